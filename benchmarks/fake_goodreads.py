@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""Local fake Goodreads serving synthetic versions of the pages ligrarian uses.
+
+The pages have just the elements, names and behaviour that ligrarian's
+Selenium steps and HTTP engine rely on: sign in, the home page search box,
+search results, the editions page's format filter, the book page (with top
+shelves, star rating and shelving menu) and the review edit form.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import urllib.parse
+
+SESSION_COOKIE = 'session_id=benchmark'
+BOOK_PATH = '/book/show/4799.Cannery_Row'
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta name="csrf-token" content="benchmark-token">
+<title>{title}</title></head><body>
+{header}
+<form action="/search" method="get">
+<input class="searchBox__input" name="q"><input type="submit" value="Search">
+</form>
+{body}
+</body></html>
+"""
+
+SIGN_IN = """
+<form action="/user/sign_in" method="post">
+<input name="user[email]"><input name="user[password]" type="password">
+<input type="submit" value="Sign in">
+</form>
+"""
+
+SEARCH_RESULTS = """
+<a class="bookTitle" href="{book}">Cannery Row</a>
+<a href="/work/editions/4799">43 editions</a>
+"""
+
+EDITIONS = """
+<form action="/work/editions/4799" method="get">
+<select name="filter_by_format" onchange="this.form.submit()">
+  <option value="">All formats</option>
+  <option>ebook</option><option>Hardcover</option>
+  <option>Kindle Edition</option><option>Paperback</option>
+</select>
+</form>
+<a class="bookTitle" href="{book}">Cannery Row</a>
+"""
+
+BOOK = """
+<h1 id="bookTitle">
+  Cannery Row
+  <a href="/series/1">
+    (Cannery Row #1)
+  </a>
+</h1>
+<a class="authorName" href="/author/show/585"><span>John Steinbeck</span></a>
+<span itemprop="numberOfPages">181 pages</span>
+<div class="wtrRight wtrUp"></div>
+{stars}
+<button class="wtrShelfButton" onclick="toggleShelves()">Shelve</button>
+<div class="wtrShelfList" style="display: none">
+  <input class="wtrShelfSearchField">
+</div>
+<script>
+function toggleShelves() {{
+  const list = document.querySelector('.wtrShelfList');
+  list.style.display = list.style.display === 'none' ? 'block' : 'none';
+}}
+</script>
+<div class="rightContainer">{shelves}</div>
+{padding}
+"""
+
+STAR = '<a class="star off" href="#" onclick="return false">{} of 5 stars</a>'
+SHELVES = ('Classics', 'Fiction', 'Literature', 'Historical Fiction',
+           'American', 'Novels')
+SHELF = '<a class="actionLinkLite bookPageGenreLink" href="#">{}</a>'
+FILLER = ('<div class="review"><p>A review of <b>Cannery Row</b> that '
+          'says a good deal about it.</p><a href="#">Like</a></div>\n')
+
+REVIEW_EDIT = """
+<form action="/review/update/4799" method="post">
+<input type="hidden" name="authenticity_token" value="benchmark-token">
+<div id="readingSessionEntry55">
+<select name="readingSessionDatePicker55[end][year]">{years}</select>
+<select name="readingSessionDatePicker55[end][month]">{months}</select>
+<select name="readingSessionDatePicker55[end][day]">{days}</select>
+</div>
+<textarea name="review[review]"></textarea>
+<input type="submit" name="next" value="Save">
+</form>
+"""
+
+
+def options(values, text=str):
+    """Return select options for values, with text as each option's text."""
+    return '<option value=""></option>' + ''.join(
+        '<option value="{}">{}</option>'.format(value, text(value))
+        for value in values)
+
+
+def book_page(padding=0):
+    """Return the book page with padding filler reviews to grow its size."""
+    body = BOOK.format(
+        stars=''.join(STAR.format(stars) for stars in range(1, 6)),
+        shelves=''.join(SHELF.format(shelf) for shelf in SHELVES),
+        padding=FILLER * padding,
+    )
+    return page('Cannery Row', body)
+
+
+def page(title, body, logged_in=True):
+    """Return a full page with the site header and search box."""
+    header = ('<div class="siteHeader__personal">Profile</div>'
+              if logged_in else '')
+    return PAGE.format(title=title, header=header, body=body)
+
+
+class FakeGoodreads(BaseHTTPRequestHandler):
+    """Request handler serving the fake Goodreads pages.
+
+    The book is always unshelved so every run takes the same steps.
+    """
+
+    padding = 0
+
+    def logged_in(self):
+        """Return whether the request has the session cookie."""
+        return SESSION_COOKIE in self.headers.get('Cookie', '')
+
+    def do_GET(self):
+        """Serve the page at the requested path."""
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/':
+            self.respond(page('Home', '', self.logged_in()))
+        elif path == '/user/sign_in':
+            self.respond(page('Sign in', SIGN_IN, False))
+        elif path == '/search':
+            self.respond(page('Search', SEARCH_RESULTS.format(
+                book=BOOK_PATH)))
+        elif path == '/work/editions/4799':
+            self.respond(page('Editions', EDITIONS.format(book=BOOK_PATH)))
+        elif path == BOOK_PATH:
+            self.respond(book_page(self.padding))
+        elif path == '/review/edit/4799.Cannery_Row':
+            if not self.logged_in():
+                self.redirect('/user/sign_in')
+                return
+            self.respond(page('Edit review', REVIEW_EDIT.format(
+                years=options(range(2000, 2031)),
+                months=options(range(1, 13)),
+                days=options(range(1, 32)),
+            )))
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        """Accept sign in, review and shelving forms."""
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/user/sign_in':
+            self.redirect('/', cookie=SESSION_COOKIE)
+        elif path == '/review/update/4799':
+            self.redirect(BOOK_PATH)
+        elif path == '/shelf/add_to_shelf':
+            self.respond('')
+        else:
+            self.send_error(404)
+
+    def respond(self, html):
+        """Send a 200 response of html."""
+        body = html.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def redirect(self, location, cookie=None):
+        """Send a redirect to location, optionally setting a cookie."""
+        self.send_response(302)
+        self.send_header('Location', location)
+        if cookie:
+            self.send_header('Set-Cookie', cookie + '; Path=/')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        """Keep benchmark output quiet."""
+
+
+def start_server(padding=0):
+    """Start the fake Goodreads in a background thread.
+
+    Args:
+        padding (int): Number of filler reviews on the book page.
+
+    Returns:
+        Tuple of the server and its base URL.
+
+    """
+    handler = type('FakeGoodreads', (FakeGoodreads,), {'padding': padding})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
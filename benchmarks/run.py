@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+"""Offline benchmarks of ligrarian against a local fake Goodreads.
+
+Times parsing book pages of increasing size, the full main() flow with the
+HTTP engine and, when Firefox and geckodriver are installed, the full flow
+with headless Firefox along with each of its goodreads_* steps.
+
+Usage:
+    python3 benchmarks/run.py [--runs N] [--no-browser] [--trace file]
+"""
+
+import argparse
+import configparser
+import contextlib
+import gc
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import bs4
+
+from fake_goodreads import BOOK_PATH, SESSION_COOKIE, book_page, start_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ligrarian  # noqa: E402
+
+# Filler reviews giving book pages of roughly 10KB, 100KB and 1MB
+PAGE_PADDINGS = (75, 800, 8000)
+
+
+def timed(function, runs):
+    """Call function runs times, returning the time of each call."""
+    gc.collect()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name, times):
+    """Print the median, fastest and slowest of times."""
+    print('{:<40}{:>6}{:>12.1f}{:>12.1f}{:>12.1f}'.format(
+        name, len(times), statistics.median(times) * 1000,
+        min(times) * 1000, max(times) * 1000))
+
+
+def print_header(title):
+    """Print a section title and the report column headings."""
+    print('\n' + title)
+    print('{:<40}{:>6}{:>12}{:>12}{:>12}'.format(
+        'Benchmark', 'Runs', 'Median ms', 'Min ms', 'Max ms'))
+
+
+def bench_parsing(runs):
+    """Time parsing book pages of each size, fetched and already loaded."""
+    print_header('Parsing book pages with {}'.format(
+        ligrarian.fast_parser()))
+    ligrarian.configure_http({})
+    ligrarian.configure_caches({'cache': ''})
+    for padding in PAGE_PADDINGS:
+        html = book_page(padding)
+        size = '{}KB'.format(len(html.encode('utf-8')) // 1024)
+        server, base_url = start_server(padding)
+        try:
+            report('parse_page fetch ' + size, timed(
+                lambda: ligrarian.parse_page(base_url + BOOK_PATH), runs))
+        finally:
+            server.shutdown()
+            server.server_close()
+        report('parse_book_html ' + size, timed(
+            lambda: ligrarian.parse_book_html(html), runs))
+        report('full html.parser parse ' + size, timed(
+            lambda: ligrarian.book_info_from_soup(
+                bs4.BeautifulSoup(html, 'html.parser')), runs))
+
+
+def write_settings(engine, headless=True):
+    """Write a settings.ini for benchmarking in the current directory."""
+    config = configparser.ConfigParser()
+    config['user'] = {'email': 'reader@example.com',
+                      'password': 'benchmark'}
+    config['settings'] = {'prompt': 'False',
+                          'path': './Ligrarian.xlsx',
+                          'headless': str(headless),
+                          'session': './session.json',
+                          'cache': '',
+                          'history': '',
+                          'engine': engine,
+                          'socket': '',
+                          'journal': ''}
+    config['defaults'] = {'format': 'Paperback',
+                          'rating': '3'}
+    with open('settings.ini', 'w') as configfile:
+        config.write(configfile)
+
+
+def run_main(argv):
+    """Run ligrarian's main() with argv, hiding its output."""
+    sys.argv = ['ligrarian.py'] + argv
+    with contextlib.redirect_stdout(io.StringIO()):
+        ligrarian.main()
+
+
+@contextlib.contextmanager
+def work_directory():
+    """Run the body in a temporary copy of the spreadsheet's directory."""
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp(prefix='ligrarian-bench-')
+    shutil.copy(os.path.join(ROOT, 'Ligrarian.xlsx'), directory)
+    os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
+def bench_http_engine(base_url, runs):
+    """Time the full main() flow using the HTTP engine."""
+    print_header('Full run with the HTTP engine')
+    name, value = SESSION_COOKIE.split('=')
+    with work_directory():
+        write_settings('http')
+        with open('session.json', 'w') as session_file:
+            json.dump([{'name': name, 'value': value, 'path': '/'}],
+                      session_file)
+        report('main url', timed(lambda: run_main(
+            ['url', base_url + BOOK_PATH, 't', '4', 'Great.']), runs))
+
+
+def firefox_available():
+    """Return whether headless Firefox can be started.
+
+    The probe runs in a work directory so geckodriver.log isn't left behind.
+    """
+    try:
+        with work_directory(), contextlib.redirect_stdout(io.StringIO()):
+            ligrarian.create_driver(True).quit()
+    except Exception as error:
+        print('\nSkipping browser benchmarks, Firefox could not be started: '
+              '{}'.format(str(error).strip().splitlines()[0]))
+        return False
+    return True
+
+
+def bench_browser(base_url, runs):
+    """Time the full main() flow and its steps with headless Firefox.
+
+    The first run signs in, later ones restore the saved session, so the
+    first is reported separately.
+    """
+    print_header('Full run with headless Firefox')
+    profiler = ligrarian.start_profiling()
+    with work_directory():
+        write_settings('browser')
+        for mode, argv in (
+                ('url', ['url', base_url + BOOK_PATH, 't', '4', 'Great.']),
+                ('search', ['search', 'Cannery Row', 'p', 't', '5', '',
+                            '--refresh'])):
+            times = timed(lambda: run_main(argv), runs + 1)
+            if mode == 'url':
+                report('main url (signing in)', times[:1])
+                times = times[1:]
+            report('main ' + mode, times)
+    print('\nSteps')
+    print(profiler.summary())
+    return profiler
+
+
+def parse_arguments():
+    """Parse the benchmark options."""
+    parser = argparse.ArgumentParser(description=(
+        'Benchmark ligrarian against a local fake Goodreads.'))
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of times to run each benchmark')
+    parser.add_argument('--no-browser', action='store_true',
+                        help='Skip the headless Firefox benchmarks')
+    parser.add_argument('--trace', metavar='file',
+                        help=('Write a Chrome trace of the browser runs '
+                              'to file'))
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmarks and print their timings."""
+    args = parse_arguments()
+    bench_parsing(args.runs)
+
+    server, base_url = start_server()
+    ligrarian.GOODREADS_URL = base_url
+    try:
+        bench_http_engine(base_url, args.runs)
+        if not args.no_browser and firefox_available():
+            profiler = bench_browser(base_url, args.runs)
+            if args.trace:
+                profiler.write_trace(args.trace)
+                print('\nTrace written to {}.'.format(args.trace))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
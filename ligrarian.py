@@ -3,7 +3,15 @@
 """Automatically update Goodreads and local Spreadsheet with book read info.
 
 Args:
-    Three operational modes (g)ui, (s)earch or (u)rl
+    Nine operational modes (g)ui, (s)earch, (u)rl, (b)atch, (r)esume,
+    (e)xport, (en)rich, (st)ats or serve
+
+    --import-times (Optional): Before the mode, report how long each
+                               library the mode used took to import
+    --profile (Optional): Before the mode, print how long each Goodreads
+                          step and spreadsheet function took
+    --trace (Optional): Before the mode, the path of a Chrome trace JSON
+                        file to write the profiled steps to
 
     gui arguments:
         None
@@ -21,27 +29,230 @@ Args:
         Read Date: (t)oday, (y)esterday or a date formatted DD/MM/YYYY
         Rating: Number between 1 and 5
         Review (Optional): Enclosed in double quotation marks
+
+    batch arguments:
+        File: Path to a .csv or .json file of books, one per row/object,
+              with url or search and format, date, rating and review keys
+
+    resume arguments:
+        --discard (Optional): Drop the unfinished jobs of interrupted runs
+                              rather than resuming them
+
+    export arguments:
+        --full (Optional): Regenerate every row of the spreadsheet from the
+                           reading history rather than only adding new ones
+
+    enrich arguments:
+        File: Path to a file of Goodreads book URLs, one per line
+        Output: Path of the .csv file to write their title, author and
+                number of pages to
+
+    stats arguments:
+        Year (Optional): Year formatted YYYY to print statistics for
+                         instead of the overall statistics
+
+    serve arguments:
+        None, keeps logged in browsers open for the url, search and gui
+        modes to send books to until stopped with Ctrl+C
 """
 
 import argparse
+import atexit
+import builtins
+import collections
 import configparser
+import contextlib
+from concurrent import futures
+import csv
 from datetime import datetime as dt
 from datetime import timedelta
+import functools
+from html import escape
+from html import unescape
+import itertools
+import json
+import os
+import queue
+import random
+import re
+import socket
+import socketserver
+import sqlite3
 import sys
-import tkinter as tk
-from tkinter import messagebox
-
-import bs4
-import openpyxl
-import requests
-from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.support.ui import WebDriverWait
+import threading
+import time
+import weakref
+from xml.etree import ElementTree
+import zipfile
+
+
+IMPORT_TIMES = collections.OrderedDict()
+# Libraries only imported by the modes that need them
+TIMED_LIBRARIES = ('bs4', 'openpyxl', 'requests', 'selenium', 'tkinter',
+                   'urllib3')
+
+
+def time_imports():
+    """Record how long each library takes the first time it's imported.
+
+    The GUI, browser, spreadsheet, parsing and HTTP libraries are imported
+    inside the functions that use them, so each mode only pays for its own.
+    Nested imports are counted in the import that triggered them.
+    """
+    original_import = builtins.__import__
+    nesting = threading.local()
+
+    def timed_import(name, *args, **kwargs):
+        if (getattr(nesting, 'depth', 0) or name in sys.modules
+                or name.split('.')[0] not in TIMED_LIBRARIES):
+            return original_import(name, *args, **kwargs)
+        nesting.depth = 1
+        start = time.perf_counter()
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            nesting.depth = 0
+            IMPORT_TIMES[name] = time.perf_counter() - start
+
+    builtins.__import__ = timed_import
+
+
+def print_import_times():
+    """Print how long each library the run used took to import."""
+    print('Import times:')
+    for module, seconds in IMPORT_TIMES.items():
+        print('{:<48}{:>8.1f}ms'.format(module, seconds * 1000))
+    print('{:<48}{:>8.1f}ms'.format('Total',
+                                    sum(IMPORT_TIMES.values()) * 1000))
+
+
+class Profiler:
+    """Records timed spans of a run for a summary table and a trace file.
+
+    Spans from every thread are kept, each with its start relative to the
+    start of profiling so they can be exported in Chrome's trace format.
+    """
+
+    def __init__(self):
+        """Profiler constructor, starting the clock."""
+        self.started = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Time the body of a with statement as a span called name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.spans.append((name, start - self.started, end - start,
+                                   threading.get_ident()))
+
+    def summary(self):
+        """Return a table of calls and times per span name, slowest first."""
+        totals = collections.OrderedDict()
+        for name, _, duration, _ in self.spans:
+            totals.setdefault(name, []).append(duration)
+
+        lines = ['{:<32}{:>7}{:>12}{:>12}{:>12}'.format(
+            'Span', 'Calls', 'Total ms', 'Mean ms', 'Max ms')]
+        for name, durations in sorted(totals.items(),
+                                      key=lambda item: -sum(item[1])):
+            lines.append('{:<32}{:>7}{:>12.1f}{:>12.1f}{:>12.1f}'.format(
+                name, len(durations), sum(durations) * 1000,
+                sum(durations) / len(durations) * 1000,
+                max(durations) * 1000))
+        return '\n'.join(lines)
+
+    def write_trace(self, path):
+        """Write the spans as a Chrome trace (chrome://tracing, Perfetto).
+
+        Args:
+            path (str): Path of the JSON file to write.
+
+        """
+        threads = {}
+        events = []
+        for name, start, duration, thread in self.spans:
+            events.append({
+                'name': name, 'cat': 'ligrarian', 'ph': 'X',
+                'ts': round(start * 1e6), 'dur': round(duration * 1e6),
+                'pid': os.getpid(),
+                'tid': threads.setdefault(thread, len(threads) + 1),
+            })
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                      trace_file)
+
+
+# Browser steps and spreadsheet functions timed when profiling
+PROFILED_FUNCTIONS = (
+    'create_driver', 'goodreads_login', 'goodreads_restore_session',
+    'goodreads_save_session', 'goodreads_start_session', 'goodreads_find',
+    'goodreads_filter', 'goodreads_get_shelves',
+    'goodreads_get_shelved_status', 'goodreads_date_input',
+    'goodreads_add_review', 'goodreads_rate_book', 'goodreads_shelve',
+    'goodreads_update', 'http_update', 'parse_page', 'parse_pages',
+    'parse_book_html', 'category_and_genre', 'check_year_sheet_exists',
+    'ensure_year_sheet', 'create_sheet', 'create_template_sheet',
+    'input_info', 'input_infos', 'write_records', 'append_rows_xlsx',
+    'open_history', 'save_records', 'export_history', 'prepare_spreadsheet',
+)
+
+_profiler = None
+
+
+def span(name):
+    """Return a context manager timing its body when profiling is on."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.span(name)
+
+
+def profiled(function):
+    """Wrap function so that each call is timed as a span of its name."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with span(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def start_profiling():
+    """Start recording spans, timing each of PROFILED_FUNCTIONS.
+
+    The functions are only wrapped once profiling starts so that normal runs
+    don't pay for timing them.
+
+    Returns:
+        The Profiler recording the spans.
+
+    """
+    global _profiler
+    _profiler = Profiler()
+    module = globals()
+    for name in PROFILED_FUNCTIONS:
+        if not hasattr(module[name], '__wrapped__'):
+            module[name] = profiled(module[name])
+    return _profiler
+
+
+def report_profile(profiler, trace_path=None):
+    """Print the profile summary and write the trace file if one is given.
+
+    Args:
+        profiler (obj): Profiler from start_profiling.
+        trace_path (str): Path to write a Chrome trace to, or None.
+
+    """
+    print('Profile:')
+    print(profiler.summary())
+    if trace_path:
+        profiler.write_trace(trace_path)
+        print('Trace written to {}.'.format(trace_path))
 
 
 class Gui:
@@ -54,6 +265,8 @@ class Gui:
             master (obj): tkinter TK object - base object for the GUI.
 
         """
+        import tkinter as tk
+
         self.master = master
         self.master.title("Ligrarian")
         self.master.geometry('665x560')
@@ -178,6 +391,8 @@ class Gui:
 
     def parse_input(self):
         """Create input dictionary and test required info has been given."""
+        from tkinter import messagebox
+
         self.mode = self.mode.get()
         self.settings['email'] = self.email.get()
 
@@ -229,6 +444,8 @@ def retrieve_settings():
 
 def create_gui(settings_dict):
     """Create GUI instance and return it."""
+    import tkinter as tk
+
     root = tk.Tk()
     root.protocol("WM_DELETE_WINDOW", exit)
     gui = Gui(root, settings_dict)
@@ -268,6 +485,23 @@ def get_date_str(yesterday=False):
     return dt.strftime(today_datetime, '%d/%m/%Y')
 
 
+def process_date(date):
+    """Convert a (t)oday or (y)esterday date argument into DD/MM/YYYY.
+
+    Args:
+        date (str): (t)oday, (y)esterday or a date formatted DD/MM/YYYY.
+
+    Returns:
+        Date formatted DD/MM/YYYY.
+
+    """
+    if date.lower() == 't':
+        return get_date_str()
+    if date.lower() == 'y':
+        return get_date_str(True)
+    return date
+
+
 def parse_arguments():
     """Set up parsers/subparsers and parse command line arguments.
 
@@ -276,7 +510,17 @@ def parse_arguments():
 
     """
     parser = argparse.ArgumentParser(description="Goodreads updater")
-    subparsers = parser.add_subparsers(help="Choose (u)rl, (s)earch or (g)ui")
+    parser.add_argument('--import-times', action='store_true',
+                        help="Report how long each library took to import")
+    parser.add_argument('--profile', action='store_true',
+                        help="Print how long each step of the run took")
+    parser.add_argument('--trace', metavar='file',
+                        help="Profile the run and write a Chrome trace of "
+                             "its steps to file")
+    subparsers = parser.add_subparsers(
+        help="Choose (u)rl, (s)earch, (b)atch, (r)esume, (e)xport, (en)rich, "
+             "(st)ats, serve or (g)ui"
+    )
 
     url_parser = subparsers.add_parser("url", aliases=['u'])
     url_parser.add_argument('url', metavar="url",
@@ -304,6 +548,46 @@ def parse_arguments():
                                help="A number 1 through 5")
     search_parser.add_argument('review', nargs='?', metavar="'review'",
                                help="Review enclosed in quotes")
+    search_parser.add_argument('--refresh', action='store_true',
+                               help="Search Goodreads again rather than "
+                                    "using the cached edition")
+
+    batch_parser = subparsers.add_parser('batch', aliases=['b'])
+    batch_parser.add_argument('batch', metavar='file',
+                              help="Path to a .csv or .json file of books "
+                                   "with url or search and format, date, "
+                                   "rating and review fields")
+    batch_parser.add_argument('--refresh', action='store_true',
+                              help="Search Goodreads again rather than "
+                                   "using cached editions")
+
+    export_parser = subparsers.add_parser('export', aliases=['e'])
+    export_parser.set_defaults(export=True)
+    export_parser.add_argument('--full', action='store_true',
+                               help="Regenerate every spreadsheet row from "
+                                    "the reading history")
+
+    enrich_parser = subparsers.add_parser('enrich', aliases=['en'])
+    enrich_parser.add_argument('enrich', metavar='file',
+                               help="Path to a file of Goodreads book URLs, "
+                                    "one per line")
+    enrich_parser.add_argument('output', help="Path of the .csv file to "
+                                              "write book details to")
+
+    stats_parser = subparsers.add_parser('stats', aliases=['st'])
+    stats_parser.add_argument('stats', nargs='?', metavar='year',
+                              default='Overall',
+                              help="Year formatted YYYY (defaults to all "
+                                   "years)")
+
+    resume_parser = subparsers.add_parser('resume', aliases=['r'])
+    resume_parser.set_defaults(resume=True)
+    resume_parser.add_argument('--discard', action='store_true',
+                               help="Drop unfinished jobs instead of "
+                                    "resuming them")
+
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.set_defaults(serve=True)
 
     gui = subparsers.add_parser("gui", aliases=['g'])
     gui.add_argument('gui', action='store_true',
@@ -313,12 +597,54 @@ def parse_arguments():
     return vars(args)
 
 
+def read_batch_file(path):
+    """Read and validate the book details stored in a batch file.
+
+    CSV files need a header row naming the columns; JSON files must contain
+    a list of objects. Either way each book has either a 'url' or a 'search'
+    and 'format', plus a 'date', a 'rating' and an optional 'review'.
+
+    Args:
+        path (str): Path to a .csv or .json batch file.
+
+    Returns:
+        List of book details dictionaries in the format main() expects.
+
+    """
+    with open(path, newline='') as batch_file:
+        if path.lower().endswith('.json'):
+            rows = json.load(batch_file)
+        else:
+            rows = list(csv.DictReader(batch_file))
+
+    books = []
+    for number, row in enumerate(rows, 1):
+        details = {key: str(value).strip() for key, value in row.items()
+                   if value not in (None, '')}
+        has_target = 'url' in details or ('search' in details
+                                          and 'format' in details)
+        valid_rating = details.get('rating') in ['1', '2', '3', '4', '5']
+        if not has_target or 'date' not in details or not valid_rating:
+            print("Batch entry {} is missing a url (or search and format), "
+                  "date or rating between 1 and 5.".format(number))
+            sys.exit()
+
+        details['date'] = process_date(details['date'])
+        details.setdefault('review', None)
+        books.append(details)
+
+    return books
+
+
 def create_driver(run_headless):
     """Create the appropriate driver for the session.
 
     Args:
         run_headless (bool): Run in headless mode or not
     """
+    from selenium import webdriver
+    from selenium.webdriver.firefox.options import Options
+
     if run_headless:
         print(('Opening a headless computer controlled browser and updating '
                'Goodreads'))
@@ -359,7 +685,25 @@ def write_initial_config():
                       'password': ''}
     config['settings'] = {'prompt': 'False',
                           'path': './Ligrarian.xlsx',
-                          'headless': 'False'}
+                          'headless': 'False',
+                          'session': './session.json',
+                          'workers': '1',
+                          'wait_timeout': '10',
+                          'http_timeout': '20',
+                          'http_retries': '3',
+                          'http_backoff': '0.5',
+                          'http_connections': '10',
+                          'cache': './cache.db',
+                          'cache_ttl': '30',
+                          'cache_size': '5000',
+                          'cache_html': 'False',
+                          'history': './history.db',
+                          'engine': 'browser',
+                          'enrich_workers': '8',
+                          'enrich_rate': '2',
+                          'socket': './ligrarian.sock',
+                          'flush_delay': '5',
+                          'journal': './journal.db'}
     config['defaults'] = {'format': 'Paperback',
                           'rating': '3'}
     with open('settings.ini', 'w') as configfile:
@@ -385,6 +729,103 @@ def write_config(email, password, prompt):
         config.write(configfile)
 
 
+WAIT_SETTINGS = {}
+
+
+def configure_waits(settings):
+    """Set the settings used for the timeouts of explicit waits.
+
+    The 'wait_timeout' setting applies to every step unless overridden by a
+    'wait_<step>' setting, e.g. wait_shelve = 20.
+
+    Args:
+        settings (dict): Dictionary of user settings.
+
+    """
+    WAIT_SETTINGS.clear()
+    WAIT_SETTINGS.update(settings)
+
+
+def step_timeout(step):
+    """Return the explicit wait timeout in seconds for the given step."""
+    default = WAIT_SETTINGS.get('wait_timeout', '10')
+    return float(WAIT_SETTINGS.get('wait_' + step, default))
+
+
+def wait_for(driver, by, value, step, condition=None):
+    """Wait until the located element meets condition and return it.
+
+    Args:
+        driver: Selenium webdriver to act upon.
+        by (str): Selenium By locator strategy.
+        value (str): Locator value.
+        step (str): Name of the step, used to find its timeout.
+        condition (func): Selenium expected condition taking a locator,
+                          defaults to presence_of_element_located.
+
+    Raises:
+        TimeoutException: Condition not met within the step's timeout.
+
+    """
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    if condition is None:
+        condition = EC.presence_of_element_located
+    return WebDriverWait(driver, step_timeout(step)).until(
+        condition((by, value))
+    )
+
+
+def element_present(driver, by, value):
+    """Return whether the located element is present, without waiting.
+
+    Args:
+        driver: Selenium webdriver to act upon.
+        by (str): Selenium By locator strategy.
+        value (str): Locator value.
+
+    """
+    return bool(driver.find_elements(by, value))
+
+
+# Scripts for dom_query that gather everything a step needs from the page
+READING_SESSION_IDS_JS = """
+return Array.from(document.querySelectorAll('[id*="readingSessionEntry"]'),
+                  element => element.id);
+"""
+SHELF_NAMES_JS = """
+const links = document.querySelectorAll('.actionLinkLite.bookPageGenreLink');
+return Array.from(links, element => element.innerText.trim());
+"""
+STARS_JS = """
+return Array.from(document.querySelectorAll('.star.off'),
+                  element => [element, element.innerText.trim()]);
+"""
+
+
+def dom_query(driver, script):
+    """Run a script gathering data from the page in a single round trip.
+
+    Reading attributes or text from elements one at a time costs a request
+    to the driver per element, whereas a script can collect them all at once.
+
+    Args:
+        driver: Selenium webdriver to act upon.
+        script (str): JavaScript returning an array of plain data (elements
+                      are returned as WebElements).
+
+    Returns:
+        List of the data returned by the script.
+
+    """
+    return driver.execute_script(script) or []
+
+
+# Base URL of Goodreads, pointed at a local fake server by the benchmarks
+GOODREADS_URL = 'https://www.goodreads.com'
+
+
 def goodreads_login(driver, email, password):
     """Login to Goodreads account from the homepage.
 
@@ -394,20 +835,87 @@ def goodreads_login(driver, email, password):
         password (str): Password to be entered.
 
     """
-    driver.get('https://goodreads.com/user/sign_in')
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
 
-    driver.find_element_by_name('user[email]').send_keys(email)
+    driver.get(GOODREADS_URL + '/user/sign_in')
+
+    wait_for(driver, By.NAME, 'user[email]', 'login').send_keys(email)
     pass_elem = driver.find_element_by_name('user[password]')
     pass_elem.send_keys(password, Keys.ENTER)
 
     try:
-        driver.find_element_by_class_name('siteHeader__personal')
-    except NoSuchElementException:
+        wait_for(driver, By.CLASS_NAME, 'siteHeader__personal', 'login')
+    except TimeoutException:
         print('Failed to login - Email and/or Password probably incorrect.')
         driver.close()
         sys.exit()
 
 
+def goodreads_restore_session(driver, path):
+    """Load saved session cookies into the driver and check they log in.
+
+    Args:
+        driver: Selenium webdriver to act upon.
+        path (str): Path to the saved session cookies.
+
+    Returns:
+        Boolean of whether the restored session is logged in.
+
+    """
+    from selenium.common.exceptions import WebDriverException
+    from selenium.webdriver.common.by import By
+
+    try:
+        with open(path) as session_file:
+            cookies = json.load(session_file)
+    except (OSError, ValueError):
+        return False
+
+    # Cookies can only be added for the domain the driver is currently on
+    driver.get(GOODREADS_URL + '/')
+    for cookie in cookies:
+        try:
+            driver.add_cookie(cookie)
+        except WebDriverException:
+            continue
+    driver.refresh()
+
+    return element_present(driver, By.CLASS_NAME, 'siteHeader__personal')
+
+
+def goodreads_save_session(driver, path):
+    """Save the driver's session cookies so later runs can skip logging in.
+
+    Args:
+        driver: Logged in Selenium webdriver.
+        path (str): Path to save the session cookies to.
+
+    """
+    with open(path, 'w') as session_file:
+        json.dump(driver.get_cookies(), session_file)
+    # The cookies are as sensitive as the password so keep them private
+    os.chmod(path, 0o600)
+
+
+def goodreads_start_session(driver, settings):
+    """Restore a saved Goodreads session, logging in if it was rejected.
+
+    Args:
+        driver: Selenium webdriver to act upon.
+        settings (dict): Dictionary of user settings.
+
+    """
+    path = settings.get('session', './session.json')
+    if path and goodreads_restore_session(driver, path):
+        return
+
+    goodreads_login(driver, settings['email'], settings['password'])
+    if path:
+        goodreads_save_session(driver, path)
+
+
 def goodreads_find(driver, terms):
     """Find the book on Goodreads and navigate to all editions page.
 
@@ -415,16 +923,19 @@ def goodreads_find(driver, terms):
         driver: Selenium webdriver to act upon.
         terms (str): Terms to be used in the Goodreads search.
 
-    Raises:
-        NoSuchElementException: Search terms yields no results.
-
     """
-    search_elem = driver.find_element_by_class_name('searchBox__input')
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support import expected_conditions as EC
+
+    search_elem = wait_for(driver, By.CLASS_NAME, 'searchBox__input', 'find')
     search_elem.send_keys(terms, Keys.ENTER)
 
     try:
-        driver.find_element_by_partial_link_text('edition').click()
-    except NoSuchElementException:
+        wait_for(driver, By.PARTIAL_LINK_TEXT, 'edition', 'find',
+                 EC.element_to_be_clickable).click()
+    except TimeoutException:
         print("Failed to find book using those search terms.")
         driver.close()
         sys.exit()
@@ -441,20 +952,27 @@ def goodreads_filter(driver, book_format):
         Current URL the driver argument is now visiting.
 
     """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
     pre_filter_url = driver.current_url
 
     # Filter by format
-    filter_elem = driver.find_element_by_name('filter_by_format')
+    filter_elem = wait_for(driver, By.NAME, 'filter_by_format', 'filter')
     filter_elem.click()
     filter_elem.send_keys(book_format, Keys.ENTER)
 
     # Make sure filtered page is loaded before clicking top book
-    WebDriverWait(driver, 10).until(
+    WebDriverWait(driver, step_timeout('filter')).until(
         EC.url_changes((pre_filter_url))
     )
 
-    # Select top book
-    driver.find_element_by_class_name('bookTitle').click()
+    # Select top book and wait for its page to load
+    wait_for(driver, By.CLASS_NAME, 'bookTitle', 'filter',
+             EC.element_to_be_clickable).click()
+    wait_for(driver, By.ID, 'bookTitle', 'filter')
 
     return driver.current_url
 
@@ -470,12 +988,10 @@ def goodreads_get_shelves(driver, rating):
         list of strings of the 'shelve' categories on the current driver page.
 
     """
-    shelves_elems = driver.find_elements_by_class_name('actionLinkLite.'
-                                                       'bookPageGenreLink')
     shelves = []
-    for shelf in shelves_elems:
-        if ' users' not in shelf.text and shelf.text not in shelves:
-            shelves.append(shelf.text)
+    for shelf in dom_query(driver, SHELF_NAMES_JS):
+        if ' users' not in shelf and shelf not in shelves:
+            shelves.append(shelf)
 
     if rating == '5':
         shelves.append('5-star-books')
@@ -496,11 +1012,9 @@ def goodreads_get_shelved_status(driver):
         Boolean
 
     """
-    try:
-        driver.find_element_by_class_name('wtrRight.wtrUp')
-        return False
-    except NoSuchElementException:
-        return True
+    from selenium.webdriver.common.by import By
+
+    return not element_present(driver, By.CLASS_NAME, 'wtrRight.wtrUp')
 
 
 def goodreads_date_input(driver, date_done, reread):
@@ -513,24 +1027,25 @@ def goodreads_date_input(driver, date_done, reread):
                               the boolean True, or None acting as False.
 
     """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import Select
+
     book_code = driver.current_url.split('/')[-1]
-    driver.get("https://www.goodreads.com/review/edit/{}".format(book_code))
+    driver.get("{}/review/edit/{}".format(GOODREADS_URL, book_code))
 
     # If it's a reread need to create new session selectors
     if reread:
-        driver.find_element_by_id('readingSessionAddLink').click()
+        wait_for(driver, By.ID, 'readingSessionAddLink', 'date',
+                 EC.element_to_be_clickable).click()
         # More details loaded for Explicit Wait
-        driver.find_element_by_class_name('smallLink.closed').click()
-        WebDriverWait(driver, 10).until(
-            EC.visibility_of_element_located((By.ID, "review_recommendation"))
-        )
+        wait_for(driver, By.CLASS_NAME, 'smallLink.closed', 'date',
+                 EC.element_to_be_clickable).click()
+        wait_for(driver, By.ID, 'review_recommendation', 'date',
+                 EC.visibility_of_element_located)
 
     # Find reading session codes from all ids then use last one for date entry
-    reread_codes = []
-    for id_elem in driver.find_elements_by_xpath('//*[@id]'):
-        id_attribute = id_elem.get_attribute('id')
-        if 'readingSessionEntry' in id_attribute:
-            reread_codes.append(id_attribute)
+    reread_codes = dom_query(driver, READING_SESSION_IDS_JS)
     new_read_code = reread_codes[-1][19:]
 
     # Date Formatting and Selection
@@ -542,7 +1057,7 @@ def goodreads_date_input(driver, date_done, reread):
     month_name = 'readingSessionDatePicker{}[end][month]'.format(new_read_code)
     day_name = 'readingSessionDatePicker{}[end][day]'.format(new_read_code)
 
-    Select(driver.find_element_by_name(year_name)
+    Select(wait_for(driver, By.NAME, year_name, 'date')
            ).select_by_visible_text(year)
 
     Select(driver.find_element_by_name(month_name)
@@ -560,7 +1075,9 @@ def goodreads_add_review(driver, review):
         review (str): Review of the book.
 
     """
-    review_elem = driver.find_element_by_name('review[review]')
+    from selenium.webdriver.common.by import By
+
+    review_elem = wait_for(driver, By.NAME, 'review[review]', 'review')
     review_elem.clear()
     review_elem.click()
     review_elem.send_keys(review)
@@ -574,10 +1091,13 @@ def goodreads_rate_book(driver, rating):
         rating (str): A number 1-5.
 
     """
-    # Give star rating
-    stars_elem = driver.find_elements_by_class_name('star.off')
-    for stars in stars_elem:
-        if stars.text.strip() == '{} of 5 stars'.format(rating):
+    from selenium.webdriver.common.by import By
+
+    # Wait for the rating widget, which has no unfilled stars when the book
+    # is already rated 5
+    wait_for(driver, By.CLASS_NAME, 'star', 'rate')
+    for stars, text in dom_query(driver, STARS_JS):
+        if text == '{} of 5 stars'.format(rating):
             stars.click()
             break
 
@@ -593,15 +1113,20 @@ def goodreads_shelve(driver, shelves):
         shelves (list): List of strings representing Goodreads shelves.
 
     """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support import expected_conditions as EC
+
     # Wait until review box is invisible
-    WebDriverWait(driver, 10).until(
-        EC.invisibility_of_element_located((By.ID, "box"))
-    )
+    wait_for(driver, By.ID, 'box', 'shelve',
+             EC.invisibility_of_element_located)
 
     # Select shelves
-    menu_elem = driver.find_element_by_class_name('wtrShelfButton')
+    menu_elem = wait_for(driver, By.CLASS_NAME, 'wtrShelfButton', 'shelve',
+                         EC.element_to_be_clickable)
     menu_elem.click()
-    shelf_elem = driver.find_element_by_class_name('wtrShelfSearchField')
+    shelf_elem = wait_for(driver, By.CLASS_NAME, 'wtrShelfSearchField',
+                          'shelve', EC.visibility_of_element_located)
 
     for shelf in shelves:
         shelf_elem.send_keys(shelf, Keys.ENTER)
@@ -609,209 +1134,2682 @@ def goodreads_shelve(driver, shelves):
 
     # Close dropdown and wait until it disappears
     menu_elem.click()
-    WebDriverWait(driver, 10).until(
-        EC.invisibility_of_element_located((By.CLASS_NAME, "wtrShelfList"))
-    )
+    wait_for(driver, By.CLASS_NAME, 'wtrShelfList', 'shelve',
+             EC.invisibility_of_element_located)
 
 
-def parse_page(url):
-    """Parse Goodreads page for title, author and number of pages.
+def goodreads_update(driver, details, on_page=None):
+    """Mark a single book as read on Goodreads using a logged in driver.
+
+    Searches are looked up in the resolution cache before using the driver,
+    unless details has a true 'refresh' value, and are recorded there once
+    resolved. Books with a journal job checkpoint each step and skip the
+    steps that an earlier, interrupted run completed.
 
     Args:
-        url (str): Goodreads Book URL.
+        driver: Logged in Selenium webdriver to act upon.
+        details (dict): Book details with either a 'url' or a 'search' and
+                        'format' plus 'date', 'rating' and 'review'.
+        on_page (func): Called with the book's URL, shelves and page source
+                        as soon as the book page has been read, before the
+                        remaining steps.
 
     Returns:
-        Dictionary of parsed Title, Author and Number of Pages.
+        Tuple of the book's Goodreads URL, its list of shelves and the page
+        source of the book page for parse_page, or None in place of the
+        page source if an earlier run read the page.
 
     """
-    info = {}
-    res = requests.get(url)
-    res.raise_for_status()
-    soup = bs4.BeautifulSoup(res.text, 'html.parser')
-
-    title_elem = soup.select('#bookTitle')
-    rough_title = title_elem[0].getText().strip().split('\n')
-    if len(rough_title) == 1:
-        info['title'] = rough_title[0].strip()
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    steps = journal_steps(details)
+    if 'page' in steps:
+        url = steps['page']['url']
+        shelves = steps['page']['shelves']
+        page_source = None
+        shelved_status = steps['page']['shelved_status']
     else:
-        info['title'] = rough_title[0].strip() + ' ' + rough_title[2].strip()
+        cache = _resolution_cache
+        url = details.get('url')
+        if not url and cache:
+            if details.get('refresh'):
+                cache.forget(details['search'], details['format'])
+            else:
+                url = cache.lookup(details['search'], details['format'])
+
+        if url:
+            driver.get(url)
+        else:
+            goodreads_find(driver, details['search'])
+            url = goodreads_filter(driver, details['format'])
+            if cache:
+                cache.store(details['search'], details['format'], url)
 
-    info['author'] = soup.select('.authorName')[0].getText().strip()
+        shelves = goodreads_get_shelves(driver, details['rating'])
+        page_source = driver.page_source
 
-    pages_elem = soup.findAll('span', attrs={'itemprop': 'numberOfPages'})
-    info['pages'] = int(pages_elem[0].getText().strip(' pages'))
+        shelved_status = goodreads_get_shelved_status(driver)
+        journal_checkpoint(details, 'page', url=url, shelves=shelves,
+                           shelved_status=shelved_status)
 
-    return info
+    if on_page:
+        on_page(url, shelves, page_source)
 
+    if 'review' not in steps:
+        if 'page' in steps:
+            driver.get(url)
+        goodreads_date_input(driver, details['date'], shelved_status)
 
-def category_and_genre(shelves):
-    """Use shelves list to deterime genre and categorise as Fiction/Nonfiction.
+        if details['review']:
+            goodreads_add_review(driver, details['review'])
 
-    Args:
-        shelves (list): List of strings of Goodreads shelf categories.
+        wait_for(driver, By.NAME, 'next', 'review',
+                 EC.element_to_be_clickable).click()
+        journal_checkpoint(details, 'review')
 
-    Returns:
-        Tuple of category (Fiction/Nonfiction) and the books genre.
+    if 'rate' not in steps:
+        driver.get(url)
+        goodreads_rate_book(driver, details['rating'])
+        journal_checkpoint(details, 'rate')
+    elif not shelved_status and 'shelve' not in steps:
+        driver.get(url)
 
-    """
-    if 'Nonfiction' in shelves:
-        category = 'Nonfiction'
-    else:
-        category = 'Fiction'
+    if not shelved_status and 'shelve' not in steps:
+        goodreads_shelve(driver, shelves)
+        journal_checkpoint(details, 'shelve')
 
-    for shelf in shelves:
-        if shelf != category:
-            genre = shelf
-            break
+    return (url, shelves, page_source)
 
-    return (category, genre)
 
+# Lets the first pool worker log in and save the session for the others
+SESSION_LOCK = threading.Lock()
 
-def check_year_sheet_exists(path, year_sheet):
-    """Check year_sheet exists in path workbook, call create if not.
 
-    Args:
-        path (str): Path to spreadsheet to check
-        year_sheet (str): The year the book was read formatted YYYY.
+def quit_driver(driver):
+    """Quit a driver and its geckodriver process, even if already closed."""
+    from selenium.common.exceptions import WebDriverException
+
+    try:
+        driver.quit()
+    except WebDriverException:
+        pass
 
-    Return:
-        workbook (obj): openpyxl workbook object.
 
+def start_worker_driver(settings):
+    """Create a driver and log it in, one worker at a time."""
+    driver = create_driver(settings['headless'])
+    try:
+        with SESSION_LOCK:
+            goodreads_start_session(driver, settings)
+    except SystemExit:
+        quit_driver(driver)
+        raise
+    return driver
+
+
+def goodreads_worker(settings, jobs, results, keep_alive=False):
+    """Update Goodreads for queued books using one logged in driver.
+
+    Each job is a (number, details) tuple and each finished job is put on
+    results as (number, details, update) where update is the tuple returned
+    by goodreads_update, or with None in place of
+    the tuple if the book failed. A step that closes the driver, such as a
+    failed search, only fails its own book and the driver is replaced for
+    the next one. None is put on results once the worker has stopped,
+    whether because jobs is empty or because logging in failed.
+
+    The driver is only started once a book needs it, so resumed jobs whose
+    Goodreads steps are all done don't start a browser, and with the
+    'engine' setting as 'http' books are updated by http_update where
+    possible. Resident (keep_alive) workers log in before the first job.
+
+    Args:
+        settings (dict): Dictionary of user settings.
+        jobs (obj): queue.Queue of (number, details) tuples.
+        results (obj): queue.Queue to put finished jobs on.
+        keep_alive (bool): Wait for more jobs rather than stopping when jobs
+                           is empty, until a None job is taken.
+
+    """
+    driver = None
+    http_session = None
+    if settings.get('engine') == 'http':
+        http_session = http_start_session(settings)
+    try:
+        if keep_alive and http_session is None:
+            driver = start_worker_driver(settings)
+
+        while True:
+            try:
+                job = jobs.get(block=keep_alive)
+            except queue.Empty:
+                break
+            if job is None:
+                break
+            number, details = job
+
+            try:
+                update = None
+                if goodreads_steps_pending(details):
+                    update = http_try_update(http_session, details)
+                    if update is None and driver is None:
+                        try:
+                            driver = start_worker_driver(settings)
+                        except SystemExit:
+                            # Logging in failed so the book can't be done
+                            results.put((number, details, None))
+                            if keep_alive:
+                                continue
+                            break
+                if update is None:
+                    update = goodreads_update(driver, details)
+                results.put((number, details, update))
+            except SystemExit:
+                # The driver's window has been closed so start a new one
+                results.put((number, details, None))
+                if driver:
+                    quit_driver(driver)
+                driver = None
+            except Exception as error:
+                print('Failed to update book {}: {}'.format(number, error))
+                results.put((number, details, None))
+
+    except SystemExit:
+        # Logging in failed and start_worker_driver quit the driver
+        pass
+    finally:
+        if driver:
+            quit_driver(driver)
+        results.put(None)
+
+
+class JobJournal:
+    """Persistent SQLite journal of book jobs and their completed steps.
+
+    A job stays pending until its spreadsheet row has been saved, so a run
+    that stops partway through can be resumed without repeating the
+    Goodreads steps it already completed.
     """
-    workbook = openpyxl.load_workbook(path)
 
-    existing_sheets = workbook.sheetnames
-    if year_sheet not in existing_sheets:
-        create_sheet(workbook, existing_sheets[-1], year_sheet)
+    def __init__(self, path):
+        """JobJournal constructor to open (and create) the database.
 
-    return workbook
+        Args:
+            path (str): Path to the SQLite journal database.
 
+        """
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, '
+                "details TEXT, steps TEXT DEFAULT '{}', "
+                'finished INTEGER DEFAULT 0, created REAL)'
+            )
 
-def create_sheet(workbook, sheet_to_copy, new_sheet_name):
-    """Create a new sheet by copying and modifying a different one.
+    def add(self, details):
+        """Record a new job and return its id."""
+        details = {key: value for key, value in details.items()
+                   if key != 'job'}
+        with self.lock, self.connection:
+            return self.connection.execute(
+                'INSERT INTO jobs (details, created) VALUES (?, ?)',
+                (json.dumps(details), time.time())
+            ).lastrowid
+
+    def steps(self, job):
+        """Return a dictionary of the job's completed step: step data."""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT steps FROM jobs WHERE id = ?', (job,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def checkpoint(self, job, step, data):
+        """Record that a step of the job completed, with data to resume."""
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                'SELECT steps FROM jobs WHERE id = ?', (job,)).fetchone()
+            steps = json.loads(row[0]) if row else {}
+            steps[step] = data
+            self.connection.execute(
+                'UPDATE jobs SET steps = ? WHERE id = ?',
+                (json.dumps(steps), job)
+            )
 
-    Args:
-        workbook (obj): openpyxl workbook object.
-        sheet_to_copy (str): Name of the sheet to copy.
-        new_sheet_name (str): Name (year formatted YYYY) to name new sheet.
+    def pending(self):
+        """Return the details of unfinished jobs, oldest first."""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT id, details FROM jobs WHERE finished = 0 ORDER BY id'
+            ).fetchall()
+        return [dict(json.loads(details), job=job) for job, details in rows]
+
+    def finish(self, jobs):
+        """Mark jobs as finished so they aren't resumed, dropping steps."""
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE jobs SET finished = 1, steps = '{}' WHERE id = ?",
+                [(job,) for job in jobs]
+            )
 
-    """
-    sheet = workbook.copy_worksheet(workbook[sheet_to_copy])
-    sheet.title = new_sheet_name
-    last_row = first_blank_row(sheet)
-    while last_row > 1:
-        for col in range(1, 7):
-            sheet.cell(row=last_row, column=col).value = None
-        last_row -= 1
-    day_tracker = '=(TODAY()-DATE({},1,1))/7'.format(new_sheet_name)
-    sheet.cell(row=5, column=9).value = day_tracker
 
+_journal = None
 
-def input_info(workbook, info, date, path):
-    """Write the book information to the first blank row on the given sheet.
+
+def configure_journal(settings):
+    """Open the job journal, or disable it if no path is set.
 
     Args:
-        workbook (obj): openpyxl workbook object.
-        info (dict): Information about the book.
-        date (str): Date to input in the 'Read date' column.
-        path (str): Path to spreadsheet.
+        settings (dict): Dictionary of user settings.
 
     """
-    for sheet in [date[-4:], 'Overall']:
-        sheet = workbook[sheet]
+    global _journal
+    path = settings.get('journal', './journal.db')
+    _journal = JobJournal(path) if path else None
 
-        input_row = first_blank_row(sheet)
 
-        values_to_write = [
-                info['title'], info['author'],
-                info['pages'], info['category'],
-                info['genre'], date
-        ]
-        for number, value in enumerate(values_to_write, 1):
-            sheet.cell(row=input_row, column=number).value = value
+def journal_job(details):
+    """Add a book to the journal, storing its job id in details."""
+    if _journal and 'job' not in details:
+        details['job'] = _journal.add(details)
 
-    workbook.save(path)
 
+def journal_steps(details):
+    """Return the completed steps of a book's job, empty if not journaled."""
+    if _journal and details.get('job'):
+        return _journal.steps(details['job'])
+    return {}
 
-def first_blank_row(sheet):
-    """Return the number of the first blank row of the given sheet.
 
-    Args:
-        sheet (obj): openpyxl sheet object to find first blank row of.
+def journal_checkpoint(details, step, **data):
+    """Record that a step of a book's job completed, if it's journaled."""
+    if _journal and details.get('job'):
+        _journal.checkpoint(details['job'], step, data)
 
-    """
-    input_row = 0
-    while True:
-        input_row += 1
-        if not sheet.cell(row=input_row, column=1).value:
-            break
-    return input_row
 
+def journal_finish(details_list):
+    """Mark the jobs of books whose rows have been saved as finished."""
+    jobs = [details['job'] for details in details_list
+            if details.get('job')]
+    if _journal and jobs:
+        _journal.finish(jobs)
 
-def main():
-    """Coordinate updating of Goodreads account and writing to spreadsheet."""
-    args = parse_arguments()
-    try:
-        open("settings.ini")
-    except FileNotFoundError:
-        write_initial_config()
 
-    settings = retrieve_settings()
+def goodreads_steps_pending(details):
+    """Return whether a book still has Goodreads steps to be done.
 
-    if 'gui' in args:
-        gui_instance = create_gui(settings)
-        details = gui_mode_details_edits(gui_instance)
+    Only a resumed job can have done them all, and goodreads_update then
+    needs no driver to return its update.
+    """
+    steps = journal_steps(details)
+    if not {'page', 'review', 'rate'} <= set(steps):
+        return True
+    return not steps['page']['shelved_status'] and 'shelve' not in steps
+
+
+HTTP_SETTINGS = {}
+HTTP_SESSION_LOCK = threading.Lock()
+_http_session = None
+
+
+def configure_http(settings):
+    """Set the settings used to create the shared HTTP session.
+
+    Args:
+        settings (dict): Dictionary of user settings.
+
+    """
+    global _http_session
+    with HTTP_SESSION_LOCK:
+        HTTP_SETTINGS.clear()
+        HTTP_SETTINGS.update(settings)
+        _http_session = None
+
+
+def create_http_session(settings):
+    """Create a requests session with pooled keep-alive connections.
+
+    Idempotent requests that fail to connect or return 429/5xx responses are
+    retried a bounded number of times with jittered exponential backoff,
+    honouring any Retry-After header.
+
+    Args:
+        settings (dict): Dictionary of user settings.
+
+    Returns:
+        requests.Session object.
+
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class JitteredRetry(Retry):
+        """urllib3 Retry whose exponential backoff is randomised.
+
+        Spreading retries out (full jitter) stops parallel fetches that
+        failed together from retrying together. A Retry-After header still
+        takes precedence over the backoff as urllib3 sleeps for that instead
+        when it is present.
+        """
+
+        def get_backoff_time(self):
+            """Return a random backoff between zero and exponential."""
+            return random.uniform(0, super().get_backoff_time())
+
+    retry = JitteredRetry(
+        total=int(settings.get('http_retries', '3')),
+        backoff_factor=float(settings.get('http_backoff', '0.5')),
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    connections = int(settings.get('http_connections', '10'))
+    adapter = HTTPAdapter(pool_connections=connections,
+                          pool_maxsize=connections, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_http_session():
+    """Return the shared HTTP session, creating it on first use."""
+    global _http_session
+    with HTTP_SESSION_LOCK:
+        if _http_session is None:
+            _http_session = create_http_session(HTTP_SETTINGS)
+        return _http_session
+
+
+def http_get(url, **kwargs):
+    """GET url through the shared HTTP session with the configured timeout.
+
+    Args:
+        url (str): URL to fetch.
+        **kwargs: Extra arguments passed on to requests.Session.get.
+
+    Returns:
+        requests.Response object.
+
+    """
+    kwargs.setdefault('timeout', float(HTTP_SETTINGS.get('http_timeout',
+                                                         '20')))
+    return get_http_session().get(url, **kwargs)
+
+
+class HttpEngineError(Exception):
+    """The HTTP engine can't update a book so the browser should be used.
+
+    Only raised before anything has been submitted to Goodreads, so the
+    browser can safely repeat the update from the start.
+    """
+
+
+def http_start_session(settings):
+    """Create a requests session logged in with the saved session cookies.
+
+    Args:
+        settings (dict): Dictionary of user settings.
+
+    Returns:
+        requests.Session object, or None if there are no saved cookies.
+
+    """
+    path = settings.get('session', './session.json')
+    try:
+        with open(path) as session_file:
+            cookies = json.load(session_file)
+    except (OSError, ValueError):
+        return None
+
+    session = create_http_session(settings)
+    for cookie in cookies:
+        session.cookies.set(cookie['name'], cookie['value'],
+                            domain=cookie.get('domain', ''),
+                            path=cookie.get('path', '/'))
+    return session
+
+
+def http_fetch(session, url):
+    """GET a Goodreads page with the logged in session and parse it.
+
+    Args:
+        session (obj): Logged in requests.Session.
+        url (str): URL of the page.
+
+    Returns:
+        Tuple of the page source and its BeautifulSoup.
+
+    Raises:
+        HttpEngineError: The page failed to load or the session has been
+                         logged out.
+
+    """
+    import bs4
+    import requests
+
+    timeout = float(HTTP_SETTINGS.get('http_timeout', '20'))
+    try:
+        res = session.get(url, timeout=timeout)
+        res.raise_for_status()
+    except requests.RequestException as error:
+        raise HttpEngineError('failed to load {}: {}'.format(url, error))
+    if 'sign_in' in res.url:
+        raise HttpEngineError('the saved session has been logged out')
+
+    return res.text, bs4.BeautifulSoup(res.text, 'html.parser')
+
+
+def http_post(session, url, data, token):
+    """POST a form to Goodreads with the page's CSRF token.
+
+    Args:
+        session (obj): Logged in requests.Session.
+        url (str): URL the form is submitted to.
+        data (dict): Form fields.
+        token (str): CSRF token of the page the form is on.
+
+    """
+    data = dict(data, authenticity_token=token)
+    res = session.post(url, data=data, headers={'X-CSRF-Token': token},
+                       timeout=float(HTTP_SETTINGS.get('http_timeout',
+                                                       '20')))
+    res.raise_for_status()
+
+
+def http_csrf_token(soup):
+    """Return the CSRF token from a Goodreads page.
+
+    Args:
+        soup (obj): BeautifulSoup of the page.
+
+    Returns:
+        String of the token.
+
+    Raises:
+        HttpEngineError: The page has no token.
+
+    """
+    meta = soup.find('meta', attrs={'name': 'csrf-token'})
+    if meta and meta.get('content'):
+        return meta['content']
+    field = soup.find('input', attrs={'name': 'authenticity_token'})
+    if field and field.get('value'):
+        return field['value']
+    raise HttpEngineError('no CSRF token found')
+
+
+def http_get_shelves(soup, rating):
+    """Return the book page's 'Top Shelves' like goodreads_get_shelves."""
+    shelves = []
+    for link in soup.select('.actionLinkLite.bookPageGenreLink'):
+        shelf = link.getText().strip()
+        if ' users' not in shelf and shelf not in shelves:
+            shelves.append(shelf)
+
+    if rating == '5':
+        shelves.append('5-star-books')
+
+    return shelves
+
+
+def http_get_shelved_status(soup):
+    """Return whether the book is shelved like goodreads_get_shelved_status."""
+    return not soup.select('.wtrRight.wtrUp')
+
+
+def http_review_form(soup):
+    """Return the review edit form's action and its current field values.
+
+    Args:
+        soup (obj): BeautifulSoup of the review edit page.
+
+    Returns:
+        Tuple of the form's action URL and a dictionary of its fields.
+
+    Raises:
+        HttpEngineError: The page has no review form.
+
+    """
+    import requests
+
+    review_elem = soup.find('textarea', attrs={'name': 'review[review]'})
+    form = review_elem.find_parent('form') if review_elem else None
+    if not form:
+        raise HttpEngineError('no review form found')
+
+    fields = {}
+    for field in form.find_all(['input', 'select', 'textarea']):
+        name = field.get('name')
+        if not name or field.get('type') in ('submit', 'button'):
+            continue
+        if field.name == 'textarea':
+            fields[name] = field.getText()
+        elif field.name == 'select':
+            selected = (field.find('option', selected=True)
+                        or field.find('option'))
+            fields[name] = selected.get('value', selected.getText()) \
+                if selected else ''
+        elif field.get('type') in ('checkbox', 'radio'):
+            if field.has_attr('checked'):
+                fields[name] = field.get('value', 'on')
+        else:
+            fields[name] = field.get('value', '')
+
+    action = requests.compat.urljoin(GOODREADS_URL,
+                                     form.get('action', ''))
+    return action, fields
+
+
+def http_date_input(fields, date_done):
+    """Set the completion date of the last reading session in the fields.
+
+    Args:
+        fields (dict): Review form fields from http_review_form.
+        date_done (str): Date formatted DD/MM/YYYY.
+
+    Raises:
+        HttpEngineError: The form has no reading session date fields.
+
+    """
+    codes = re.findall(r'readingSessionDatePicker(\w*)\[end\]\[year\]',
+                       ' '.join(fields))
+    if not codes:
+        raise HttpEngineError('no reading session found')
+
+    name = 'readingSessionDatePicker{}[end][{{}}]'.format(codes[-1])
+    fields[name.format('year')] = date_done[6:]
+    fields[name.format('month')] = date_done[3:5].lstrip('0')
+    fields[name.format('day')] = date_done[:2].lstrip('0')
+
+
+def http_update(session, details):
+    """Mark a single book as read on Goodreads without a browser.
+
+    Makes the same changes as goodreads_update by submitting the review edit
+    form and shelving requests directly. Books that need searching for (and
+    aren't in the resolution cache) or that are being reread raise
+    HttpEngineError before anything is submitted, so the browser can be
+    used for them instead.
+
+    Args:
+        session (obj): Logged in requests.Session from http_start_session.
+        details (dict): Book details with either a 'url' or a 'search' and
+                        'format' plus 'date', 'rating' and 'review'.
+
+    Returns:
+        Tuple of the book's Goodreads URL, its list of shelves and the page
+        source of the book page for parse_page.
+
+    Raises:
+        HttpEngineError: The book has to be updated using the browser.
+
+    """
+    if journal_steps(details):
+        raise HttpEngineError('resuming a job needs the browser')
+    url = details.get('url')
+    if not url and _resolution_cache and not details.get('refresh'):
+        url = _resolution_cache.lookup(details['search'], details['format'])
+    if not url:
+        raise HttpEngineError('searching needs the browser')
+
+    page_source, book_soup = http_fetch(session, url)
+    shelves = http_get_shelves(book_soup, details['rating'])
+    if http_get_shelved_status(book_soup):
+        raise HttpEngineError('rereads need the browser')
+
+    book_code = url.rstrip('/').split('/')[-1]
+    _, edit_soup = http_fetch(
+        session, '{}/review/edit/{}'.format(GOODREADS_URL, book_code)
+    )
+    token = http_csrf_token(edit_soup)
+    action, fields = http_review_form(edit_soup)
+    http_date_input(fields, details['date'])
+    if details['review']:
+        fields['review[review]'] = details['review']
+    fields['review[rating]'] = details['rating']
+
+    journal_checkpoint(details, 'page', url=url, shelves=shelves,
+                       shelved_status=False)
+    http_post(session, action, fields, token)
+    journal_checkpoint(details, 'review')
+    journal_checkpoint(details, 'rate')
+    for shelf in shelves:
+        http_post(session, GOODREADS_URL + '/shelf/add_to_shelf',
+                  {'book_id': book_code, 'name': shelf}, token)
+    journal_checkpoint(details, 'shelve')
+
+    return (url, shelves, page_source)
+
+
+def http_try_update(session, details):
+    """Update a book with http_update, returning None if it needs a browser.
+
+    Args:
+        session (obj): Logged in requests.Session, or None if there is no
+                       saved session to use.
+        details (dict): Book details as taken by http_update.
+
+    Returns:
+        Tuple returned by http_update, or None.
+
+    """
+    if session is None:
+        return None
+    try:
+        return http_update(session, details)
+    except HttpEngineError as error:
+        print('Using the browser as {}.'.format(error))
+        return None
+
+
+def book_id(url):
+    """Return the Goodreads book ID from a book URL, or the URL if it has none.
+
+    Args:
+        url (str): Goodreads Book URL e.g. .../book/show/4799.Cannery_Row
+
+    """
+    match = re.search(r'/book/show/(\d+)', url)
+    if match:
+        return match.group(1)
+    return url
+
+
+class PageCache:
+    """Persistent SQLite cache of the book info parsed from Goodreads pages.
+
+    Entries are keyed by book ID, are fresh for ttl seconds after they were
+    fetched and then kept for conditional revalidation using their ETag and
+    Last-Modified validators. The least recently used entries are evicted
+    once there are more than max_entries.
+    """
+
+    def __init__(self, path, ttl, max_entries, store_html=False):
+        """PageCache constructor to open (and create) the cache database.
+
+        Args:
+            path (str): Path to the SQLite cache database.
+            ttl (float): Seconds an entry is fresh for.
+            max_entries (int): Maximum number of entries to keep.
+            store_html (bool): Whether to keep the raw page HTML as well.
+
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.store_html = store_html
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                'book_id TEXT PRIMARY KEY, url TEXT, title TEXT, '
+                'author TEXT, pages INTEGER, html TEXT, etag TEXT, '
+                'last_modified TEXT, fetched REAL, accessed REAL)'
+            )
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS pages_accessed ON pages(accessed)'
+            )
+
+    def lookup(self, url):
+        """Return the cached entry for url, marking it as recently used.
+
+        Returns:
+            Dictionary with 'info', 'etag', 'last_modified' and 'fresh' keys,
+            or None if url isn't cached.
+
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                'SELECT title, author, pages, etag, last_modified, fetched '
+                'FROM pages WHERE book_id = ?', (book_id(url),)
+            ).fetchone()
+            if not row:
+                return None
+            self.connection.execute(
+                'UPDATE pages SET accessed = ? WHERE book_id = ?',
+                (time.time(), book_id(url))
+            )
+
+        title, author, pages, etag, last_modified, fetched = row
+        return {
+            'info': {'title': title, 'author': author, 'pages': pages},
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': time.time() - fetched < self.ttl,
+        }
+
+    def store(self, url, info, etag=None, last_modified=None, html=None):
+        """Cache the info parsed from url then evict any excess entries."""
+        now = time.time()
+        if not self.store_html:
+            html = None
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, '
+                '?, ?)', (book_id(url), url, info['title'], info['author'],
+                          info['pages'], html, etag, last_modified, now, now)
+            )
+            self.connection.execute(
+                'DELETE FROM pages WHERE book_id NOT IN (SELECT book_id '
+                'FROM pages ORDER BY accessed DESC LIMIT ?)',
+                (self.max_entries,)
+            )
+
+    def refresh(self, url):
+        """Mark url's entry as freshly fetched after it was revalidated."""
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE pages SET fetched = ?, accessed = ? '
+                'WHERE book_id = ?', (now, now, book_id(url))
+            )
+
+
+class ResolutionCache:
+    """Persistent SQLite cache of search terms and format to edition URL.
+
+    Search terms are normalised to lowercase words and formats to their first
+    letter so that equivalent searches share an entry.
+    """
+
+    def __init__(self, path):
+        """ResolutionCache constructor to open (and create) the database.
+
+        Args:
+            path (str): Path to the SQLite cache database.
+
+        """
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS resolutions (terms TEXT, '
+                'format TEXT, url TEXT, PRIMARY KEY (terms, format))'
+            )
+
+    @staticmethod
+    def normalise(terms, book_format):
+        """Return the (terms, format) key for a search."""
+        words = re.findall(r'\w+', terms.lower())
+        return (' '.join(words), book_format.strip()[:1].lower())
+
+    def lookup(self, terms, book_format):
+        """Return the edition URL the search resolved to, or None."""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT url FROM resolutions WHERE terms = ? AND format = ?',
+                self.normalise(terms, book_format)
+            ).fetchone()
+        return row[0] if row else None
+
+    def store(self, terms, book_format, url):
+        """Record the edition URL that the search resolved to."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?)',
+                self.normalise(terms, book_format) + (url,)
+            )
+
+    def forget(self, terms, book_format):
+        """Remove the search's entry so it is resolved afresh next time."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'DELETE FROM resolutions WHERE terms = ? AND format = ?',
+                self.normalise(terms, book_format)
+            )
+
+
+_page_cache = None
+_resolution_cache = None
+
+
+def configure_caches(settings):
+    """Open the page and resolution caches, or disable them if none is set.
+
+    Args:
+        settings (dict): Dictionary of user settings.
+
+    """
+    global _page_cache, _resolution_cache
+    path = settings.get('cache', './cache.db')
+    if not path:
+        _page_cache = None
+        _resolution_cache = None
+        return
+    _resolution_cache = ResolutionCache(path)
+    _page_cache = PageCache(
+        path,
+        ttl=float(settings.get('cache_ttl', '30')) * 24 * 60 * 60,
+        max_entries=int(settings.get('cache_size', '5000')),
+        store_html=settings.get('cache_html', 'False') == 'True',
+    )
+
+
+def parse_page(url, html=None, limiter=None, in_pool=False):
+    """Parse Goodreads page for title, author and number of pages.
+
+    Fresh entries in the page cache are used without fetching the page and
+    stale ones are revalidated with a conditional request.
+
+    Args:
+        url (str): Goodreads Book URL, only fetched if html is not given or
+                   can't be parsed.
+        html (str): Page source of the book page if already loaded.
+        limiter (obj): TokenBucket to wait on before fetching the page.
+        in_pool (bool): Parse a fetched page in the parsing process pool,
+                        leaving this thread free while it's parsed.
+
+    Returns:
+        Dictionary of parsed Title, Author and Number of Pages.
+
+    """
+    cache = _page_cache
+    if html:
+        try:
+            info = parse_book_html(html)
+        except (IndexError, ValueError):
+            pass
+        else:
+            if cache:
+                cache.store(url, info, html=html)
+            return info
+
+    entry = cache.lookup(url) if cache else None
+    headers = {}
+    if entry:
+        if entry['fresh']:
+            return entry['info']
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    if limiter:
+        limiter.acquire()
+    res = http_get(url, headers=headers)
+    if limiter:
+        limiter.observe(res)
+    if entry and res.status_code == 304:
+        cache.refresh(url)
+        return entry['info']
+    res.raise_for_status()
+
+    if in_pool:
+        info = parse_in_pool(res.text)
+    else:
+        info = parse_book_html(res.text)
+    if cache:
+        cache.store(url, info, res.headers.get('ETag'),
+                    res.headers.get('Last-Modified'), res.text)
+    return info
+
+
+def parse_book_html(html):
+    """Parse Goodreads book page HTML for title, author and number of pages.
+
+    The page's JSON-LD structured data is used when it has the book's
+    details, otherwise only the elements holding them are parsed, with a
+    parse of the whole page as a last resort.
+
+    Args:
+        html (str): Source of a Goodreads book page.
+
+    Returns:
+        Dictionary of parsed Title, Author and Number of Pages.
+
+    """
+    import bs4
+
+    info = parse_book_json_ld(html)
+    if info:
+        return info
+
+    try:
+        return book_info_from_soup(bs4.BeautifulSoup(
+            html, fast_parser(), parse_only=bs4.SoupStrainer(book_fragment)
+        ))
+    except (IndexError, ValueError):
+        return book_info_from_soup(bs4.BeautifulSoup(html, 'html.parser'))
+
+
+BOOK_JSON_LD = re.compile(
+    r'<script[^>]*type="application/ld\+json"[^>]*>(.*?)</script>', re.S
+)
+
+
+def parse_book_json_ld(html):
+    """Return the book's information from the page's JSON-LD if it has it.
+
+    Args:
+        html (str): Source of a Goodreads book page.
+
+    Returns:
+        Dictionary of Title, Author and Number of Pages, or None.
+
+    """
+    for match in BOOK_JSON_LD.finditer(html):
+        try:
+            data = json.loads(match.group(1))
+        except ValueError:
+            continue
+
+        for item in data if isinstance(data, list) else [data]:
+            if not isinstance(item, dict) or item.get('@type') != 'Book':
+                continue
+            authors = item.get('author')
+            if isinstance(authors, dict):
+                authors = [authors]
+            try:
+                return {'title': unescape(item['name']).strip(),
+                        'author': unescape(authors[0]['name']).strip(),
+                        'pages': int(item['numberOfPages'])}
+            except (KeyError, IndexError, TypeError, ValueError):
+                continue
+
+    return None
+
+
+def book_fragment(name, attrs):
+    """Return whether a tag is one of those book_info_from_soup reads."""
+    classes = attrs.get('class') or ''
+    if isinstance(classes, str):
+        classes = classes.split()
+    return (attrs.get('id') == 'bookTitle' or 'authorName' in classes
+            or (name == 'span' and attrs.get('itemprop') == 'numberOfPages'))
+
+
+def fast_parser():
+    """Return lxml if it's installed as it's much faster, else html.parser."""
+    import bs4
+
+    if bs4.builder.builder_registry.lookup('lxml'):
+        return 'lxml'
+    return 'html.parser'
+
+
+def book_info_from_soup(soup):
+    """Read title, author and number of pages from a book page's soup.
+
+    Args:
+        soup (obj): BeautifulSoup of a Goodreads book page or its fragments.
+
+    Returns:
+        Dictionary of parsed Title, Author and Number of Pages.
+
+    """
+    info = {}
+
+    title_elem = soup.select('#bookTitle')
+    rough_title = title_elem[0].getText().strip().split('\n')
+    if len(rough_title) == 1:
+        info['title'] = rough_title[0].strip()
+    else:
+        info['title'] = rough_title[0].strip() + ' ' + rough_title[2].strip()
+
+    info['author'] = soup.select('.authorName')[0].getText().strip()
+
+    pages_elem = soup.findAll('span', attrs={'itemprop': 'numberOfPages'})
+    info['pages'] = int(pages_elem[0].getText().strip(' pages'))
+
+    return info
+
+
+PARSE_POOL_LOCK = threading.Lock()
+_parse_pool = None
+
+
+def get_parse_pool():
+    """Return the process pool for parsing pages, creating it on first use.
+
+    The pool has a process per core as parsing is CPU bound and holds the
+    GIL in a single process. Its processes are started by a forkserver (or
+    spawned where that's unavailable) rather than forked, as the pool is
+    created while worker threads are running.
+    """
+    import multiprocessing
+
+    global _parse_pool
+    with PARSE_POOL_LOCK:
+        if _parse_pool is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+            else:
+                context = multiprocessing.get_context('spawn')
+            _parse_pool = futures.ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1, mp_context=context
+            )
+        return _parse_pool
+
+
+def try_parse_book_html(html):
+    """Return parse_book_html's info, or None if the html can't be parsed."""
+    try:
+        return parse_book_html(html)
+    except (IndexError, ValueError):
+        return None
+
+
+def parse_in_pool(html):
+    """Parse a book page in the parsing process pool like parse_book_html.
+
+    Parses in this process instead if the pool can't be used.
+
+    Args:
+        html (str): Source of a Goodreads book page.
+
+    Returns:
+        Dictionary of parsed Title, Author and Number of Pages.
+
+    """
+    try:
+        info = get_parse_pool().submit(try_parse_book_html, html).result()
+    except (OSError, futures.process.BrokenProcessPool):
+        return parse_book_html(html)
+    if info is None:
+        raise ValueError('Book information not found on page')
+    return info
+
+
+def submit_parse(html, in_pool=True):
+    """Start parsing a book page, returning a future of its info or None.
+
+    The future's result is try_parse_book_html's, so None if the page can't
+    be parsed. Without page source there is nothing to parse and None is
+    returned in place of the future.
+
+    Args:
+        html (str): Source of a Goodreads book page, or None.
+        in_pool (bool): Parse in the parsing process pool, otherwise (or if
+                        the pool can't be used) parse in this process.
+
+    """
+    if not html:
+        return None
+    if in_pool:
+        try:
+            return get_parse_pool().submit(try_parse_book_html, html)
+        except (OSError, futures.process.BrokenProcessPool):
+            pass
+    future = futures.Future()
+    future.set_result(try_parse_book_html(html))
+    return future
+
+
+def parse_pages(pages):
+    """Parse many book pages across every core, keeping their order.
+
+    A single page is parsed in this process rather than waiting on the pool.
+    Pages without page source, or whose source can't be parsed, are parsed
+    with parse_page instead.
+
+    Args:
+        pages (list): (url, html) tuples, html being the page source or None.
+
+    Returns:
+        List of parse_page info dictionaries in the order of pages.
+
+    """
+    htmls = [html or '' for _, html in pages]
+    parsed = None
+    if len(htmls) > 1:
+        workers = os.cpu_count() or 1
+        try:
+            parsed = list(get_parse_pool().map(
+                try_parse_book_html, htmls,
+                chunksize=max(1, len(htmls) // (workers * 4))
+            ))
+        except (OSError, futures.process.BrokenProcessPool):
+            pass
+    if parsed is None:
+        parsed = [try_parse_book_html(html) for html in htmls]
+
+    infos = []
+    for (url, html), info in zip(pages, parsed):
+        if info is None:
+            info = parse_page(url)
+        elif _page_cache:
+            _page_cache.store(url, info, html=html)
+        infos.append(info)
+    return infos
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter that adapts to throttling.
+
+    The rate is halved whenever Goodreads throttles or errors (429/5xx) and
+    creeps back up towards the maximum after each successful fetch, so bulk
+    fetching settles at the fastest rate the site tolerates.
+    """
+
+    MIN_RATE = 0.1
+
+    def __init__(self, rate, burst=1):
+        """TokenBucket constructor.
+
+        Args:
+            rate (float): Maximum requests per second.
+            burst (int): Number of requests that can be made at once.
+
+        """
+        self.max_rate = self.rate = max(rate, self.MIN_RATE)
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request can be made then take its token."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens
+                                  + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def observe(self, response):
+        """Adjust the rate by the statuses of a response and its retries.
+
+        Args:
+            response (obj): requests.Response of a fetch.
+
+        """
+        retries = getattr(response.raw, 'retries', None)
+        statuses = [entry.status for entry in retries.history
+                    if entry.status] if retries else []
+        statuses.append(response.status_code)
+        with self.lock:
+            if any(status == 429 or status >= 500 for status in statuses):
+                self.rate = max(self.MIN_RATE, self.rate / 2)
+            else:
+                self.rate = min(self.max_rate,
+                                self.rate + self.max_rate / 10)
+
+
+def read_url_file(path):
+    """Yield the book URLs in a file, one per line, skipping blanks/comments.
+
+    Args:
+        path (str): Path to the file.
+
+    """
+    with open(path) as url_file:
+        for line in url_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
+
+def enrich_pages(urls, settings):
+    """Fetch and parse many book pages concurrently, yielding as they finish.
+
+    At most 'enrich_workers' pages are in flight at once and requests are
+    limited to 'enrich_rate' per second by an adaptive TokenBucket. URLs are
+    taken from the iterable as space frees up so any number can be given.
+    Pages are parsed in the parsing process pool to use every core.
+
+    Args:
+        urls (iterable): Goodreads book URLs.
+        settings (dict): Dictionary of user settings.
+
+    Yields:
+        Tuples of a URL and its parse_page info dictionary, or the URL and
+        the exception raised if it failed.
+
+    """
+    workers = max(1, int(settings.get('enrich_workers', '8')))
+    limiter = TokenBucket(float(settings.get('enrich_rate', '2')),
+                          burst=workers)
+    urls = iter(urls)
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while True:
+            for url in urls:
+                running[executor.submit(parse_page, url, limiter=limiter,
+                                        in_pool=True)] = url
+                if len(running) >= workers:
+                    break
+            if not running:
+                return
+
+            done, _ = futures.wait(running,
+                                   return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                url = running.pop(future)
+                try:
+                    yield url, future.result()
+                except Exception as error:
+                    yield url, error
+
+
+def write_enrichment(urls, settings, path):
+    """Write the parsed information of many book pages to a CSV file.
+
+    Rows are written in the order the pages finish, with failures printed
+    rather than written.
+
+    Args:
+        urls (iterable): Goodreads book URLs.
+        settings (dict): Dictionary of user settings.
+        path (str): Path of the CSV file to write.
+
+    Returns:
+        Tuple of the number of pages written and the number that failed.
+
+    """
+    written = failed = 0
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['url', 'title', 'author', 'pages'])
+        for url, info in enrich_pages(urls, settings):
+            if isinstance(info, Exception):
+                print('Failed to fetch {}: {}'.format(url, info))
+                failed += 1
+                continue
+            writer.writerow([url, info['title'], info['author'],
+                             info['pages']])
+            written += 1
+
+    return written, failed
+
+
+def category_and_genre(shelves):
+    """Use shelves list to deterime genre and categorise as Fiction/Nonfiction.
+
+    Args:
+        shelves (list): List of strings of Goodreads shelf categories.
+
+    Returns:
+        Tuple of category (Fiction/Nonfiction) and the books genre.
+
+    """
+    if 'Nonfiction' in shelves:
+        category = 'Nonfiction'
+    else:
+        category = 'Fiction'
+
+    for shelf in shelves:
+        if shelf != category:
+            genre = shelf
+            break
+
+    return (category, genre)
+
+
+def check_year_sheet_exists(path, year_sheet):
+    """Check year_sheet exists in path workbook, call create if not.
+
+    Args:
+        path (str): Path to spreadsheet to check
+        year_sheet (str): The year the book was read formatted YYYY.
+
+    Return:
+        workbook (obj): openpyxl workbook object.
+
+    """
+    import openpyxl
+
+    with span('workbook load'):
+        workbook = openpyxl.load_workbook(path)
+    ensure_year_sheet(workbook, year_sheet)
+
+    return workbook
+
+
+def ensure_year_sheet(workbook, year_sheet):
+    """Create year_sheet in an already loaded workbook if it is missing.
+
+    Args:
+        workbook (obj): openpyxl workbook object.
+        year_sheet (str): The year the book was read formatted YYYY.
+
+    """
+    existing_sheets = [sheet for sheet in workbook.sheetnames
+                       if sheet != TEMPLATE_SHEET]
+    if year_sheet not in existing_sheets:
+        create_sheet(workbook, existing_sheets[-1], year_sheet)
+
+
+# Hidden, empty year sheet that new year sheets are copied from
+TEMPLATE_SHEET = 'Template'
+
+
+def create_sheet(workbook, sheet_to_copy, new_sheet_name):
+    """Create a new year sheet by copying the empty template sheet.
+
+    Copying the template keeps creation constant time however many books
+    were read the previous year. Workbooks without a template have one made
+    from sheet_to_copy first.
+
+    Args:
+        workbook (obj): openpyxl workbook object.
+        sheet_to_copy (str): Name of the sheet to make the template from.
+        new_sheet_name (str): Name (year formatted YYYY) to name new sheet.
+
+    """
+    if TEMPLATE_SHEET not in workbook.sheetnames:
+        create_template_sheet(workbook, sheet_to_copy)
+
+    sheet = workbook.copy_worksheet(workbook[TEMPLATE_SHEET])
+    sheet.title = new_sheet_name
+    sheet.sheet_state = 'visible'
+    day_tracker = '=(TODAY()-DATE({},1,1))/7'.format(new_sheet_name)
+    sheet.cell(row=5, column=9).value = day_tracker
+
+
+def create_template_sheet(workbook, sheet_to_copy):
+    """Create the hidden template sheet by copying and clearing a year sheet.
+
+    Args:
+        workbook (obj): openpyxl workbook object.
+        sheet_to_copy (str): Name of the year sheet to copy.
+
+    """
+    sheet = workbook.copy_worksheet(workbook[sheet_to_copy])
+    sheet.title = TEMPLATE_SHEET
+    clear_rows(sheet)
+    sheet.sheet_state = 'hidden'
+
+
+def clear_rows(sheet):
+    """Blank the book information of every row below the header row.
+
+    Args:
+        sheet (obj): openpyxl sheet object.
+
+    """
+    last_row = first_blank_row(sheet)
+    while last_row > 1:
+        for col in range(1, 7):
+            sheet.cell(row=last_row, column=col).value = None
+        last_row -= 1
+
+
+def input_info(workbook, info, date, path):
+    """Write the book information to the first blank row on the given sheet.
+
+    Args:
+        workbook (obj): openpyxl workbook object.
+        info (dict): Information about the book.
+        date (str): Date to input in the 'Read date' column.
+        path (str): Path to spreadsheet.
+
+    """
+    write_info(workbook, info, date)
+    with span('workbook save'):
+        workbook.save(path)
+
+
+def write_info(workbook, info, date):
+    """Write the book information to its year and Overall sheets unsaved.
+
+    Args:
+        workbook (obj): openpyxl workbook object.
+        info (dict): Information about the book.
+        date (str): Date to input in the 'Read date' column.
+
+    """
+    for sheet in [date[-4:], 'Overall']:
+        write_rows(workbook[sheet], [info_values(info, date)])
+
+
+def input_infos(workbook, records, path):
+    """Write many books' information to the workbook with a single save.
+
+    Records are grouped by the year they were read so each missing year
+    sheet is created once, in year order, before any rows are written.
+
+    Args:
+        workbook (obj): openpyxl workbook object.
+        records (list): (info, date) tuples in the order to write them.
+        path (str): Path to spreadsheet.
+
+    """
+    rows_by_sheet = {'Overall': []}
+    years = {}
+    for info, date in records:
+        values = info_values(info, date)
+        years.setdefault(date[-4:], []).append(values)
+        rows_by_sheet['Overall'].append(values)
+
+    for year in sorted(years):
+        ensure_year_sheet(workbook, year)
+    rows_by_sheet.update(years)
+
+    for sheet, rows in rows_by_sheet.items():
+        write_rows(workbook[sheet], rows)
+
+    with span('workbook save'):
+        workbook.save(path)
+
+
+def write_rows(sheet, rows):
+    """Write rows of values to a sheet below its last filled row.
+
+    Args:
+        sheet (obj): openpyxl sheet object.
+        rows (list): Rows (lists of values for columns A onwards) to write.
+
+    """
+    input_row = first_blank_row(sheet)
+    for values_to_write in rows:
+        for number, value in enumerate(values_to_write, 1):
+            sheet.cell(row=input_row, column=number).value = value
+        input_row += 1
+
+
+# Cache of each loaded sheet's first blank row to make appending O(1)
+BLANK_ROWS = weakref.WeakKeyDictionary()
+
+
+def first_blank_row(sheet):
+    """Return the number of the row after the last filled row of column A.
+
+    Rows inside the data with a blank column A are skipped over rather than
+    returned, so writing from the returned row never overwrites a book. The
+    result is cached and, as rows are only appended, verified on later calls
+    by checking it or the row after is the boundary; otherwise column A is
+    searched upwards from the sheet's last row.
+
+    Args:
+        sheet (obj): openpyxl sheet object to find first blank row of.
+
+    """
+    cached = BLANK_ROWS.get(sheet)
+    if cached:
+        for row in (cached, cached + 1):
+            if (not row_filled(sheet, row)
+                    and (row == 1 or row_filled(sheet, row - 1))):
+                BLANK_ROWS[sheet] = row
+                return row
+
+    row = sheet.max_row
+    while row > 0 and not row_filled(sheet, row):
+        row -= 1
+
+    BLANK_ROWS[sheet] = row + 1
+    return row + 1
+
+
+def row_filled(sheet, row):
+    """Return whether column A of the row has a value."""
+    return cell_value(sheet, row) not in (None, '')
+
+
+def cell_value(sheet, row, column=1):
+    """Return a cell's value without creating the cell if it doesn't exist.
+
+    Args:
+        sheet (obj): openpyxl sheet object.
+        row (int): Row number of the cell.
+        column (int): Column number of the cell.
+
+    """
+    cell = sheet._cells.get((row, column))
+    return cell.value if cell else None
 
-    else:
-        details = args
-        check_and_prompt_for_email_password(settings)
-        # Process date if given as (t)oday or (y)esterday into proper format
-        if details['date'].lower() == 't':
-            details['date'] = get_date_str()
-        elif details['date'].lower() == 'y':
-            details['date'] = get_date_str(True)
 
-    driver = create_driver(settings['headless'])
+def info_values(info, date):
+    """Return the list of values written to a sheet row for a book."""
+    return [
+            info['title'], info['author'],
+            info['pages'], info['category'],
+            info['genre'], date
+    ]
 
-    driver.implicitly_wait(10)
-    goodreads_login(driver, settings['email'], settings['password'])
-    if 'url' in details:
-        url = details['url']
-        driver.get(url)
+
+def write_records(path, records, stats_by_sheet=None, workbook=None):
+    """Append many books' information to their year and Overall sheets.
+
+    The rows are streamed into the existing sheets with append_rows_xlsx,
+    falling back to loading and saving the whole workbook with openpyxl when
+    a year sheet has to be created first. Any statistics given are stored
+    as the results of the sheets' statistics formulas.
+
+    Args:
+        path (str): Path to spreadsheet.
+        records (list): (info, date) tuples in the order to write them.
+        stats_by_sheet (dict): Sheet name: ReadingStats for that sheet.
+        workbook (obj): openpyxl workbook already loaded from path, such as
+                        one from prepare_spreadsheet, to write and save
+                        instead of streaming the rows.
+
+    """
+    import openpyxl
+
+    rows_by_sheet = {}
+    for info, date in records:
+        values = info_values(info, date)
+        rows_by_sheet.setdefault(date[-4:], []).append(values)
+        rows_by_sheet.setdefault('Overall', []).append(values)
+
+    formula_values = {sheet: stats.cell_values(sheet) for sheet, stats
+                      in (stats_by_sheet or {}).items()}
+    if workbook is None:
+        try:
+            append_rows_xlsx(path, rows_by_sheet, formula_values)
+            return
+        except KeyError:
+            with span('workbook load'):
+                workbook = openpyxl.load_workbook(path)
+    input_infos(workbook, records, path)
+    append_rows_xlsx(path, {}, formula_values)
+
+
+XLSX_NAMESPACES = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+    'r': ('http://schemas.openxmlformats.org/officeDocument/2006/'
+          'relationships'),
+}
+
+
+def xlsx_sheet_parts(archive):
+    """Map the sheet names of an xlsx archive to their worksheet part names.
+
+    Args:
+        archive (obj): zipfile.ZipFile of the xlsx file.
+
+    Returns:
+        Dictionary with sheet name: part name format.
+
+    """
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {}
+    for rel in rels.iter('{%s}Relationship' % XLSX_NAMESPACES['rel']):
+        target = rel.get('Target')
+        if target.startswith('/'):
+            targets[rel.get('Id')] = target[1:]
+        else:
+            targets[rel.get('Id')] = 'xl/' + target
+
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    parts = {}
+    for sheet in workbook.iter('{%s}sheet' % XLSX_NAMESPACES['main']):
+        rel_id = sheet.get('{%s}id' % XLSX_NAMESPACES['r'])
+        parts[sheet.get('name')] = targets[rel_id]
+
+    return parts
+
+
+def append_rows_xlsx(path, rows_by_sheet, formula_values=None):
+    """Append rows to sheets by rewriting only their parts of the xlsx file.
+
+    Every other part of the archive (styles, shared strings, other sheets)
+    is copied across unchanged, so the cost of appending doesn't grow with
+    the size of the rest of the workbook.
+
+    Args:
+        path (str): Path to spreadsheet.
+        rows_by_sheet (dict): Sheet name: list of rows (lists of values).
+        formula_values (dict): Sheet name: dictionary of cell coordinate:
+                               value to store as formula cells' results.
+
+    Raises:
+        KeyError: A sheet in rows_by_sheet doesn't exist in the workbook.
+
+    """
+    formula_values = formula_values or {}
+    with zipfile.ZipFile(path) as archive:
+        parts = xlsx_sheet_parts(archive)
+        new_parts = {}
+        for sheet in set(rows_by_sheet) | set(formula_values):
+            part = parts[sheet]
+            xml = archive.read(part).decode('utf-8')
+            xml = append_rows_to_sheet_xml(xml, rows_by_sheet.get(sheet, []))
+            new_parts[part] = set_formula_values(
+                xml, formula_values.get(sheet, {})
+            )
+
+        temp_path = path + '.tmp'
+        with zipfile.ZipFile(temp_path, 'w') as output:
+            for item in archive.infolist():
+                if item.filename in new_parts:
+                    data = new_parts[item.filename].encode('utf-8')
+                else:
+                    data = archive.read(item.filename)
+                output.writestr(item, data)
+
+    os.replace(temp_path, path)
+
+
+XLSX_ROW = re.compile(r'<row\b[^>]*?\sr="(\d+)"[^>]*?(?:/>|>(.*?)</row>)',
+                      re.DOTALL)
+XLSX_CELL = re.compile(
+    r'<c\b[^>]*?\sr="([A-Z]+)(\d+)"[^>]*?(?:/>|>(.*?)</c>)', re.DOTALL
+)
+XLSX_STYLE = re.compile(r' s="(\d+)"')
+XLSX_CACHED_FORMULA_VALUE = re.compile(r'(</f>|<f [^>]*/>)<v>[^<]*</v>')
+
+
+def append_rows_to_sheet_xml(xml, rows):
+    """Append rows after the last row with data in a sheet's XML.
+
+    Rows are only written below every filled cell of the columns being
+    written, so gaps in the data are left alone rather than filled in.
+
+    Cells are written as inline strings or numbers so the shared strings
+    part is left alone, and take the style of the blank cell already in
+    their place or of the data cell above. Cached formula results are dropped,
+    as openpyxl does on save, so the statistics are recalculated on open.
+
+    Args:
+        xml (str): Worksheet part XML.
+        rows (list): Rows (lists of values for columns A onwards) to append.
+
+    Returns:
+        Worksheet part XML with the rows added.
+
+    """
+    cells = {}
+    for match in XLSX_CELL.finditer(xml):
+        cells[(match.group(1), int(match.group(2)))] = match.group(0)
+
+    def filled(cell):
+        body = XLSX_CELL.match(cell).group(3)
+        return bool(body) and ('<v>' in body or '<is>' in body)
+
+    columns = {chr(ord('A') + column) for column
+               in range(max((len(values) for values in rows), default=1))}
+    row_number = 1 + max((row for (letter, row), cell in cells.items()
+                          if letter in columns and filled(cell)), default=0)
+
+    for values in rows:
+        new_cells = {}
+        for column, value in enumerate(values, 1):
+            letter = chr(ord('A') + column - 1)
+            style_source = cells.get((letter, row_number), '')
+            if not style_source and row_number > 2:
+                # Never borrow the style of the header row
+                style_source = cells.get((letter, row_number - 1), '')
+            style = XLSX_STYLE.search(style_source.split('>')[0])
+            new_cells[letter] = xlsx_cell(letter, row_number, value,
+                                          style.group(1) if style else None)
+            cells[(letter, row_number)] = new_cells[letter]
+        xml = replace_sheet_row(xml, row_number, new_cells)
+        row_number += 1
+
+    xml = re.sub(r'<dimension ref="([A-Z]+\d+):([A-Z]+)(\d+)"/>',
+                 lambda match: '<dimension ref="{}:{}{}"/>'.format(
+                     match.group(1), match.group(2),
+                     max(int(match.group(3)), row_number - 1)),
+                 xml, count=1)
+    return XLSX_CACHED_FORMULA_VALUE.sub(r'\1', xml)
+
+
+def set_formula_values(xml, values):
+    """Store values as the cached results of formula cells in a sheet's XML.
+
+    Spreadsheet applications show cached results on open instead of having
+    to calculate every formula first.
+
+    Args:
+        xml (str): Worksheet part XML.
+        values (dict): Cell coordinate: string or number result.
+
+    Returns:
+        Worksheet part XML with the formula results set.
+
+    """
+    def cached_result(match):
+        coordinate = match.group(1) + match.group(2)
+        body = match.group(3) or ''
+        if coordinate not in values or '<f' not in body:
+            return match.group(0)
+
+        value = values[coordinate]
+        start_tag = re.sub(r' t="[^"]*"', '', match.group(0).split('>')[0])
+        if isinstance(value, str):
+            start_tag += ' t="str"'
+        formula = re.sub(r'<v>[^<]*</v>|<v\s*/>', '', body)
+        return '{}>{}<v>{}</v></c>'.format(start_tag, formula, escape(
+            value if isinstance(value, str) else repr(value), quote=False))
+
+    return XLSX_CELL.sub(cached_result, xml)
+
+
+def xlsx_cell(letter, row, value, style=None):
+    """Return the XML of a cell holding value.
+
+    Args:
+        letter (str): Column letter of the cell.
+        row (int): Row number of the cell.
+        value: String or number to store in the cell.
+        style (str): Index of the cell's style, if it has one.
+
+    """
+    attributes = 'r="{}{}"'.format(letter, row)
+    if style is not None:
+        attributes += ' s="{}"'.format(style)
+    if isinstance(value, (int, float)):
+        return '<c {}><v>{}</v></c>'.format(attributes, value)
+    return ('<c {} t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>'
+            .format(attributes, escape(str(value), quote=False)))
+
+
+def replace_sheet_row(xml, row_number, new_cells):
+    """Merge new cells into a sheet row, creating the row if it's missing.
+
+    Args:
+        xml (str): Worksheet part XML.
+        row_number (int): Number of the row to modify.
+        new_cells (dict): Column letter: cell XML of the cells to set.
+
+    Returns:
+        Worksheet part XML with the row's cells set.
+
+    """
+    def column_key(letter):
+        return (len(letter), letter)
+
+    for match in XLSX_ROW.finditer(xml):
+        number = int(match.group(1))
+        if number < row_number:
+            continue
+
+        if number == row_number:
+            row_cells = {cell.group(1): cell.group(0) for cell
+                         in XLSX_CELL.finditer(match.group(2) or '')}
+            row_cells.update(new_cells)
+            start_tag = re.match(r'<row [^>]*?(?=/?>)', match.group(0))
+            row_xml = '{}>{}</row>'.format(
+                start_tag.group(0),
+                ''.join(row_cells[letter] for letter
+                        in sorted(row_cells, key=column_key)))
+            return xml[:match.start()] + row_xml + xml[match.end():]
+
+        # Rows are in order so the new row goes before the first later one
+        insert_at = match.start()
+        break
     else:
-        goodreads_find(driver, details['search'])
-        url = goodreads_filter(driver, details['format'])
+        if '<sheetData/>' in xml:
+            xml = xml.replace('<sheetData/>', '<sheetData></sheetData>', 1)
+        insert_at = xml.index('</sheetData>')
 
-    shelves = goodreads_get_shelves(driver, details['rating'])
+    row_xml = '<row r="{}">{}</row>'.format(
+        row_number,
+        ''.join(new_cells[letter] for letter
+                in sorted(new_cells, key=column_key)))
+    return xml[:insert_at] + row_xml + xml[insert_at:]
 
-    shelved_status = goodreads_get_shelved_status(driver)
 
-    goodreads_date_input(driver, details['date'], shelved_status)
+class ReadingStats:
+    """Running totals behind a sheet's statistics, updated a book at a time.
 
-    if details['review']:
-        goodreads_add_review(driver, details['review'])
+    Books and pages read, fiction and nonfiction counts, and count maps of
+    authors and genres are kept so adding a book is O(1) and the sheet's
+    summary statistics can be produced without rereading every row.
+    """
 
-    driver.find_element_by_name('next').click()
-    driver.get(url)
-    goodreads_rate_book(driver, details['rating'])
+    # Statistic: (Overall sheet cell, year sheet cell) of its formula
+    CELLS = collections.OrderedDict([
+        ('Books Read', ('I4', 'I6')),
+        ('Pages Read', ('I5', 'I7')),
+        ('Average Book Length', ('I8', 'I8')),
+        ('Fiction', ('I9', 'I9')),
+        ('Fiction Share', ('J9', 'J9')),
+        ('Nonfiction', ('I10', 'I10')),
+        ('Nonfiction Share', ('J10', 'J10')),
+        ('Most Read Author', ('I11', 'I11')),
+        ('Books By Most Read Author', ('I12', 'I12')),
+        ('Most Read Author Share', ('J12', 'J12')),
+        ('Different Authors Read', ('I13', 'I13')),
+        ('Most Read Genre', ('I14', 'I14')),
+        ('Books of Most Read Genre', ('I15', 'I15')),
+        ('Most Read Genre Share', ('J15', 'J15')),
+        ('Different Genres Read', ('I16', 'I16')),
+    ])
+
+    def __init__(self):
+        """ReadingStats constructor with every total at zero."""
+        self.books = 0
+        self.pages = 0
+        self.fiction = 0
+        self.nonfiction = 0
+        self.authors = collections.Counter()
+        self.genres = collections.Counter()
+
+    @staticmethod
+    def counts(info):
+        """Return the (kind, key, count) rows a book adds to the totals."""
+        category = ('nonfiction' if info['category'] == 'Nonfiction'
+                    else 'fiction')
+        return [('total', 'books', 1), ('total', 'pages', info['pages'] or 0),
+                ('total', category, 1), ('author', info['author'], 1),
+                ('genre', info['genre'], 1)]
+
+    def add_count(self, kind, key, count):
+        """Add count to a total, author or genre count of the totals."""
+        if kind == 'total':
+            setattr(self, key, getattr(self, key) + count)
+        elif kind == 'author':
+            self.authors[key] += count
+        else:
+            self.genres[key] += count
+
+    def add(self, info):
+        """Add a book's information to the running totals."""
+        for kind, key, count in self.counts(info):
+            self.add_count(kind, key, count)
+
+    def summary(self):
+        """Return an OrderedDict of statistic: value, empty without books."""
+        if not self.books:
+            return collections.OrderedDict()
+
+        author, author_count = self.authors.most_common(1)[0]
+        genre, genre_count = self.genres.most_common(1)[0]
+        values = [
+            self.books, self.pages, self.pages / self.books,
+            self.fiction, self.fiction / self.books,
+            self.nonfiction, self.nonfiction / self.books,
+            author, author_count, author_count / self.books,
+            len(self.authors),
+            genre, genre_count, genre_count / self.books,
+            len(self.genres),
+        ]
+        return collections.OrderedDict(zip(self.CELLS, values))
 
-    if not shelved_status:
-        goodreads_shelve(driver, shelves)
+    def cell_values(self, sheet):
+        """Return the summary as cell coordinate: value for a sheet."""
+        column = 0 if sheet == 'Overall' else 1
+        return {self.CELLS[name][column]: value
+                for name, value in self.summary().items()}
+
+
+def print_stats(stats, sheet):
+    """Print a sheet's statistics to the terminal.
+
+    Args:
+        stats (obj): ReadingStats of the sheet.
+        sheet (str): Name of the sheet, Overall or a year formatted YYYY.
+
+    """
+    summary = stats.summary()
+    if not summary:
+        print('No books have been read in {}.'.format(sheet))
+        return
+
+    print('{} Statistics'.format(sheet))
+    for name, value in summary.items():
+        if name.endswith('Share'):
+            value = '{:.0%}'.format(value)
+        elif isinstance(value, float):
+            value = '{:.1f}'.format(value)
+        print('{:<28}{}'.format(name, value))
+
+
+class ReadingHistory:
+    """SQLite store of every book written to the spreadsheet.
+
+    The spreadsheet is generated from the history: new books are exported
+    to it incrementally and it can be fully regenerated with export_history.
+    Books are indexed by read date (stored ISO formatted as read_on), author
+    and genre.
+    """
+
+    columns = ('title', 'author', 'pages', 'category', 'genre', 'date',
+               'url')
+
+    def __init__(self, path):
+        """ReadingHistory constructor to open (and create) the database.
+
+        Args:
+            path (str): Path to the SQLite history database.
+
+        """
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS books (id INTEGER PRIMARY KEY, '
+                'title TEXT, author TEXT, pages INTEGER, category TEXT, '
+                'genre TEXT, date TEXT, read_on TEXT, url TEXT, '
+                'book_id TEXT, exported INTEGER DEFAULT 0)'
+            )
+            for column in ('read_on', 'author', 'genre'):
+                self.connection.execute(
+                    'CREATE INDEX IF NOT EXISTS books_{0} ON books({0})'
+                    .format(column)
+                )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS stat_counts (sheet TEXT, '
+                'kind TEXT, key TEXT, count INTEGER, '
+                'PRIMARY KEY (sheet, kind, key))'
+            )
+        if not self.is_empty() and not self.connection.execute(
+                'SELECT 1 FROM stat_counts LIMIT 1').fetchone():
+            self.rebuild_stats()
+
+    def is_empty(self):
+        """Return whether the history has no books in it."""
+        return not self.connection.execute(
+            'SELECT 1 FROM books LIMIT 1').fetchone()
+
+    def add(self, info, date, exported=False):
+        """Add a book read on date (DD/MM/YYYY) to the history.
+
+        Args:
+            info (dict): Information about the book, optionally with a 'url'.
+            date (str): Date the book was finished formatted DD/MM/YYYY.
+            exported (bool): Whether the book is already in the spreadsheet.
+
+        """
+        with self.connection:
+            self.insert(info, date, exported)
+
+    def insert(self, info, date, exported=False):
+        """Insert a book and count it in its sheets' totals, uncommitted.
+
+        Only the counts the book changes are updated, so each book costs the
+        same however many authors and genres the history has.
+        """
+        url = info.get('url')
+        self.connection.execute(
+            'INSERT INTO books (title, author, pages, category, genre, '
+            'date, read_on, url, book_id, exported) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (info['title'], info['author'], info['pages'],
+             info['category'], info['genre'], date,
+             '{}-{}-{}'.format(date[6:], date[3:5], date[:2]), url,
+             book_id(url) if url else None, int(exported))
+        )
+        self.count(info, date)
+
+    def count(self, info, date):
+        """Add a book to the Overall and year sheet totals, uncommitted."""
+        self.connection.executemany(
+            'INSERT INTO stat_counts VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (sheet, kind, key) '
+            'DO UPDATE SET count = count + excluded.count',
+            [(sheet, kind, key, count) for sheet in ('Overall', date[-4:])
+             for kind, key, count in ReadingStats.counts(info)]
+        )
+
+    def stats(self, sheet):
+        """Return the ReadingStats of a sheet (Overall or a year YYYY)."""
+        stats = ReadingStats()
+        # Ties for most read go to the first read, as the rows are created
+        for kind, key, count in self.connection.execute(
+                'SELECT kind, key, count FROM stat_counts WHERE sheet = ? '
+                'ORDER BY rowid', (sheet,)):
+            stats.add_count(kind, key, count)
+        return stats
+
+    def rebuild_stats(self):
+        """Recalculate every sheet's statistics from the books."""
+        with self.connection:
+            self.connection.execute('DELETE FROM stat_counts')
+            for _, (info, date) in self.records():
+                self.count(info, date)
+
+    def records(self, unexported_only=False):
+        """Return (id, (info, date)) tuples of books in the order added."""
+        query = 'SELECT id, {} FROM books'.format(', '.join(self.columns))
+        if unexported_only:
+            query += ' WHERE exported = 0'
+        records = []
+        for row in self.connection.execute(query + ' ORDER BY id'):
+            info = dict(zip(self.columns, row[1:]))
+            records.append((row[0], (info, info.pop('date'))))
+        return records
+
+    def mark_exported(self, ids):
+        """Mark the books with the given ids as written to the spreadsheet."""
+        with self.connection:
+            self.connection.executemany(
+                'UPDATE books SET exported = 1 WHERE id = ?',
+                [(book,) for book in ids]
+            )
+
+    def import_sheet(self, sheet):
+        """Add the books already on a spreadsheet sheet as exported.
+
+        Args:
+            sheet (obj): openpyxl sheet object, normally Overall.
+
+        """
+        with self.connection:
+            for row in range(2, first_blank_row(sheet)):
+                values = [sheet.cell(row=row, column=column).value
+                          for column in range(1, 7)]
+                if values[0] in (None, ''):
+                    continue
+                if isinstance(values[5], dt):
+                    values[5] = values[5].strftime('%d/%m/%Y')
+                info = dict(zip(self.columns[:5], values[:5]))
+                self.insert(info, str(values[5]), exported=True)
+
+
+def open_history(settings):
+    """Open the reading history, seeding a new one from the spreadsheet.
+
+    Args:
+        settings (dict): Dictionary of user settings.
+
+    Returns:
+        ReadingHistory object or None if the history setting is blank.
+
+    """
+    import openpyxl
+
+    path = settings.get('history', './history.db')
+    if not path:
+        return None
+
+    history = ReadingHistory(path)
+    if history.is_empty():
+        with span('workbook load'):
+            workbook = openpyxl.load_workbook(settings['path'])
+        history.import_sheet(workbook['Overall'])
+    return history
+
+
+def save_records(settings, records, workbook=None):
+    """Add books to the reading history and export them to the spreadsheet.
 
-    driver.close()
-    print('Goodreads account updated.')
+    Args:
+        settings (dict): Dictionary of user settings.
+        records (list): (info, date) tuples in the order to write them.
+        workbook (obj): Unsaved workbook from prepare_spreadsheet, if any.
+
+    """
+    history = open_history(settings)
+    if history is None:
+        write_records(settings['path'], records, workbook=workbook)
+        return
+
+    for info, date in records:
+        history.add(info, date)
+    export_history(history, settings['path'], workbook=workbook)
+
+
+def export_history(history, path, full=False, workbook=None):
+    """Write the reading history's books to the spreadsheet.
+
+    Args:
+        history (obj): ReadingHistory object.
+        path (str): Path to spreadsheet.
+        full (bool): Regenerate every book row rather than only appending
+                     the books not exported yet.
+        workbook (obj): Unsaved workbook from prepare_spreadsheet to append
+                        the rows to, if any.
+
+    """
+    import openpyxl
+
+    if not full:
+        unexported = history.records(unexported_only=True)
+        if unexported:
+            sheets = {'Overall'} | {date[-4:] for _, (_, date) in unexported}
+            write_records(path, [record for _, record in unexported],
+                          {sheet: history.stats(sheet) for sheet in sheets},
+                          workbook)
+            history.mark_exported([book for book, _ in unexported])
+        return
+
+    records = history.records()
+    with span('workbook load'):
+        workbook = openpyxl.load_workbook(path)
+    for sheet in workbook.sheetnames:
+        if sheet != TEMPLATE_SHEET:
+            clear_rows(workbook[sheet])
+    input_infos(workbook, [record for _, record in records], path)
+    history.mark_exported([book for book, _ in records])
+    append_rows_xlsx(path, {}, {
+        sheet: history.stats(sheet).cell_values(sheet)
+        for sheet in workbook.sheetnames if sheet != TEMPLATE_SHEET
+    })
+
+
+def prepare_spreadsheet(settings, year):
+    """Do the slow spreadsheet work a book's row needs ahead of saving it.
+
+    Opens the reading history, which imports the spreadsheet if it's new,
+    and if the year's sheet is missing loads the workbook and creates it.
+    Nothing is saved, so the spreadsheet is untouched until save_records is
+    given the workbook along with the row.
+
+    Args:
+        settings (dict): Dictionary of user settings.
+        year (str): The year the book was read formatted YYYY.
+
+    Returns:
+        The openpyxl workbook with the new year sheet, or None if the sheet
+        already exists and the row can be streamed in.
+
+    """
+    open_history(settings)
+    path = settings['path']
+    with zipfile.ZipFile(path) as archive:
+        if year in xlsx_sheet_parts(archive):
+            return None
+    return check_year_sheet_exists(path, year)
+
+
+def book_record(url, shelves, page_source, date):
+    """Return the spreadsheet record of a book updated on Goodreads.
+
+    Args:
+        url (str): The book's Goodreads URL.
+        shelves (list): The book's shelves from goodreads_get_shelves.
+        page_source (str): Source of the book page, or None to fetch it.
+        date (str): Date the book was read formatted DD/MM/YYYY.
+
+    Returns:
+        Tuple of the book's info dictionary and date.
 
-    print('Updating Spreadsheet...')
-    info = parse_page(url)
+    """
+    info = parse_pages([(url, page_source)])[0]
     info['category'], info['genre'] = category_and_genre(shelves)
-    workbook = check_year_sheet_exists(settings['path'], details['date'][-4:])
+    info['url'] = url
+    return (info, date)
+
+
+def print_info(info, date):
+    """Print the book information that was written to the spreadsheet."""
+    print(info['title'], info['author'], info['pages'],
+          info['category'], info['genre'], date, sep='\n')
+
+
+def run_batch(books, settings):
+    """Update Goodreads and the spreadsheet for every book in a batch.
+
+    The books are shared out between a pool of logged in drivers, the size
+    of which is set by the 'workers' setting, while this thread collects
+    their results in batch file order. Each book's page starts being parsed
+    in the parsing pool as soon as its result arrives, and the rows are
+    written with a single load and save of the workbook after the last book
+    (or an error) so that completed books are always recorded.
+
+    Args:
+        books (list): Book details dictionaries from read_batch_file.
+        settings (dict): Dictionary of user settings.
+
+    """
+    jobs = queue.Queue()
+    for job in enumerate(books, 1):
+        journal_job(job[1])
+        jobs.put(job)
+    results = queue.Queue()
+
+    worker_count = max(1, min(int(settings.get('workers', '1')), len(books)))
+    for _ in range(worker_count):
+        threading.Thread(target=goodreads_worker,
+                         args=(settings, jobs, results), daemon=True).start()
+
+    pending = {}
+    next_number = 1
+    finished = []
+    try:
+        stopped_workers = 0
+        while stopped_workers < worker_count:
+            result = results.get()
+            if result is None:
+                stopped_workers += 1
+                continue
+
+            number, details, update = result
+            parsed = None
+            if update:
+                parsed = submit_parse(update[2], in_pool=len(books) > 1)
+            pending[number] = (details, update, parsed)
+            while next_number in pending:
+                finished.append(pending.pop(next_number))
+                next_number += 1
+    except BaseException:
+        # Record the books completed before the error, then raise it
+        try:
+            save_batch(settings, finished, pending)
+        except Exception as error:
+            print('Failed to save the completed books: {}'.format(error))
+        raise
+
+    for number, details in enumerate(books, 1):
+        if number >= next_number and number not in pending:
+            print('Book {} ({}) was never attempted.'.format(
+                number, details.get('url') or details.get('search')))
+    records = save_batch(settings, finished, pending)
+
+    print('Ligrarian has completed {} of {} books.'.format(len(records),
+                                                           len(books)))
+
+
+def save_batch(settings, finished, pending):
+    """Save the records of the finished batch books and finish their jobs.
+
+    Args:
+        settings (dict): Dictionary of user settings.
+        finished (list): (details, update, parsed) tuples in batch order.
+        pending (dict): Number: (details, update, parsed) tuple of books
+                        finished after a gap in the numbering left by a
+                        book that was never attempted.
+
+    Returns:
+        List of the (info, date) records saved.
+
+    """
+    finished = finished + [pending[number] for number in sorted(pending)]
+    records = batch_records(finished)
+    if records:
+        save_records(settings, records)
+        journal_finish([details for details, update, _ in finished
+                        if update])
+    return records
+
+
+def batch_records(finished):
+    """Return the spreadsheet records of batch books updated on Goodreads.
+
+    Pages that couldn't be parsed, or have no page source, are parsed with
+    parse_page instead.
+
+    Args:
+        finished (list): (details, update, parsed) tuples of book details
+                         from read_batch_file, the (url, shelves,
+                         page_source) tuple from goodreads_update, or None
+                         if the Goodreads update failed, and the future
+                         from submit_parse of the page source.
+
+    Returns:
+        List of (info, date) records of the updated books in order.
+
+    """
+    records = []
+    for details, update, parsed in finished:
+        if not update:
+            print('Skipping {} as Goodreads was not updated.'.format(
+                details.get('url') or details.get('search')))
+            continue
+
+        url, shelves, page_source = update
+        try:
+            info = parsed.result() if parsed else None
+        except futures.process.BrokenProcessPool:
+            info = try_parse_book_html(page_source)
+        if info is None:
+            info = parse_page(url)
+        elif _page_cache:
+            _page_cache.store(url, info, html=page_source)
+        info['category'], info['genre'] = category_and_genre(shelves)
+        info['url'] = url
+        print_info(info, details['date'])
+        records.append((info, details['date']))
+    return records
+
+
+class DebouncedSaver:
+    """Buffers records and saves them once none have arrived for a while.
+
+    A burst of books marked as read is saved with one write rather than one
+    per book.
+    """
+
+    def __init__(self, settings, delay):
+        """DebouncedSaver constructor.
+
+        Args:
+            settings (dict): Dictionary of user settings.
+            delay (float): Seconds to wait after the last record is added
+                           before saving.
+
+        """
+        self.settings = settings
+        self.delay = delay
+        self.records = []
+        self.details = []
+        self.timer = None
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+
+    def add(self, records, details_list=()):
+        """Buffer records, restarting the wait before they're saved.
 
-    input_info(workbook, info, details['date'], settings['path'])
+        Args:
+            records (list): (info, date) tuples to save.
+            details_list (list): Book details of the records whose journal
+                                 jobs are finished once they're saved.
+
+        """
+        with self.lock:
+            self.records += records
+            self.details += details_list
+            if self.timer:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Save every buffered record now."""
+        with self.save_lock:
+            with self.lock:
+                records, self.records = self.records, []
+                details_list, self.details = self.details, []
+                if self.timer:
+                    self.timer.cancel()
+                    self.timer = None
+            if records:
+                save_records(self.settings, records)
+                journal_finish(details_list)
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Handles a book sent by send_to_server, replying once it's done."""
+
+    def handle(self):
+        """Update Goodreads for the book and buffer its spreadsheet row."""
+        line = self.rfile.readline()
+        if not line:
+            # send_to_server checking the server is listening
+            return
+        try:
+            details = json.loads(line.decode('utf-8'))
+            journal_job(details)
+            update = self.server.submit(details)
+            if update is None:
+                reply = {'error': 'Goodreads was not updated.'}
+            else:
+                info, date = book_record(*update, details['date'])
+                self.server.saver.add([(info, date)], [details])
+                reply = {'info': info, 'date': details['date']}
+        except Exception as error:
+            reply = {'error': 'The server failed to record the book: '
+                              '{}'.format(error)}
+        self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+class LigrarianServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    """Unix socket server sharing a pool of logged in drivers between jobs.
+
+    The drivers are started and logged in once when the server starts, and
+    rows are saved by a DebouncedSaver, so each job only costs the Goodreads
+    steps themselves. Closing the server waits for the books being handled
+    before stopping the drivers and saving their rows.
+    """
+
+    def __init__(self, path, settings):
+        """LigrarianServer constructor, starting the driver pool.
+
+        Args:
+            path (str): Path of the Unix socket to listen on.
+            settings (dict): Dictionary of user settings.
+
+        """
+        super().__init__(path, JobHandler)
+        self.saver = DebouncedSaver(
+            settings, float(settings.get('flush_delay', '5'))
+        )
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.replies = {}
+        self.replies_lock = threading.Lock()
+        self.job_numbers = itertools.count(1)
+        self.worker_count = max(1, int(settings.get('workers', '1')))
+
+        self.workers = [
+            threading.Thread(target=goodreads_worker,
+                             args=(settings, self.jobs, self.results, True),
+                             daemon=True)
+            for _ in range(self.worker_count)
+        ]
+        for worker in self.workers:
+            worker.start()
+        threading.Thread(target=self.dispatch, daemon=True).start()
+
+    def submit(self, details):
+        """Queue a book for the drivers and wait for its update.
+
+        Args:
+            details (dict): Book details as taken by goodreads_update.
+
+        Returns:
+            Tuple returned by goodreads_update, or None if it failed.
+
+        """
+        reply = queue.Queue()
+        with self.replies_lock:
+            number = next(self.job_numbers)
+            self.replies[number] = reply
+        self.jobs.put((number, details))
+        return reply.get()
+
+    def dispatch(self):
+        """Pass each finished job's update to the handler waiting for it."""
+        stopped_workers = 0
+        while stopped_workers < self.worker_count:
+            result = self.results.get()
+            if result is None:
+                stopped_workers += 1
+                continue
+            number, _, update = result
+            with self.replies_lock:
+                self.replies.pop(number).put(update)
+
+        # No drivers are left to take the jobs still waiting
+        with self.replies_lock:
+            for reply in self.replies.values():
+                reply.put(None)
+            self.replies.clear()
+
+    def server_close(self):
+        """Stop the drivers, save buffered rows and remove the socket."""
+        # Also waits for the handlers, whose books still need the drivers
+        super().server_close()
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.saver.flush()
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+
+def run_server(settings):
+    """Serve jobs from send_to_server until interrupted.
+
+    Args:
+        settings (dict): Dictionary of user settings.
+
+    """
+    path = settings.get('socket', './ligrarian.sock')
+    if os.path.exists(path):
+        if send_to_server(settings, None) is not None:
+            print('Ligrarian is already serving on {}.'.format(path))
+            return
+        os.remove(path)
+
+    server = LigrarianServer(path, settings)
+    print('Ligrarian is serving on {} (Ctrl+C to stop).'.format(path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def send_to_server(settings, details):
+    """Send a book to a running server and return its reply.
+
+    Args:
+        settings (dict): Dictionary of user settings.
+        details (dict): Book details as taken by goodreads_update, or None
+                        to only check whether a server is listening.
+
+    Returns:
+        Dictionary of the reply, with either 'info' and 'date' or 'error',
+        or None if no server is listening. Checking returns an empty
+        dictionary if a server is listening.
+
+    """
+    path = settings.get('socket', './ligrarian.sock')
+    if not path or not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(path)
+        except OSError:
+            return None
+        if details is None:
+            return {}
+        connection.sendall(json.dumps(details).encode('utf-8') + b'\n')
+        with connection.makefile('rb') as replies:
+            reply = replies.readline()
+    try:
+        return json.loads(reply.decode('utf-8'))
+    except ValueError:
+        return {'error': 'The server closed the connection without '
+                         'replying.'}
+
+
+def main():
+    """Coordinate updating of Goodreads account and writing to spreadsheet."""
+    args = parse_arguments()
+    if args.pop('import_times'):
+        time_imports()
+        atexit.register(print_import_times)
+    profile, trace_path = args.pop('profile'), args.pop('trace')
+    if profile or trace_path:
+        atexit.register(report_profile, start_profiling(), trace_path)
+    try:
+        open("settings.ini")
+    except FileNotFoundError:
+        write_initial_config()
+
+    settings = retrieve_settings()
+    configure_http(settings)
+    configure_caches(settings)
+    configure_waits(settings)
+    configure_journal(settings)
+
+    if 'export' in args:
+        history = open_history(settings)
+        if history is None:
+            print('Set a history path in settings.ini to export from.')
+            return
+        export_history(history, settings['path'], args['full'])
+        print('Spreadsheet exported from the reading history.')
+        return
+
+    if 'enrich' in args:
+        written, failed = write_enrichment(read_url_file(args['enrich']),
+                                           settings, args['output'])
+        print('Ligrarian has written {} books to {} ({} failed).'.format(
+            written, args['output'], failed))
+        return
+
+    if 'stats' in args:
+        history = open_history(settings)
+        if history is None:
+            print('Set a history path in settings.ini to show statistics.')
+            return
+        print_stats(history.stats(args['stats']), args['stats'])
+        return
+
+    if 'resume' in args:
+        if _journal is None:
+            print('Set a journal path in settings.ini to resume jobs.')
+            return
+        books = _journal.pending()
+        if args['discard']:
+            journal_finish(books)
+            print('Discarded {} unfinished jobs.'.format(len(books)))
+            return
+        if not books:
+            print('There are no unfinished jobs to resume.')
+            return
+        check_and_prompt_for_email_password(settings)
+        run_batch(books, settings)
+        write_config(settings['email'], settings['password'],
+                     settings['prompt'])
+        return
+
+    if 'serve' in args:
+        check_and_prompt_for_email_password(settings)
+        run_server(settings)
+        write_config(settings['email'], settings['password'],
+                     settings['prompt'])
+        return
+
+    if 'batch' in args:
+        books = read_batch_file(args['batch'])
+        for details in books:
+            details['refresh'] = args['refresh']
+        check_and_prompt_for_email_password(settings)
+        run_batch(books, settings)
+        write_config(settings['email'], settings['password'],
+                     settings['prompt'])
+        return
+
+    if 'gui' in args:
+        gui_instance = create_gui(settings)
+        details = gui_mode_details_edits(gui_instance)
+
+    else:
+        details = args
+        # Process date if given as (t)oday or (y)esterday into proper format
+        details['date'] = process_date(details['date'])
+
+    reply = send_to_server(settings, details)
+    if reply is not None:
+        if 'error' in reply:
+            print(reply['error'])
+            return
+        print(('Ligrarian has completed. The following information will be '
+               'written to the spreadsheet by the server:'))
+        print_info(reply['info'], reply['date'])
+        write_config(settings['email'], settings['password'],
+                     settings['prompt'])
+        return
+
+    if 'gui' not in args:
+        check_and_prompt_for_email_password(settings)
+
+    journal_job(details)
+    # Spreadsheet work runs in the background while the browser is busy
+    with futures.ThreadPoolExecutor(max_workers=1) as background:
+        prepared = background.submit(prepare_spreadsheet, settings,
+                                     details['date'][-4:])
+        records = []
+
+        def record_page(url, shelves, page_source):
+            records.append(background.submit(book_record, url, shelves,
+                                             page_source, details['date']))
+
+        update = None
+        if settings.get('engine') == 'http':
+            update = http_try_update(http_start_session(settings), details)
+        if update is None:
+            driver = create_driver(settings['headless'])
+            goodreads_start_session(driver, settings)
+            update = goodreads_update(driver, details, record_page)
+            driver.close()
+        print('Goodreads account updated.')
+
+        print('Updating Spreadsheet...')
+        workbook = prepared.result()
+        if records:
+            info, date = records[0].result()
+        else:
+            info, date = book_record(*update, details['date'])
+    save_records(settings, [(info, date)], workbook)
+    journal_finish([details])
 
     print(('Ligrarian has completed and will now close. The following '
            'information has been written to the spreadsheet:'))
-    print(info['title'], info['author'], info['pages'],
-          info['category'], info['genre'], details['date'], sep='\n')
+    print_info(info, details['date'])
 
     write_config(settings['email'], settings['password'], settings['prompt'])
 
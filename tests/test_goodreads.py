@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
 
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+import urllib.parse
+
+import bs4
 import pytest
+from selenium.webdriver.common.by import By
 import unittest.mock as mock
+from urllib3.util.retry import Retry
 
 import ligrarian
 
@@ -14,26 +22,26 @@ class TestCreateDriver:
     default, non-headless webdriver.
     """
 
-    @mock.patch('ligrarian.webdriver.Firefox')
+    @mock.patch('selenium.webdriver.Firefox')
     def test_create_driver(self, mocked_driver):
         """Headless False should create non-headless (no call args) driver."""
         ligrarian.create_driver(False)
         assert mocked_driver.call_args == ''
 
-    @mock.patch('ligrarian.webdriver.Firefox')
+    @mock.patch('selenium.webdriver.Firefox')
     def test_create_headless_driver(self, mocked_driver):
         """Headless True should create headless (call args) driver."""
         ligrarian.create_driver(True)
         assert mocked_driver.call_args != ''
 
-    @mock.patch('ligrarian.webdriver.Firefox')
+    @mock.patch('selenium.webdriver.Firefox')
     def test_create_driver_message(self, mocked_driver, capsys):
         """Headless False should print non-headless message."""
         ligrarian.create_driver(False)
         captured_stdout = capsys.readouterr()[0]
         assert "headless" not in captured_stdout
 
-    @mock.patch('ligrarian.webdriver.Firefox')
+    @mock.patch('selenium.webdriver.Firefox')
     def test_create_driver_headless_message(self, mocked_driver, capsys):
         """Headless True should print headless message."""
         ligrarian.create_driver(True)
@@ -58,20 +66,792 @@ class TestCategoryAndGenre:
 class TestGetShelvedStatus:
     """Test function returns correct boolean for shelved and unshelved."""
 
-    @mock.patch('ligrarian.webdriver.firefox')
+    @mock.patch('selenium.webdriver.firefox')
     def test_shelved_returns_true(self, mocked_driver):
-        """Seleniums NoSuchElementException being raised indicates shelved."""
-        mocked_driver.find_element_by_class_name.side_effect = (
-                ligrarian.NoSuchElementException
-        )
+        """No 'want to read' element present indicates shelved."""
+        mocked_driver.find_elements.return_value = []
         read_status = ligrarian.goodreads_get_shelved_status(mocked_driver)
 
         assert read_status is True
 
-    @mock.patch('ligrarian.webdriver.firefox')
+    @mock.patch('selenium.webdriver.firefox')
     def test_unshelved_book_returns_false(self, mocked_driver):
-        """Successfull element_by_class_name query indicated unshelved."""
-        mocked_driver.find_element_by_class_name.return_value = "Found"
+        """A present 'want to read' element indicates unshelved."""
+        mocked_driver.find_elements.return_value = ["Found"]
         read_status = ligrarian.goodreads_get_shelved_status(mocked_driver)
 
         assert read_status is False
+
+
+class TestWaits:
+    """Test explicit waits use per-step timeouts and presence doesn't wait."""
+
+    def teardown_method(self):
+        """Reset the wait settings changed by the tests."""
+        ligrarian.configure_waits({})
+
+    def test_default_timeout(self):
+        """Steps without an override should use wait_timeout."""
+        ligrarian.configure_waits({'wait_timeout': '4'})
+        assert ligrarian.step_timeout('find') == 4
+
+    def test_step_timeout_override(self):
+        """A wait_<step> setting should override wait_timeout."""
+        ligrarian.configure_waits({'wait_timeout': '4', 'wait_shelve': '9'})
+        assert ligrarian.step_timeout('shelve') == 9
+
+    @mock.patch('selenium.webdriver.support.ui.WebDriverWait')
+    def test_wait_for_uses_step_timeout(self, mock_wait):
+        """wait_for should wait for the step's timeout on the condition."""
+        ligrarian.configure_waits({'wait_find': '3'})
+        mock_driver = mock.MagicMock()
+        mock_condition = mock.MagicMock()
+        element = ligrarian.wait_for(mock_driver, 'id', 'x', 'find',
+                                     mock_condition)
+
+        mock_wait.assert_called_once_with(mock_driver, 3)
+        mock_condition.assert_called_once_with(('id', 'x'))
+        assert element == mock_wait.return_value.until.return_value
+
+    def test_element_present_uses_find_elements(self):
+        """Presence checks should use find_elements so nothing waits."""
+        mock_driver = mock.MagicMock()
+        mock_driver.find_elements.return_value = []
+
+        assert ligrarian.element_present(mock_driver, 'id', 'x') is False
+        mock_driver.find_elements.assert_called_once_with('id', 'x')
+
+
+class TestRestoreSession:
+    """Test function loads saved cookies and reports if they log in."""
+
+    def test_missing_session_file_returns_false(self, tmp_path):
+        """No saved session should return False without using the driver."""
+        mock_driver = mock.MagicMock()
+        restored = ligrarian.goodreads_restore_session(
+                mock_driver, str(tmp_path / 'session.json')
+        )
+
+        assert restored is False
+        mock_driver.get.assert_not_called()
+
+    def test_cookies_added_to_driver(self, tmp_path):
+        """Each saved cookie should be added to the driver."""
+        session = tmp_path / 'session.json'
+        session.write_text('[{"name": "a", "value": "1"}]')
+        mock_driver = mock.MagicMock()
+        ligrarian.goodreads_restore_session(mock_driver, str(session))
+
+        mock_driver.add_cookie.assert_called_once_with(
+                {'name': 'a', 'value': '1'}
+        )
+
+    def test_rejected_session_returns_false(self, tmp_path):
+        """No personal site header after refresh means not logged in."""
+        session = tmp_path / 'session.json'
+        session.write_text('[]')
+        mock_driver = mock.MagicMock()
+        mock_driver.find_elements.return_value = []
+
+        assert ligrarian.goodreads_restore_session(
+                mock_driver, str(session)) is False
+
+
+class TestStartSession:
+    """Test function only logs in when the saved session is rejected."""
+
+    @mock.patch('ligrarian.goodreads_save_session')
+    @mock.patch('ligrarian.goodreads_login')
+    @mock.patch('ligrarian.goodreads_restore_session', return_value=True)
+    def test_restored_session_skips_login(self, mock_restore, mock_login,
+                                          mock_save):
+        """A restored session should not log in again."""
+        settings = {'email': 'e', 'password': 'p', 'session': 'session.json'}
+        ligrarian.goodreads_start_session(mock.MagicMock(), settings)
+
+        mock_login.assert_not_called()
+
+    @mock.patch('ligrarian.goodreads_save_session')
+    @mock.patch('ligrarian.goodreads_login')
+    @mock.patch('ligrarian.goodreads_restore_session', return_value=False)
+    def test_rejected_session_logs_in_and_saves(self, mock_restore,
+                                                mock_login, mock_save):
+        """A rejected session should log in and save the new cookies."""
+        settings = {'email': 'e', 'password': 'p', 'session': 'session.json'}
+        mock_driver = mock.MagicMock()
+        ligrarian.goodreads_start_session(mock_driver, settings)
+
+        mock_login.assert_called_once_with(mock_driver, 'e', 'p')
+        mock_save.assert_called_once_with(mock_driver, 'session.json')
+
+
+@mock.patch('ligrarian.goodreads_start_session')
+@mock.patch('ligrarian.create_driver')
+class TestGoodreadsWorker:
+    """Test worker drains the job queue and reports every job it takes."""
+
+    def run_worker(self, jobs):
+        """Run a worker over jobs and return everything put on results."""
+        job_queue = ligrarian.queue.Queue()
+        for job in jobs:
+            job_queue.put(job)
+        results = ligrarian.queue.Queue()
+        ligrarian.goodreads_worker({'headless': True}, job_queue, results)
+
+        return [results.get() for _ in range(results.qsize())]
+
+    @mock.patch('ligrarian.goodreads_update', return_value=('url', []))
+    def test_results_then_sentinel(self, mock_update, mock_create,
+                                   mock_start):
+        """Each job's result should be put followed by a final None."""
+        results = self.run_worker([(1, {'a': 1}), (2, {'b': 2})])
+
+        assert results == [(1, {'a': 1}, ('url', [])),
+                           (2, {'b': 2}, ('url', [])), None]
+
+    @mock.patch('ligrarian.goodreads_update', side_effect=ValueError)
+    def test_failed_job_reported(self, mock_update, mock_create, mock_start):
+        """A failing job should be put with None and the driver quit."""
+        results = self.run_worker([(1, {'a': 1})])
+
+        assert results == [(1, {'a': 1}, None), None]
+        mock_create.return_value.quit.assert_called_once()
+
+    @mock.patch('ligrarian.goodreads_update',
+                side_effect=[SystemExit, ('url', [])])
+    def test_exit_replaces_driver(self, mock_update, mock_create,
+                                  mock_start):
+        """An exiting step closed the driver so a new one takes the rest."""
+        results = self.run_worker([(1, {'a': 1}), (2, {'b': 2})])
+
+        assert results == [(1, {'a': 1}, None), (2, {'b': 2}, ('url', [])),
+                           None]
+        assert mock_create.call_count == 2
+        assert mock_create.return_value.quit.call_count == 2
+
+    @mock.patch('ligrarian.goodreads_update')
+    def test_failed_login_stops_worker(self, mock_update, mock_create,
+                                       mock_start):
+        """A worker that can't log in should fail its book and stop."""
+        mock_start.side_effect = SystemExit
+        results = self.run_worker([(1, {'a': 1}), (2, {'b': 2})])
+
+        assert results == [(1, {'a': 1}, None), None]
+        mock_update.assert_not_called()
+        mock_create.return_value.quit.assert_called_once()
+
+
+BOOK_HTML = """
+<html><body>
+<h1 id="bookTitle">
+  Cannery Row
+  <a href="/series">
+    (Cannery Row #1)
+  </a>
+</h1>
+<a class="authorName" href="/author"><span>John Steinbeck</span></a>
+<span itemprop="numberOfPages">181 pages</span>
+</body></html>
+"""
+
+
+class TestParsePage:
+    """Test book info is parsed from given page source or fetched page."""
+
+    def test_parse_book_html(self):
+        """Title with series, author and pages parsed from page source."""
+        assert ligrarian.parse_book_html(BOOK_HTML) == {
+                'title': 'Cannery Row (Cannery Row #1)',
+                'author': 'John Steinbeck',
+                'pages': 181,
+        }
+
+    @mock.patch('ligrarian.http_get')
+    def test_page_source_not_refetched(self, mock_get):
+        """Given page source should be parsed without a request."""
+        info = ligrarian.parse_page('url', BOOK_HTML)
+
+        assert info['author'] == 'John Steinbeck'
+        mock_get.assert_not_called()
+
+    @mock.patch('ligrarian.http_get')
+    def test_unparseable_page_source_fetched(self, mock_get):
+        """Page source missing book info should fall back to fetching."""
+        mock_get.return_value.text = BOOK_HTML
+        info = ligrarian.parse_page('url', '<html></html>')
+
+        mock_get.assert_called_once_with('url', headers={})
+        assert info['pages'] == 181
+
+
+class TestFastParse:
+    """Test book pages are parsed without building the whole page's tree."""
+
+    def test_json_ld_used(self):
+        """Structured data should be used when it describes the book."""
+        html = BOOK_HTML.replace('<html>', """<html><script
+            type="application/ld+json">{"@type": "Book",
+            "name": "East of Eden", "numberOfPages": 601,
+            "author": [{"@type": "Person", "name": "John Steinbeck"}]}
+            </script>""")
+
+        assert ligrarian.parse_book_html(html) == {
+                'title': 'East of Eden', 'author': 'John Steinbeck',
+                'pages': 601}
+
+    def test_incomplete_json_ld_ignored(self):
+        """Structured data missing details should fall back to the HTML."""
+        html = BOOK_HTML.replace('<html>', """<html><script
+            type="application/ld+json">{"@type": "Book",
+            "name": "East of Eden"}</script>""")
+
+        assert ligrarian.parse_book_html(html)['pages'] == 181
+
+    def test_only_book_fragments_parsed(self):
+        """The strainer should keep the book elements and nothing else."""
+        soup = bs4.BeautifulSoup(
+                BOOK_HTML.replace('<body>', '<body><p>Other</p>'),
+                'html.parser',
+                parse_only=bs4.SoupStrainer(ligrarian.book_fragment))
+
+        assert 'Other' not in soup.getText()
+        assert ligrarian.book_info_from_soup(soup)['title'] == (
+                'Cannery Row (Cannery Row #1)')
+
+    @mock.patch('ligrarian.book_fragment', return_value=False)
+    def test_full_parse_fallback(self, mock_fragment):
+        """A failed fragment parse should fall back to the full parse."""
+        assert ligrarian.parse_book_html(BOOK_HTML)['author'] == (
+                'John Steinbeck')
+
+
+class TestParsePages:
+    """Test page sources are parsed in order using the process pool."""
+
+    @mock.patch('ligrarian._page_cache', None)
+    def test_order_kept_across_pool(self):
+        """Infos should be returned in the order of the pages given."""
+        pages = [('url{}'.format(number),
+                  BOOK_HTML.replace('Cannery Row', 'Book {}'.format(number)))
+                 for number in range(6)]
+        infos = ligrarian.parse_pages(pages)
+
+        assert [info['title'].split(' (')[0] for info in infos] == [
+                'Book {}'.format(number) for number in range(6)]
+
+    @mock.patch('ligrarian._parse_pool', None)
+    @mock.patch('ligrarian.futures.ProcessPoolExecutor')
+    def test_pool_processes_not_forked(self, mock_executor):
+        """The pool shouldn't fork the threaded process it's created in."""
+        ligrarian.get_parse_pool()
+
+        context = mock_executor.call_args[1]['mp_context']
+        assert context.get_start_method() in ('forkserver', 'spawn')
+
+    @mock.patch('ligrarian._page_cache', None)
+    @mock.patch('ligrarian.get_parse_pool')
+    def test_single_page_parsed_without_pool(self, mock_pool):
+        """A single page shouldn't wait on the process pool."""
+        info = ligrarian.parse_pages([('url', BOOK_HTML)])[0]
+
+        assert info['pages'] == 181
+        mock_pool.assert_not_called()
+
+    @mock.patch('ligrarian._page_cache', None)
+    @mock.patch('ligrarian.parse_page', return_value={'title': 'fetched'})
+    def test_unparseable_pages_fetched(self, mock_parse):
+        """Pages without parseable source should go through parse_page."""
+        infos = ligrarian.parse_pages([('url1', BOOK_HTML),
+                                       ('url2', '<html></html>'),
+                                       ('url3', None)])
+
+        assert infos[0]['author'] == 'John Steinbeck'
+        assert infos[1:] == [{'title': 'fetched'}] * 2
+        assert mock_parse.call_args_list == [mock.call('url2'),
+                                             mock.call('url3')]
+
+    @mock.patch('ligrarian._page_cache', None)
+    @mock.patch('ligrarian.parse_page', return_value={'title': 'fetched'})
+    def test_batch_records_use_submitted_parses(self, mock_parse):
+        """Batch records should use each page's parse or fetch the page."""
+        shelves = ['Fiction', 'Classics']
+        finished = [
+            ({'date': '01/02/2018'}, ('url1', shelves, BOOK_HTML),
+             ligrarian.submit_parse(BOOK_HTML)),
+            ({'date': '02/02/2018'}, ('url2', shelves, None),
+             ligrarian.submit_parse(None)),
+            ({'url': 'url3'}, None, None),
+        ]
+        with mock.patch('ligrarian.print_info'):
+            records = ligrarian.batch_records(finished)
+
+        assert [info['title'] for info, _ in records] == [
+                'Cannery Row (Cannery Row #1)', 'fetched']
+        assert records[0][0]['url'] == 'url1'
+        mock_parse.assert_called_once_with('url2')
+
+    @mock.patch('ligrarian.http_get')
+    def test_fetched_page_parsed_in_pool(self, mock_get):
+        """A fetched page should be parsed by the pool when asked to."""
+        mock_get.return_value.text = BOOK_HTML
+        mock_get.return_value.status_code = 200
+        with mock.patch('ligrarian._page_cache', None):
+            info = ligrarian.parse_page('url', in_pool=True)
+
+        assert info['title'] == 'Cannery Row (Cannery Row #1)'
+
+
+class TestPageCache:
+    """Test parsed pages are cached, expired, revalidated and evicted."""
+
+    url = 'https://www.goodreads.com/book/show/4799.Cannery_Row'
+    info = {'title': 'Cannery Row', 'author': 'John Steinbeck', 'pages': 181}
+
+    def create_cache(self, tmp_path, ttl=60, max_entries=10):
+        """Return a PageCache in tmp_path."""
+        return ligrarian.PageCache(str(tmp_path / 'cache.db'), ttl,
+                                   max_entries)
+
+    def test_book_id_from_url(self):
+        """The numeric ID should be taken from a book URL."""
+        assert ligrarian.book_id(self.url) == '4799'
+
+    def test_stored_entry_fresh(self, tmp_path):
+        """An entry within its ttl should be returned as fresh."""
+        cache = self.create_cache(tmp_path)
+        cache.store(self.url, self.info, etag='"abc"')
+        entry = cache.lookup(self.url + '?from_search=true')
+
+        assert entry['info'] == self.info
+        assert entry['etag'] == '"abc"'
+        assert entry['fresh']
+
+    def test_expired_entry_stale(self, tmp_path):
+        """An entry past its ttl should be returned as stale."""
+        cache = self.create_cache(tmp_path, ttl=0)
+        cache.store(self.url, self.info)
+
+        assert not cache.lookup(self.url)['fresh']
+
+    def test_least_recently_used_evicted(self, tmp_path):
+        """Storing past max_entries should evict the least recently used."""
+        cache = self.create_cache(tmp_path, max_entries=2)
+        cache.store('/book/show/1', self.info)
+        cache.store('/book/show/2', self.info)
+        cache.lookup('/book/show/1')
+        cache.store('/book/show/3', self.info)
+
+        assert cache.lookup('/book/show/2') is None
+        assert cache.lookup('/book/show/1') is not None
+
+    @mock.patch('ligrarian.http_get')
+    def test_fresh_entry_not_fetched(self, mock_get, tmp_path):
+        """parse_page should return a fresh entry without a request."""
+        cache = self.create_cache(tmp_path)
+        cache.store(self.url, self.info)
+        with mock.patch('ligrarian._page_cache', cache):
+            assert ligrarian.parse_page(self.url) == self.info
+
+        mock_get.assert_not_called()
+
+    @mock.patch('ligrarian.http_get')
+    def test_stale_entry_revalidated(self, mock_get, tmp_path):
+        """A 304 for a stale entry should return and refresh the entry."""
+        cache = self.create_cache(tmp_path, ttl=0)
+        cache.store(self.url, self.info, etag='"abc"')
+        mock_get.return_value.status_code = 304
+        with mock.patch('ligrarian._page_cache', cache):
+            assert ligrarian.parse_page(self.url) == self.info
+
+        mock_get.assert_called_once_with(
+                self.url, headers={'If-None-Match': '"abc"'}
+        )
+
+
+class TestHttpSession:
+    """Test the shared HTTP session is pooled, retrying and timed out."""
+
+    def test_adapter_retry_settings(self):
+        """Retries, backoff and pool size should come from the settings."""
+        session = ligrarian.create_http_session(
+                {'http_retries': '5', 'http_backoff': '2',
+                 'http_connections': '4'}
+        )
+        adapter = session.get_adapter('https://www.goodreads.com')
+
+        assert adapter.max_retries.total == 5
+        assert adapter.max_retries.backoff_factor == 2
+        assert adapter.max_retries.respect_retry_after_header
+        assert adapter._pool_maxsize == 4
+
+    def test_backoff_jittered_below_exponential(self):
+        """Jittered backoff should never exceed the exponential backoff."""
+        session = ligrarian.create_http_session({'http_retries': '5',
+                                                 'http_backoff': '1'})
+        retry = session.get_adapter('https://www.goodreads.com').max_retries
+        for _ in range(3):
+            retry = retry.increment(method='GET', url='/')
+        exponential = Retry.get_backoff_time(retry)
+
+        assert 0 <= retry.get_backoff_time() <= exponential
+
+    @mock.patch('ligrarian.get_http_session')
+    def test_http_get_uses_configured_timeout(self, mock_session):
+        """http_get should pass the http_timeout setting to the session."""
+        ligrarian.configure_http({'http_timeout': '7'})
+        ligrarian.http_get('url')
+        ligrarian.configure_http({})
+
+        mock_session.return_value.get.assert_called_once_with('url',
+                                                              timeout=7.0)
+
+
+class TestResolutionCache:
+    """Test searches are resolved from the cache before using the driver."""
+
+    details = {'search': 'Cannery  Row!', 'format': 'kindle',
+               'date': '01/01/2020', 'rating': '4', 'review': None}
+
+    def run_update(self, tmp_path, cache_url=None, **details):
+        """Run goodreads_update with mocked steps and a resolution cache."""
+        cache = ligrarian.ResolutionCache(str(tmp_path / 'cache.db'))
+        if cache_url:
+            cache.store('cannery row', 'k', cache_url)
+        mock_driver = mock.MagicMock()
+        with mock.patch.multiple(
+                'ligrarian', goodreads_find=mock.DEFAULT,
+                goodreads_filter=mock.DEFAULT,
+                goodreads_get_shelves=mock.DEFAULT,
+                goodreads_get_shelved_status=mock.DEFAULT,
+                goodreads_date_input=mock.DEFAULT,
+                goodreads_rate_book=mock.DEFAULT,
+                goodreads_shelve=mock.DEFAULT, wait_for=mock.DEFAULT,
+                _resolution_cache=cache) as mocks:
+            mocks['goodreads_filter'].return_value = 'searched url'
+            url = ligrarian.goodreads_update(
+                    mock_driver, dict(self.details, **details))[0]
+
+        return (url, cache, mock_driver, mocks['goodreads_find'])
+
+    def test_cached_search_skips_find(self, tmp_path):
+        """A cached resolution should be visited without searching."""
+        url, cache, mock_driver, mock_find = self.run_update(tmp_path,
+                                                             'cached url')
+
+        assert url == 'cached url'
+        mock_find.assert_not_called()
+        mock_driver.get.assert_any_call('cached url')
+
+    def test_uncached_search_stored(self, tmp_path):
+        """A resolved search should be stored under its normalised key."""
+        url, cache, mock_driver, mock_find = self.run_update(tmp_path)
+
+        assert url == 'searched url'
+        assert cache.lookup('CANNERY ROW', 'k') == 'searched url'
+
+    def test_refresh_searches_again(self, tmp_path):
+        """Refresh should ignore and replace the cached resolution."""
+        url, cache, mock_driver, mock_find = self.run_update(
+                tmp_path, 'cached url', refresh=True
+        )
+
+        mock_find.assert_called_once()
+        assert cache.lookup('cannery row', 'kindle') == 'searched url'
+
+
+class TestDomQueries:
+    """Test steps read the page through single dom_query scripts."""
+
+    def test_shelves_deduplicated_without_user_counts(self):
+        """Shelf names should skip user counts and duplicates."""
+        mock_driver = mock.MagicMock()
+        mock_driver.execute_script.return_value = [
+                'Fiction', '1,234 users', 'Classics', 'Fiction'
+        ]
+        shelves = ligrarian.goodreads_get_shelves(mock_driver, '5')
+
+        mock_driver.execute_script.assert_called_once_with(
+                ligrarian.SHELF_NAMES_JS
+        )
+        assert shelves == ['Fiction', 'Classics', '5-star-books']
+
+    @mock.patch('ligrarian.wait_for')
+    def test_matching_star_clicked(self, mock_wait):
+        """Only the star whose text matches the rating should be clicked."""
+        stars = [mock.MagicMock() for _ in range(5)]
+        mock_driver = mock.MagicMock()
+        mock_driver.execute_script.return_value = [
+                [star, '{} of 5 stars'.format(number)]
+                for number, star in enumerate(stars, 1)
+        ]
+        ligrarian.goodreads_rate_book(mock_driver, '4')
+
+        stars[3].click.assert_called_once()
+        stars[2].click.assert_not_called()
+
+    @mock.patch('ligrarian.wait_for')
+    def test_fully_rated_book_waits_for_widget(self, mock_wait):
+        """A book with every star filled should wait for any star only."""
+        mock_driver = mock.MagicMock()
+        mock_driver.execute_script.return_value = []
+        ligrarian.goodreads_rate_book(mock_driver, '5')
+
+        mock_wait.assert_called_once_with(mock_driver, By.CLASS_NAME,
+                                          'star', 'rate')
+
+    @mock.patch('selenium.webdriver.support.ui.Select')
+    @mock.patch('ligrarian.wait_for')
+    def test_last_reading_session_used(self, mock_wait, mock_select):
+        """The date selectors of the last reading session should be used."""
+        mock_driver = mock.MagicMock()
+        mock_driver.current_url = 'https://www.goodreads.com/book/show/1'
+        mock_driver.execute_script.return_value = [
+                'readingSessionEntry111', 'readingSessionEntry222'
+        ]
+        ligrarian.goodreads_date_input(mock_driver, '05/06/2020', None)
+
+        mock_wait.assert_called_once_with(
+                mock_driver, By.NAME,
+                'readingSessionDatePicker222[end][year]', 'date'
+        )
+        mock_driver.find_element_by_name.assert_any_call(
+                'readingSessionDatePicker222[end][day]'
+        )
+
+
+EDIT_HTML = """
+<html><head><meta name="csrf-token" content="token123"></head><body>
+<form action="/review/update/4799" method="post">
+<input type="hidden" name="authenticity_token" value="token123">
+<select name="readingSessionDatePicker55[end][year]">
+  <option value="">year</option><option value="2018">2018</option>
+</select>
+<select name="readingSessionDatePicker55[end][month]">
+  <option value="">month</option><option value="2">February</option>
+</select>
+<select name="readingSessionDatePicker55[end][day]">
+  <option value="">day</option><option value="1">1</option>
+</select>
+<textarea name="review[review]"></textarea>
+<input type="checkbox" name="review[spoiler_flag]" value="1">
+<input type="submit" name="next" value="Save">
+</form></body></html>
+"""
+
+UNSHELVED_BOOK_HTML = BOOK_HTML.replace("<body>", """<body>
+<div class="wtrRight wtrUp"></div>
+<a class="actionLinkLite bookPageGenreLink">Classics</a>
+<a class="actionLinkLite bookPageGenreLink">1,234 users</a>
+<a class="actionLinkLite bookPageGenreLink">Fiction</a>
+""")
+
+
+class FakeGoodreads(BaseHTTPRequestHandler):
+    """Minimal Goodreads serving a book, its review form and form posts."""
+
+    book_html = UNSHELVED_BOOK_HTML
+    posts = []
+
+    def do_GET(self):
+        """Serve pages to logged in sessions, redirect others to sign in."""
+        if 'session_id=abc' not in self.headers.get('Cookie', ''):
+            self.send_response(302)
+            self.send_header('Location', '/user/sign_in')
+            self.end_headers()
+            return
+        pages = {'/book/show/4799.Cannery_Row': self.book_html,
+                 '/review/edit/4799.Cannery_Row': EDIT_HTML,
+                 '/user/sign_in': '<html></html>'}
+        self.send_response(200 if self.path in pages else 404)
+        self.end_headers()
+        self.wfile.write(pages.get(self.path, '').encode())
+
+    def do_POST(self):
+        """Record posted forms, rejecting ones without the CSRF token."""
+        length = int(self.headers['Content-Length'])
+        data = urllib.parse.parse_qs(self.rfile.read(length).decode())
+        if self.headers.get('X-CSRF-Token') != 'token123':
+            self.send_response(422)
+        else:
+            self.posts.append((self.path, data))
+            self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        """Keep test output quiet."""
+
+
+@pytest.fixture
+def goodreads(tmp_path):
+    """Run FakeGoodreads, yielding its URL with settings using a session."""
+    server = HTTPServer(('127.0.0.1', 0), FakeGoodreads)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    FakeGoodreads.posts = []
+    session_path = tmp_path / 'session.json'
+    session_path.write_text(json.dumps([{'name': 'session_id',
+                                         'value': 'abc'}]))
+    url = 'http://127.0.0.1:{}'.format(server.server_port)
+    with mock.patch('ligrarian.GOODREADS_URL', url), \
+            mock.patch('ligrarian._resolution_cache', None):
+        yield url, {'session': str(session_path)}
+    server.shutdown()
+    server.server_close()
+
+
+class TestHttpEngine:
+    """Test the browserless engine against a fake Goodreads server."""
+
+    def details(self, server, **changes):
+        """Return book details for the fake server's book."""
+        details = {'url': server + '/book/show/4799.Cannery_Row',
+                   'date': '01/02/2018', 'rating': '5',
+                   'review': 'Good'}
+        details.update(changes)
+        return details
+
+    def test_update_submits_forms(self, goodreads):
+        """The review form and shelves should be posted with the token."""
+        url, settings = goodreads
+        session = ligrarian.http_start_session(settings)
+        update = ligrarian.http_update(session, self.details(url))
+        (review_path, review), *shelving = FakeGoodreads.posts
+
+        assert update[1] == ['Classics', 'Fiction', '5-star-books']
+        assert 'Cannery Row' in update[2]
+        assert review_path == '/review/update/4799'
+        assert review['readingSessionDatePicker55[end][year]'] == ['2018']
+        assert review['readingSessionDatePicker55[end][month]'] == ['2']
+        assert review['readingSessionDatePicker55[end][day]'] == ['1']
+        assert review['review[review]'] == ['Good']
+        assert review['review[rating]'] == ['5']
+        assert review['authenticity_token'] == ['token123']
+        assert 'review[spoiler_flag]' not in review
+        assert [data['name'] for _, data in shelving] == [
+                ['Classics'], ['Fiction'], ['5-star-books']]
+
+    def test_no_saved_session(self, tmp_path):
+        """Without saved cookies there's no session to use."""
+        settings = {'session': str(tmp_path / 'missing.json')}
+
+        assert ligrarian.http_start_session(settings) is None
+
+    def test_logged_out_session_falls_back(self, goodreads):
+        """A rejected session should fall back without posting anything."""
+        url, settings = goodreads
+        session = ligrarian.http_start_session(settings)
+        session.cookies.clear()
+
+        assert ligrarian.http_try_update(session, self.details(url)) is None
+        assert FakeGoodreads.posts == []
+
+    def test_reread_falls_back(self, goodreads):
+        """Rereads should be left for the browser."""
+        url, settings = goodreads
+        session = ligrarian.http_start_session(settings)
+        with mock.patch.object(FakeGoodreads, 'book_html', BOOK_HTML):
+            update = ligrarian.http_try_update(session, self.details(url))
+
+        assert update is None
+        assert FakeGoodreads.posts == []
+
+    def test_search_falls_back(self, goodreads):
+        """Uncached searches should be left for the browser."""
+        url, settings = goodreads
+        session = ligrarian.http_start_session(settings)
+        details = self.details(url, url=None, search='Cannery Row',
+                               format='Paperback')
+
+        assert ligrarian.http_try_update(session, details) is None
+
+    @mock.patch('ligrarian.goodreads_update')
+    @mock.patch('ligrarian.goodreads_start_session')
+    @mock.patch('ligrarian.create_driver')
+    def test_worker_skips_browser(self, mock_create, mock_start,
+                                  mock_update, goodreads):
+        """A worker using the http engine shouldn't start a browser."""
+        url, settings = goodreads
+        settings.update(engine='http', headless=True)
+        jobs = ligrarian.queue.Queue()
+        jobs.put((1, self.details(url)))
+        results = ligrarian.queue.Queue()
+        ligrarian.goodreads_worker(settings, jobs, results)
+
+        assert results.get()[2][0] == url + '/book/show/4799.Cannery_Row'
+        mock_create.assert_not_called()
+
+
+class TestEnrichment:
+    """Test pages are fetched concurrently behind an adaptive rate limit."""
+
+    def response(self, status, retried=()):
+        """Return a mock response with the statuses of its retries."""
+        response = mock.Mock(status_code=status)
+        response.raw.retries.history = [mock.Mock(status=retry_status)
+                                        for retry_status in retried]
+        return response
+
+    def test_throttling_halves_rate(self):
+        """A 429, even if retried successfully, should halve the rate."""
+        limiter = ligrarian.TokenBucket(4)
+        limiter.observe(self.response(200, retried=[429]))
+
+        assert limiter.rate == 2
+
+    def test_success_recovers_rate_up_to_max(self):
+        """Successes should raise the rate without exceeding the maximum."""
+        limiter = ligrarian.TokenBucket(4)
+        limiter.observe(self.response(503))
+        for _ in range(20):
+            limiter.observe(self.response(200))
+
+        assert limiter.rate == 4
+
+    def test_acquire_waits_for_tokens(self):
+        """Requests beyond the burst should be spaced out by the rate."""
+        limiter = ligrarian.TokenBucket(50)
+        start = ligrarian.time.monotonic()
+        for _ in range(4):
+            limiter.acquire()
+
+        assert ligrarian.time.monotonic() - start >= 0.05
+
+    def test_concurrency_bounded_and_results_streamed(self):
+        """No more than enrich_workers pages should be fetched at once."""
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def fake_parse(url, limiter, in_pool):
+            with lock:
+                running.append(url)
+                peak.append(len(running))
+            ligrarian.time.sleep(0.01)
+            with lock:
+                running.remove(url)
+            if url == 'bad':
+                raise ValueError(url)
+            return {'title': url}
+
+        urls = ['url{}'.format(number) for number in range(10)] + ['bad']
+        with mock.patch('ligrarian.parse_page', side_effect=fake_parse):
+            results = dict(ligrarian.enrich_pages(
+                    urls, {'enrich_workers': '3', 'enrich_rate': '1000'}))
+
+        assert max(peak) <= 3
+        assert set(results) == set(urls)
+        assert isinstance(results['bad'], ValueError)
+
+    @mock.patch('ligrarian.enrich_pages')
+    def test_write_enrichment_csv(self, mock_enrich, tmp_path):
+        """Parsed pages should be written to the CSV and failures counted."""
+        mock_enrich.return_value = [
+                ('url1', {'title': 'A', 'author': 'B', 'pages': 1}),
+                ('url2', ValueError('bad')),
+        ]
+        path = str(tmp_path / 'books.csv')
+        counts = ligrarian.write_enrichment(['url1', 'url2'], {}, path)
+
+        with open(path) as csv_file:
+            assert csv_file.read().splitlines() == ['url,title,author,pages',
+                                                    'url1,A,B,1']
+        assert counts == (1, 1)
@@ -4,10 +4,19 @@
 
 import unittest.mock as mock
 
+import pytest
+
 import ligrarian
 
 
-@mock.patch('ligrarian.tk')
+@pytest.fixture
+def mock_tk():
+    """Replace tkinter with a mock while the GUI is created."""
+    tk = mock.MagicMock()
+    with mock.patch.dict('sys.modules', tkinter=tk):
+        yield tk
+
+
 class TestCreateGUI:
     """Test function creates and returns GUI instance correctly."""
 
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+"""Tests for ligrarian's SQLite reading history and spreadsheet export."""
+
+import os
+import shutil
+import unittest.mock as mock
+
+import openpyxl
+import pytest
+
+import ligrarian
+
+WORKBOOK = os.path.join(os.path.dirname(__file__), '..', 'Ligrarian.xlsx')
+
+
+def book(title, author='John Steinbeck', genre='Classics'):
+    """Return an info dictionary for a book."""
+    return {'title': title, 'author': author, 'pages': 181,
+            'category': 'Fiction', 'genre': genre,
+            'url': 'https://www.goodreads.com/book/show/4799.Cannery_Row'}
+
+
+@pytest.fixture
+def history(tmp_path):
+    """Return an empty ReadingHistory in tmp_path."""
+    return ligrarian.ReadingHistory(str(tmp_path / 'history.db'))
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    """Return the path to a copy of the template workbook."""
+    path = str(tmp_path / 'Ligrarian.xlsx')
+    shutil.copy(WORKBOOK, path)
+    return path
+
+
+class TestReadingHistory:
+    """Books are stored, indexed and tracked as exported or not."""
+
+    def test_new_history_empty(self, history):
+        """A new history should have no books."""
+        assert history.is_empty()
+
+    def test_added_book_returned(self, history):
+        """An added book should be returned as an (info, date) record."""
+        history.add(book('Cannery Row'), '01/02/2020')
+        book_id, (info, date) = history.records()[0]
+
+        assert date == '01/02/2020'
+        assert info == book('Cannery Row')
+
+    def test_read_on_iso_formatted_with_book_id(self, history):
+        """The indexed read_on date should sort chronologically."""
+        history.add(book('Cannery Row'), '01/02/2020')
+        row = history.connection.execute(
+                'SELECT read_on, book_id FROM books').fetchone()
+
+        assert row == ('2020-02-01', '4799')
+
+    def test_indexes_created(self, history):
+        """Date, author and genre should be indexed."""
+        indexes = {row[0] for row in history.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+        assert {'books_read_on', 'books_author', 'books_genre'} <= indexes
+
+    def test_exported_books_not_unexported(self, history):
+        """Books marked as exported shouldn't be returned as unexported."""
+        history.add(book('One'), '01/02/2020')
+        history.add(book('Two'), '02/02/2020')
+        history.mark_exported([history.records()[0][0]])
+        unexported = history.records(unexported_only=True)
+
+        assert [info['title'] for _, (info, _) in unexported] == ['Two']
+
+    def test_import_sheet(self, history):
+        """Books on a sheet should be imported as already exported."""
+        workbook = openpyxl.load_workbook(WORKBOOK)
+        sheet = workbook['Overall']
+        values = ['Cannery Row', 'John Steinbeck', 181, 'Fiction',
+                  'Classics', '01/02/2018']
+        for column, value in enumerate(values, 1):
+            sheet.cell(row=2, column=column).value = value
+        history.import_sheet(sheet)
+
+        assert history.records(unexported_only=True) == []
+        assert history.records()[0][1][0]['title'] == 'Cannery Row'
+
+
+class TestExportHistory:
+    """The spreadsheet is generated from the history."""
+
+    def test_open_history_seeded_from_spreadsheet(self, tmp_path,
+                                                  workbook_path):
+        """A new history should import the spreadsheet's books."""
+        ligrarian.write_records(workbook_path,
+                                [(book('Cannery Row'), '01/02/2018')])
+        history = ligrarian.open_history(
+                {'path': workbook_path,
+                 'history': str(tmp_path / 'history.db')}
+        )
+
+        assert len(history.records()) == 1
+
+    def test_blank_history_setting_disables(self):
+        """A blank history setting should return None."""
+        assert ligrarian.open_history({'history': ''}) is None
+
+    def test_save_records_exports_new_books(self, tmp_path, workbook_path):
+        """Saved books should be in the history and the spreadsheet."""
+        settings = {'path': workbook_path,
+                    'history': str(tmp_path / 'history.db')}
+        ligrarian.save_records(settings, [(book('One'), '01/02/2018'),
+                                          (book('Two'), '02/02/2018')])
+        ligrarian.save_records(settings, [(book('Three'), '03/02/2018')])
+        sheet = openpyxl.load_workbook(workbook_path)['2018']
+        history = ligrarian.open_history(settings)
+
+        assert [sheet.cell(row=row, column=1).value
+                for row in range(2, 5)] == ['One', 'Two', 'Three']
+        assert history.records(unexported_only=True) == []
+
+    def test_full_export_regenerates_rows(self, history, workbook_path):
+        """A full export should replace every row with the history's."""
+        ligrarian.write_records(workbook_path,
+                                [(book('Stale'), '01/02/2018')])
+        history.add(book('One'), '01/02/2018')
+        history.add(book('Two'), '01/02/2019')
+        ligrarian.export_history(history, workbook_path, full=True)
+        workbook = openpyxl.load_workbook(workbook_path)
+
+        assert workbook['Overall']['A2'].value == 'One'
+        assert workbook['Overall']['A3'].value == 'Two'
+        assert workbook['2018']['A2'].value == 'One'
+        assert workbook['2018']['A3'].value is None
+        assert workbook['2019']['A2'].value == 'Two'
+
+    @mock.patch('ligrarian.write_records')
+    def test_nothing_new_nothing_written(self, mock_write, history):
+        """An incremental export with no new books shouldn't write."""
+        ligrarian.export_history(history, 'path')
+
+        mock_write.assert_not_called()
+
+
+class TestReadingStats:
+    """Statistics are kept as running totals alongside the books."""
+
+    def test_summary_counts(self):
+        """The summary should count books, authors and genres."""
+        stats = ligrarian.ReadingStats()
+        stats.add(book('One'))
+        stats.add(book('Two'))
+        stats.add(dict(book('Three', 'Yuval Noah Harari', 'History'),
+                       category='Nonfiction', pages=443))
+        summary = stats.summary()
+
+        assert summary['Books Read'] == 3
+        assert summary['Pages Read'] == 805
+        assert summary['Nonfiction'] == 1
+        assert summary['Most Read Author'] == 'John Steinbeck'
+        assert summary['Books By Most Read Author'] == 2
+        assert summary['Different Genres Read'] == 2
+
+    def test_no_books_empty_summary(self):
+        """Without books there should be no statistics to divide by."""
+        assert ligrarian.ReadingStats().summary() == {}
+
+    def test_counts_round_trip(self, history):
+        """Stats read back from the history should match the originals."""
+        stats = ligrarian.ReadingStats()
+        for title, author in (('One', 'John Steinbeck'),
+                              ('Two', 'Jane Austen'),
+                              ('Three', 'John Steinbeck')):
+            stats.add(book(title, author))
+            history.add(book(title, author), '01/02/2018')
+
+        assert history.stats('2018').summary() == stats.summary()
+
+    def test_history_updates_overall_and_year(self, history):
+        """Adding a book should update the Overall and its year's stats."""
+        history.add(book('One'), '01/02/2018')
+        history.add(book('Two'), '01/02/2019')
+
+        assert history.stats('Overall').books == 2
+        assert history.stats('2018').books == 1
+        assert history.stats('2020').books == 0
+
+    def test_stats_rebuilt_for_existing_history(self, tmp_path, history):
+        """A history without stored stats should calculate them on open."""
+        history.add(book('One'), '01/02/2018')
+        with history.connection:
+            history.connection.execute('DELETE FROM stat_counts')
+        history = ligrarian.ReadingHistory(str(tmp_path / 'history.db'))
+
+        assert history.stats('2018').books == 1
+
+    def test_export_stores_formula_results(self, history, workbook_path):
+        """Exported sheets should hold the statistics as formula results."""
+        history.add(book('One'), '01/02/2018')
+        history.add(book('Two', 'Jane Austen'), '01/02/2018')
+        ligrarian.export_history(history, workbook_path)
+        values = openpyxl.load_workbook(workbook_path, data_only=True)
+        formulas = openpyxl.load_workbook(workbook_path)
+
+        assert values['Overall']['I4'].value == 2
+        assert values['2018']['I6'].value == 2
+        assert values['2018']['I8'].value == 181
+        assert values['2018']['I11'].value == 'John Steinbeck'
+        assert formulas['2018']['I6'].value.startswith('=')
+
+    def test_new_year_sheet_stores_formula_results(self, history,
+                                                   workbook_path):
+        """Statistics should be stored on a year sheet created for export."""
+        history.add(book('One'), '01/02/2021')
+        ligrarian.export_history(history, workbook_path)
+        values = openpyxl.load_workbook(workbook_path, data_only=True)
+
+        assert values['2021']['I6'].value == 1
+        assert values['Overall']['I4'].value == 1
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""Tests for ligrarian's job journal and resuming interrupted books."""
+
+import unittest.mock as mock
+
+import pytest
+
+import ligrarian
+
+
+@pytest.fixture
+def journal(tmp_path):
+    """Configure an empty journal in tmp_path for the test."""
+    journal = ligrarian.JobJournal(str(tmp_path / 'journal.db'))
+    with mock.patch('ligrarian._journal', journal):
+        yield journal
+
+
+def book(**changes):
+    """Return the details of a book given by URL."""
+    details = {'url': 'https://www.goodreads.com/book/show/4799',
+               'date': '01/02/2018', 'rating': '4', 'review': None}
+    details.update(changes)
+    return details
+
+
+class TestJobJournal:
+    """Jobs and their completed steps persist until finished."""
+
+    def test_added_job_pending(self, journal):
+        """An added job should be pending with its details and id."""
+        details = book()
+        ligrarian.journal_job(details)
+
+        assert journal.pending() == [details]
+
+    def test_job_added_once(self, journal):
+        """A book that already has a job shouldn't be added again."""
+        details = book()
+        ligrarian.journal_job(details)
+        ligrarian.journal_job(details)
+
+        assert len(journal.pending()) == 1
+
+    def test_checkpoints_kept(self, journal):
+        """Completed steps should be returned with their data."""
+        details = book()
+        ligrarian.journal_job(details)
+        ligrarian.journal_checkpoint(details, 'page', url='url')
+        ligrarian.journal_checkpoint(details, 'review')
+
+        assert ligrarian.journal_steps(details) == {'page': {'url': 'url'},
+                                                    'review': {}}
+
+    def test_finished_not_pending(self, journal):
+        """Finished jobs shouldn't be resumed."""
+        details = book()
+        ligrarian.journal_job(details)
+        ligrarian.journal_finish([details])
+
+        assert journal.pending() == []
+
+    def test_finished_steps_dropped(self, journal):
+        """A finished job shouldn't keep its step data."""
+        details = book()
+        ligrarian.journal_job(details)
+        ligrarian.journal_checkpoint(details, 'page', url='url')
+        ligrarian.journal_finish([details])
+
+        assert ligrarian.journal_steps(details) == {}
+
+    def test_no_journal_no_job(self):
+        """Without a journal books shouldn't be given jobs."""
+        details = book()
+        with mock.patch('ligrarian._journal', None):
+            ligrarian.journal_job(details)
+            ligrarian.journal_checkpoint(details, 'page')
+
+            assert 'job' not in details
+            assert ligrarian.journal_steps(details) == {}
+
+
+@mock.patch.multiple('ligrarian', goodreads_get_shelved_status=mock.DEFAULT,
+                     goodreads_date_input=mock.DEFAULT,
+                     goodreads_rate_book=mock.DEFAULT,
+                     goodreads_shelve=mock.DEFAULT, wait_for=mock.DEFAULT)
+class TestResumeUpdate:
+    """goodreads_update checkpoints each step and skips completed ones."""
+
+    @pytest.fixture(autouse=True)
+    def page(self):
+        """Make the book page's shelves and source serialisable."""
+        with mock.patch('ligrarian.goodreads_get_shelves',
+                        return_value=['fiction']):
+            yield
+
+    def test_steps_checkpointed(self, journal, **mocks):
+        """Every step of an update should be recorded."""
+        mocks['goodreads_get_shelved_status'].return_value = False
+        details = book()
+        ligrarian.journal_job(details)
+        ligrarian.goodreads_update(mock.MagicMock(page_source=''), details)
+
+        steps = ligrarian.journal_steps(details)
+        assert set(steps) == {'page', 'review', 'rate', 'shelve'}
+        assert 'page_source' not in steps['page']
+
+    def test_resumes_after_last_completed_step(self, journal, **mocks):
+        """A failed rating should be retried without redoing the review."""
+        mocks['goodreads_get_shelved_status'].return_value = False
+        mocks['goodreads_rate_book'].side_effect = [ValueError, None]
+        details = book()
+        ligrarian.journal_job(details)
+        mock_driver = mock.MagicMock(page_source='<html></html>')
+        with pytest.raises(ValueError):
+            ligrarian.goodreads_update(mock_driver, details)
+        update = ligrarian.goodreads_update(mock_driver, details)
+
+        mocks['goodreads_date_input'].assert_called_once()
+        assert mocks['goodreads_rate_book'].call_count == 2
+        mocks['goodreads_shelve'].assert_called_once_with(mock_driver,
+                                                          ['fiction'])
+        assert update == (details['url'], ['fiction'], None)
+
+    def test_page_passed_on_before_remaining_steps(self, journal, **mocks):
+        """on_page should get the book page before it's rated."""
+        order = []
+        mocks['goodreads_rate_book'].side_effect = (
+                lambda *args: order.append('rate'))
+        mock_driver = mock.MagicMock(page_source='<html></html>')
+        ligrarian.goodreads_update(
+                mock_driver, book(),
+                lambda *page: order.append(page))
+
+        assert order == [(book()['url'], ['fiction'], '<html></html>'),
+                         'rate']
+
+    def test_completed_update_not_repeated(self, journal, **mocks):
+        """A book whose row failed to save shouldn't touch Goodreads."""
+        mocks['goodreads_get_shelved_status'].return_value = True
+        details = book()
+        ligrarian.journal_job(details)
+        ligrarian.goodreads_update(mock.MagicMock(page_source=''), details)
+        mock_driver = mock.MagicMock()
+        ligrarian.goodreads_update(mock_driver, details)
+
+        mock_driver.get.assert_not_called()
+        assert mocks['goodreads_rate_book'].call_count == 1
+
+    def test_completed_update_starts_no_driver(self, journal, **mocks):
+        """A worker shouldn't log in for a book with no steps left."""
+        mocks['goodreads_get_shelved_status'].return_value = True
+        details = book()
+        ligrarian.journal_job(details)
+        ligrarian.goodreads_update(mock.MagicMock(page_source=''), details)
+        jobs, results = ligrarian.queue.Queue(), ligrarian.queue.Queue()
+        jobs.put((1, details))
+        with mock.patch('ligrarian.create_driver') as mock_create:
+            ligrarian.goodreads_worker({'headless': True}, jobs, results)
+
+        mock_create.assert_not_called()
+        assert results.get() == (1, details, (details['url'], ['fiction'],
+                                              None))
+
+
+@mock.patch('ligrarian.save_records')
+@mock.patch('ligrarian.batch_records', side_effect=lambda finished:
+            [update for _, update, _ in finished if update])
+class TestBatchJournal:
+    """Batch books are journaled and finished once saved."""
+
+    def test_failed_books_left_pending(self, mock_records, mock_save,
+                                       journal):
+        """Only books whose rows were saved should be finished."""
+        def worker(settings, jobs, results):
+            while not jobs.empty():
+                number, details = jobs.get()
+                results.put((number, details,
+                             None if number == 2 else ('url', [], None)))
+            results.put(None)
+
+        with mock.patch('ligrarian.goodreads_worker', side_effect=worker):
+            ligrarian.run_batch([book(), book(rating='5')], {})
+
+        assert [details['rating'] for details in journal.pending()] == ['5']
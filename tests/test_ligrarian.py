@@ -2,8 +2,12 @@
 
 """Tests the functions in ligrarian not related to GUI, sheet or goodreads."""
 
+import subprocess
+import sys
 import unittest.mock as mock
 
+import pytest
+
 import ligrarian
 
 
@@ -46,6 +50,57 @@ class TestGetDateString:
         assert ligrarian.get_date_str(yesterday=True) == formatted_date
 
 
+class TestProcessDate:
+    """Function converts (t)oday and (y)esterday but leaves dates alone."""
+
+    def test_t_returns_today(self):
+        """t should be converted to today's date."""
+        assert ligrarian.process_date('t') == ligrarian.get_date_str()
+
+    def test_y_returns_yesterday(self):
+        """Y should be converted to yesterday's date."""
+        yesterday = ligrarian.get_date_str(yesterday=True)
+        assert ligrarian.process_date('Y') == yesterday
+
+    def test_formatted_date_unchanged(self):
+        """A DD/MM/YYYY date should be returned as is."""
+        assert ligrarian.process_date('01/02/2020') == '01/02/2020'
+
+
+class TestReadBatchFile:
+    """Test function reads, validates and normalises batch file rows."""
+
+    def test_reads_csv_rows(self, tmp_path):
+        """CSV rows should be returned as details dictionaries."""
+        batch = tmp_path / 'books.csv'
+        batch.write_text("url,search,format,date,rating,review\n"
+                         "https://url,,,01/02/2020,4,Great\n"
+                         ",Cannery Row,k,02/02/2020,5,\n")
+        books = ligrarian.read_batch_file(str(batch))
+        assert books == [
+            {'url': 'https://url', 'date': '01/02/2020',
+             'rating': '4', 'review': 'Great'},
+            {'search': 'Cannery Row', 'format': 'k', 'date': '02/02/2020',
+             'rating': '5', 'review': None},
+        ]
+
+    def test_reads_json_objects(self, tmp_path):
+        """JSON objects should be returned with string ratings."""
+        batch = tmp_path / 'books.json'
+        batch.write_text('[{"url": "https://url", "date": "01/02/2020", '
+                         '"rating": 3}]')
+        books = ligrarian.read_batch_file(str(batch))
+        assert books[0]['rating'] == '3'
+
+    def test_invalid_row_exits(self, tmp_path, capsys):
+        """A row without a url or search should print a message and exit."""
+        batch = tmp_path / 'books.json'
+        batch.write_text('[{"date": "01/02/2020", "rating": 3}]')
+        with pytest.raises(SystemExit):
+            ligrarian.read_batch_file(str(batch))
+        assert "Batch entry 1" in capsys.readouterr()[0]
+
+
 @mock.patch('ligrarian.input')
 class TestCheckAndPromptForEmailPassword:
     """Test function returns, prompts for and calls with the right values."""
@@ -184,3 +239,29 @@ class TestWriteConfig:
         mock_parser.return_value.set.assert_any_call(
                 "settings", "prompt", "argument prompt"
         )
+
+
+class TestModeImports:
+    """Test libraries are only imported when a mode first uses them."""
+
+    def run(self, code):
+        """Run code after importing ligrarian in a new interpreter."""
+        return subprocess.run([sys.executable, '-c', 'import sys, ligrarian; '
+                               + code], stdout=subprocess.PIPE, check=True,
+                              universal_newlines=True).stdout.strip()
+
+    def test_libraries_not_imported_with_module(self):
+        """Importing ligrarian shouldn't import any of the libraries."""
+        output = self.run('print(sorted(name for name in ('
+                          "'bs4', 'openpyxl', 'requests', 'selenium', "
+                          "'tkinter') if name in sys.modules))")
+
+        assert output == '[]'
+
+    def test_import_times_recorded(self):
+        """Only the libraries a function uses should be imported and timed."""
+        output = self.run('ligrarian.time_imports(); ligrarian.fast_parser(); '
+                          "print(list(ligrarian.IMPORT_TIMES), "
+                          "'selenium' in sys.modules)")
+
+        assert output == "['bs4'] False"
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""Tests for ligrarian's span timing and profile reports."""
+
+import json
+import threading
+import unittest.mock as mock
+
+import pytest
+
+import ligrarian
+
+
+@pytest.fixture
+def profiler():
+    """Start profiling, restoring the unwrapped functions afterwards."""
+    originals = {name: getattr(ligrarian, name)
+                 for name in ligrarian.PROFILED_FUNCTIONS}
+    with mock.patch.multiple('ligrarian', _profiler=None, **originals):
+        yield ligrarian.start_profiling()
+
+
+class TestProfiler:
+    """Spans are recorded, summarised and exported as a trace."""
+
+    def test_no_spans_without_profiling(self):
+        """span should do nothing unless profiling has started."""
+        with mock.patch('ligrarian._profiler', None):
+            with ligrarian.span('nothing'):
+                pass
+
+    def test_profiled_function_recorded(self, profiler):
+        """Calling a profiled function should record a span of its name."""
+        ligrarian.category_and_genre(['fiction', 'classics'])
+
+        assert [span[0] for span in profiler.spans] == ['category_and_genre']
+
+    def test_functions_wrapped_once(self, profiler):
+        """Starting profiling again shouldn't time functions twice."""
+        ligrarian.start_profiling()
+        ligrarian.category_and_genre(['fiction'])
+
+        assert len(ligrarian._profiler.spans) == 1
+
+    def test_summary_slowest_first(self, profiler):
+        """The summary should total calls per span, slowest first."""
+        profiler.spans = [('fast', 0, 0.001, 1), ('slow', 0, 0.5, 1),
+                          ('fast', 1, 0.003, 1)]
+        lines = profiler.summary().splitlines()
+
+        assert lines[1].split()[:3] == ['slow', '1', '500.0']
+        assert lines[2].split()[:4] == ['fast', '2', '4.0', '2.0']
+
+    def test_trace_has_complete_events_per_thread(self, profiler,
+                                                  tmp_path):
+        """The trace should have an X event per span with numbered threads."""
+        def other():
+            with ligrarian.span('other'):
+                pass
+
+        with ligrarian.span('main'):
+            thread = threading.Thread(target=other)
+            thread.start()
+            thread.join()
+        path = str(tmp_path / 'trace.json')
+        profiler.write_trace(path)
+        with open(path) as trace_file:
+            events = json.load(trace_file)['traceEvents']
+
+        assert [(event['name'], event['ph'], event['tid'])
+                for event in events] == [('other', 'X', 1), ('main', 'X', 2)]
+        assert events[1]['dur'] >= events[0]['dur']
+
+    @mock.patch('ligrarian.ensure_year_sheet')
+    @mock.patch('openpyxl.load_workbook')
+    def test_workbook_load_timed(self, mock_load, mock_ensure, profiler):
+        """Loading the workbook should be timed inside its caller."""
+        ligrarian.check_year_sheet_exists('path', '2018')
+
+        assert {span[0] for span in profiler.spans} >= {
+                'workbook load', 'check_year_sheet_exists'}
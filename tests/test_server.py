@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""Tests for ligrarian's serve mode and the client sending it books."""
+
+import threading
+import time
+import unittest.mock as mock
+
+import pytest
+
+import ligrarian
+
+BOOK_HTML = """
+<html><body>
+<h1 id="bookTitle">Cannery Row</h1>
+<a class="authorName" href="/author"><span>John Steinbeck</span></a>
+<span itemprop="numberOfPages">181 pages</span>
+</body></html>
+"""
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Run a LigrarianServer with mocked drivers, yielding its settings."""
+    settings = {'socket': str(tmp_path / 'ligrarian.sock'),
+                'headless': True, 'workers': '2', 'flush_delay': '60'}
+    with mock.patch('ligrarian.create_driver'), \
+            mock.patch('ligrarian.goodreads_start_session'), \
+            mock.patch('ligrarian._page_cache', None):
+        server = ligrarian.LigrarianServer(settings['socket'], settings)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield server, settings
+        server.shutdown()
+        with mock.patch('ligrarian.save_records'):
+            server.server_close()
+
+
+class TestServer:
+    """Books sent to the server are updated by its resident drivers."""
+
+    details = {'url': 'https://www.goodreads.com/book/show/4799',
+               'date': '01/02/2018', 'rating': '4', 'review': None}
+
+    @mock.patch('ligrarian.goodreads_update', return_value=(
+            'https://www.goodreads.com/book/show/4799', ['fiction'],
+            BOOK_HTML))
+    def test_book_updated_and_buffered(self, mock_update, server):
+        """The reply should have the book's info and its row be buffered."""
+        server, settings = server
+        reply = ligrarian.send_to_server(settings, self.details)
+
+        assert reply['info']['title'] == 'Cannery Row'
+        assert reply['info']['category'] == 'Fiction'
+        assert reply['date'] == '01/02/2018'
+        assert server.saver.records[0][0]['pages'] == 181
+
+    @mock.patch('ligrarian.goodreads_update', side_effect=ValueError)
+    def test_failed_update_replies_error(self, mock_update, server):
+        """A failed update should reply with an error and save nothing."""
+        server, settings = server
+        reply = ligrarian.send_to_server(settings, self.details)
+
+        assert 'error' in reply
+        assert server.saver.records == []
+
+    @mock.patch('ligrarian.book_record', side_effect=OSError('disk full'))
+    @mock.patch('ligrarian.goodreads_update', return_value=(
+            'https://www.goodreads.com/book/show/4799', ['fiction'],
+            BOOK_HTML))
+    def test_failed_record_replies_error(self, mock_update, mock_record,
+                                         server):
+        """A book that can't be recorded should still get a reply."""
+        server, settings = server
+        reply = ligrarian.send_to_server(settings, self.details)
+
+        assert reply == {'error': 'The server failed to record the book: '
+                                  'disk full'}
+
+    def test_close_waits_for_handled_books(self, server):
+        """Closing should save a book that was still being updated."""
+        server, settings = server
+        started = threading.Event()
+
+        def update(*args):
+            started.set()
+            time.sleep(0.1)
+            return ('https://www.goodreads.com/book/show/4799', ['fiction'],
+                    BOOK_HTML)
+
+        client = threading.Thread(target=ligrarian.send_to_server,
+                                  args=(settings, self.details))
+        with mock.patch('ligrarian.goodreads_update', side_effect=update), \
+                mock.patch('ligrarian.save_records') as mock_save:
+            client.start()
+            started.wait(1)
+            server.shutdown()
+            server.server_close()
+            client.join()
+
+        assert not any(worker.is_alive() for worker in server.workers)
+        assert mock_save.call_args[0][1][0][0]['title'] == 'Cannery Row'
+
+    def test_empty_reply_reported(self, tmp_path):
+        """A server closing without replying should be reported cleanly."""
+        path = str(tmp_path / 'ligrarian.sock')
+        listener = ligrarian.socket.socket(ligrarian.socket.AF_UNIX)
+        listener.bind(path)
+        listener.listen()
+
+        def close_connection():
+            connection, _ = listener.accept()
+            connection.recv(4096)
+            connection.close()
+
+        threading.Thread(target=close_connection, daemon=True).start()
+        reply = ligrarian.send_to_server({'socket': path}, self.details)
+        listener.close()
+
+        assert 'error' in reply
+
+    def test_no_server_listening(self, tmp_path):
+        """Without a server the client should return None."""
+        settings = {'socket': str(tmp_path / 'missing.sock')}
+
+        assert ligrarian.send_to_server(settings, self.details) is None
+
+    def test_check_listening(self, server):
+        """Checking for a running server should return an empty reply."""
+        assert ligrarian.send_to_server(server[1], None) == {}
+
+
+class TestDebouncedSaver:
+    """Records are saved together once no more arrive."""
+
+    @mock.patch('ligrarian.save_records')
+    def test_burst_saved_once(self, mock_save):
+        """Records added in quick succession should be saved together."""
+        saver = ligrarian.DebouncedSaver({}, 0.05)
+        saver.add(['one'])
+        saver.add(['two'])
+        time.sleep(0.2)
+
+        mock_save.assert_called_once_with({}, ['one', 'two'])
+
+    @mock.patch('ligrarian.save_records')
+    def test_flush_saves_immediately(self, mock_save):
+        """Flushing should save buffered records without waiting."""
+        saver = ligrarian.DebouncedSaver({}, 60)
+        saver.add(['one'])
+        saver.flush()
+        saver.flush()
+
+        mock_save.assert_called_once_with({}, ['one'])
@@ -2,10 +2,18 @@
 
 """Tests for the openpyxl, spreadsheet related functions of ligrarian.py."""
 
+import os
+import shutil
 import unittest.mock as mock
+import zipfile
+
+import openpyxl
+import pytest
 
 import ligrarian
 
+WORKBOOK = os.path.join(os.path.dirname(__file__), '..', 'Ligrarian.xlsx')
+
 
 class FakeCell:
     """A fake version of openpyxl's workbook.sheet.cell."""
@@ -22,60 +30,167 @@ class FakeCell:
             self.value = None
 
 
-def test_first_blank_row():
-    """Return row where cell.value is an empty string."""
-    mock_sheet = mock.MagicMock()
-    mock_sheet.cell.side_effect = [
-            FakeCell(1, 1), FakeCell(2, 1), FakeCell(3, 1)
-    ]
-    assert ligrarian.first_blank_row(mock_sheet) == 3
+class FakeSheet:
+    """A fake version of an openpyxl sheet with column A filled to a row."""
+
+    def __init__(self, filled_rows, max_row=None):
+        self._cells = {}
+        for row in range(1, filled_rows + 1):
+            self.fill(row)
+        self.max_row = max_row or filled_rows
+
+    def fill(self, row):
+        """Give column A of row a value."""
+        self._cells[(row, 1)] = mock.Mock(value="not blank")
+        self.max_row = max(getattr(self, 'max_row', 0), row)
+
+
+@pytest.fixture
+def mock_pyxl():
+    """Return a mock openpyxl workbook."""
+    return mock.MagicMock()
+
+
+class TestFirstBlankRow:
+    """Return the row after the last filled row in column A."""
+
+    def test_first_blank_row(self):
+        """Return row where cell.value is an empty string."""
+        assert ligrarian.first_blank_row(FakeSheet(2)) == 3
+
+    def test_blank_rows_below_other_columns(self):
+        """Rows only filled in other columns shouldn't count as filled."""
+        assert ligrarian.first_blank_row(FakeSheet(5, max_row=16)) == 6
+
+    def test_empty_sheet(self):
+        """A sheet without any filled rows should return 1."""
+        assert ligrarian.first_blank_row(FakeSheet(0)) == 1
 
+    def test_cells_not_created(self):
+        """Probing rows should not create cells as a side effect."""
+        sheet = FakeSheet(3, max_row=16)
+        ligrarian.first_blank_row(sheet)
+        assert len(sheet._cells) == 3
 
-@mock.patch('ligrarian.openpyxl')
+    def test_appended_row_found_from_cache(self):
+        """After appending a row the next one should be returned."""
+        sheet = FakeSheet(3)
+        ligrarian.first_blank_row(sheet)
+        sheet.fill(4)
+        assert ligrarian.first_blank_row(sheet) == 5
+
+    def test_gap_in_column_a_skipped(self):
+        """A blank row inside the data shouldn't be returned."""
+        sheet = FakeSheet(10)
+        del sheet._cells[(6, 1)]
+        assert ligrarian.first_blank_row(sheet) == 11
+
+    def test_rows_written_after_gap(self):
+        """Writing rows should leave the rows after a gap alone."""
+        sheet = openpyxl.Workbook().active
+        for row in range(1, 11):
+            if row != 6:
+                sheet.cell(row=row, column=1).value = row
+        ligrarian.write_rows(sheet, [['a'], ['b'], ['c']])
+
+        assert [sheet.cell(row=row, column=1).value
+                for row in range(6, 14)] == [None, 7, 8, 9, 10, 'a', 'b', 'c']
+
+
+@mock.patch('openpyxl.load_workbook')
 class TestCheckYearSheetExists:
     """create_sheet only if no year_sheet in workbook, return workbook."""
 
     @mock.patch('ligrarian.create_sheet')
-    def test_year_sheet_exists_no_create_call(self, mock_create, mock_pyxl):
+    def test_year_sheet_exists_no_create_call(self, mock_create, mock_load):
         """No call to create_sheet."""
-        mock_pyxl.load_workbook.return_value.sheetnames = ['2019', '2020']
+        mock_load.return_value.sheetnames = ['2019', '2020']
         ligrarian.check_year_sheet_exists('', '2020')
 
         mock_create.assert_not_called()
 
     @mock.patch('ligrarian.create_sheet')
-    def test_year_sheet_not_exist_create_call(self, mock_create, mock_pyxl):
+    def test_year_sheet_not_exist_create_call(self, mock_create, mock_load):
         """One call to create_sheet."""
-        mock_pyxl.load_workbook.return_value.sheetnames = ['2018', '2019']
+        mock_load.return_value.sheetnames = ['2018', '2019']
         ligrarian.check_year_sheet_exists('', '2020')
 
         mock_create.assert_called_once()
 
-    def test_workbook_returned(self, mock_pyxl):
+    def test_workbook_returned(self, mock_load):
         """Mocked workbook (load_workbook()) returned."""
-        mock_workbook = mock_pyxl.load_workbook()
-        mock_pyxl.load_workbook.return_value.sheetnames = ['2020']
+        mock_workbook = mock_load()
+        mock_load.return_value.sheetnames = ['2020']
         returned_workbook = ligrarian.check_year_sheet_exists('', '2020')
 
         assert returned_workbook == mock_workbook
 
 
-@mock.patch('ligrarian.openpyxl')
-@mock.patch('ligrarian.first_blank_row', return_value=2)
+@mock.patch('ligrarian.create_template_sheet')
 class TestCreateSheet:
-    """Copies then renames sheet, blanks all but first, sets date function."""
+    """Copies then renames template sheet, shows it and sets date function."""
+
+    def create_mock_workbook(self, sheetnames=('Overall', 'Template')):
+        """Return a mock workbook with the given sheet names."""
+        mock_workbook = mock.MagicMock()
+        mock_workbook.sheetnames = list(sheetnames)
+        return mock_workbook
+
+    def test_copies_template_sheet(self, mock_template):
+        """Should call copy_worksheet on the template sheet only."""
+        mock_workbook = self.create_mock_workbook()
+        ligrarian.create_sheet(mock_workbook, 'copy', 'new')
+
+        mock_workbook.copy_worksheet.assert_called_once_with(
+                mock_workbook['Template']
+        )
+        mock_template.assert_not_called()
+
+    def test_missing_template_created(self, mock_template):
+        """Should create the template from sheet_to_copy if it's missing."""
+        mock_workbook = self.create_mock_workbook(['Overall', '2019'])
+        ligrarian.create_sheet(mock_workbook, '2019', 'new')
+
+        mock_template.assert_called_once_with(mock_workbook, '2019')
+
+    def test_names_sheet(self, mock_template):
+        """Should name sheet to new_sheet_name argument and show it."""
+        mock_workbook = self.create_mock_workbook()
+        ligrarian.create_sheet(mock_workbook, 'copy', 'new')
+        new_sheet = mock_workbook.copy_worksheet.return_value
+
+        assert new_sheet.title == 'new'
+        assert new_sheet.sheet_state == 'visible'
+
+    def test_date_formula_written_to_last_cell(self, mock_template):
+        """Cell 5, 9 equal to date formula."""
+        fake_last_call = FakeCell(5, 9)
+        mock_workbook = self.create_mock_workbook()
+        mock_workbook.copy_worksheet.return_value.cell.return_value = (
+                fake_last_call
+        )
+        ligrarian.create_sheet(mock_workbook, 'copy', 'new')
+
+        assert fake_last_call.value == "=(TODAY()-DATE(new,1,1))/7"
+
+
+@mock.patch('ligrarian.first_blank_row', return_value=2)
+class TestCreateTemplateSheet:
+    """Copies and hides a sheet then blanks all but its first row."""
 
     def test_copies_sheet(self, mock_first, mock_pyxl):
         """Should call copy_worksheet on workbook object."""
-        ligrarian.create_sheet(ligrarian.openpyxl, 'copy', 'new')
+        ligrarian.create_template_sheet(mock_pyxl, 'copy')
 
-        ligrarian.openpyxl.copy_worksheet.assert_called_once()
+        mock_pyxl.copy_worksheet.assert_called_once()
 
-    def test_names_sheet(self, mock_first, mock_pyxl):
-        """Should name sheet to new_sheet_name argument."""
-        ligrarian.create_sheet(ligrarian.openpyxl, 'copy', 'new')
+    def test_names_and_hides_sheet(self, mock_first, mock_pyxl):
+        """Should name sheet Template and hide it."""
+        ligrarian.create_template_sheet(mock_pyxl, 'copy')
+        template = mock_pyxl.copy_worksheet.return_value
 
-        assert ligrarian.openpyxl.copy_worksheet.return_value.title == 'new'
+        assert template.title == 'Template'
+        assert template.sheet_state == 'hidden'
 
     def test_first_row_cells_not_modified(self, mock_first, mock_pyxl):
         """First row not accessed by cell call for .value modification.
@@ -86,8 +201,8 @@ class TestCreateSheet:
         set to None.
 
         """
-        mock_sheet = ligrarian.openpyxl.copy_worksheet
-        ligrarian.create_sheet(ligrarian.openpyxl, 'copy', 'new')
+        mock_sheet = mock_pyxl.copy_worksheet
+        ligrarian.create_template_sheet(mock_pyxl, 'copy')
         cell_calls = mock_sheet.return_value.cell.call_args_list
 
         assert mock.call(row=1, column=2) not in cell_calls
@@ -95,35 +210,36 @@ class TestCreateSheet:
     def test_other_row_cells_modified(self, mock_first, mock_pyxl):
         """Other rows cell's value attributes changed to None."""
         fake_two_one = FakeCell(2, 1)
-        ligrarian.openpyxl.copy_worksheet.return_value.cell.side_effect = [
+        mock_pyxl.copy_worksheet.return_value.cell.side_effect = [
                 fake_two_one,
                 FakeCell(2, 2),
                 FakeCell(2, 3),
                 FakeCell(2, 4),
                 FakeCell(2, 5),
                 FakeCell(2, 6),
-                FakeCell(5, 8),
         ]
-        ligrarian.create_sheet(ligrarian.openpyxl, 'copy', 'new')
+        ligrarian.create_template_sheet(mock_pyxl, 'copy')
         assert fake_two_one.value is None
 
-    def test_date_formula_written_to_last_cell(self, mock_first, mock_pyxl):
-        """Cell 5, 8 equal to date formula."""
-        fake_last_call = FakeCell(5, 8)
-        ligrarian.openpyxl.copy_worksheet.return_value.cell.side_effect = [
-                FakeCell(2, 1),
-                FakeCell(2, 2),
-                FakeCell(2, 3),
-                FakeCell(2, 4),
-                FakeCell(2, 5),
-                FakeCell(2, 6),
-                fake_last_call,
-        ]
-        ligrarian.create_sheet(ligrarian.openpyxl, 'copy', 'new')
-        assert fake_last_call.value == "=(TODAY()-DATE(new,1,1))/7"
+
+class TestYearSheetFromTemplate:
+    """Year sheets made in a real workbook come from an empty template."""
+
+    def test_new_year_sheet_empty(self, tmp_path):
+        """A new year sheet should have no books but keep its formulas."""
+        workbook = openpyxl.load_workbook(WORKBOOK)
+        workbook['2018'].cell(row=2, column=1).value = 'A book'
+        ligrarian.ensure_year_sheet(workbook, '2019')
+        ligrarian.ensure_year_sheet(workbook, '2020')
+
+        assert workbook.sheetnames == ['Overall', '2018', 'Template',
+                                       '2019', '2020']
+        assert workbook['Template'].sheet_state == 'hidden'
+        assert workbook['2020']['A2'].value is None
+        assert workbook['2020']['I6'].value == '=COUNTA(A2:A150)'
+        assert workbook['2020']['I5'].value == '=(TODAY()-DATE(2020,1,1))/7'
 
 
-@mock.patch('ligrarian.openpyxl')
 @mock.patch('ligrarian.first_blank_row', return_value=1)
 class TestInputInfo:
     """Data written to 'year' and 'Overall' sheet and then workbook saved."""
@@ -136,10 +252,15 @@ class TestInputInfo:
             'genre': "mock genre"
     }
 
+    @pytest.fixture(autouse=True)
+    def set_workbook(self, mock_pyxl):
+        """Keep the mock workbook for mock_cell_access."""
+        self.workbook = mock_pyxl
+
     def mock_cell_access(self, sheet_name, test_value, test_index):
         """Create FakeCell side_effect with one assigned."""
         test_value = FakeCell(9, 9)
-        mock_cell = ligrarian.openpyxl[sheet_name].cell
+        mock_cell = self.workbook[sheet_name].cell
         mock_side_effects = [FakeCell(1, 1)] * 12
         mock_side_effects[test_index] = test_value
         mock_cell.side_effect = mock_side_effects
@@ -278,3 +399,273 @@ class TestInputInfo:
                 mock_pyxl, self.mock_info, '2020', 'path')
 
         mock_pyxl.save.assert_called_once()
+
+
+@mock.patch('ligrarian.save_records')
+@mock.patch('ligrarian.batch_records', side_effect=lambda finished:
+            [update for _, update, _ in finished if update])
+@mock.patch('ligrarian.goodreads_worker')
+class TestRunBatch:
+    """Results from the driver pool are saved in order all at once."""
+
+    one = ('one', [], None)
+    two = ('two', [], None)
+
+    def fake_worker(self, updates):
+        """Return a worker side_effect that completes jobs in reverse."""
+        def worker(settings, jobs, results):
+            taken = []
+            while not jobs.empty():
+                taken.append(jobs.get())
+            for number, details in reversed(taken):
+                results.put((number, details, updates[number]))
+            results.put(None)
+        return worker
+
+    def test_books_written_in_batch_order(self, mock_worker, mock_record,
+                                          mock_save):
+        """Books completed out of order are still saved in order."""
+        mock_worker.side_effect = self.fake_worker({1: self.one, 2: self.two})
+        settings = {'path': 'path'}
+        ligrarian.run_batch([{'n': 1}, {'n': 2}], settings)
+
+        mock_save.assert_called_once_with(settings, [self.one, self.two])
+
+    def test_failed_books_not_written(self, mock_worker, mock_record,
+                                      mock_save):
+        """Books without an update shouldn't be saved."""
+        mock_worker.side_effect = self.fake_worker({1: None, 2: self.two})
+        ligrarian.run_batch([{'n': 1}, {'n': 2}],
+                            {'path': 'path', 'workers': '2'})
+
+        assert mock_save.call_args[0][1] == [self.two]
+
+    def test_nothing_to_write_skips_save(self, mock_worker, mock_record,
+                                         mock_save):
+        """Nothing should be saved if every book failed."""
+        mock_worker.side_effect = self.fake_worker({1: None})
+        ligrarian.run_batch([{'n': 1}], {'path': 'path'})
+
+        mock_save.assert_not_called()
+
+    @mock.patch('ligrarian.submit_parse')
+    def test_pages_parsed_as_results_arrive(self, mock_submit, mock_worker,
+                                            mock_record, mock_save):
+        """A page should start parsing before the other books finish."""
+        parsing_started = []
+
+        def worker(settings, jobs, results):
+            results.put((1, jobs.get()[1], ('one', [], '<html>')))
+            for _ in range(100):
+                if mock_submit.called:
+                    break
+                ligrarian.time.sleep(0.01)
+            parsing_started.append(mock_submit.called)
+            results.put((2, jobs.get()[1], self.two))
+            results.put(None)
+
+        mock_worker.side_effect = worker
+        ligrarian.run_batch([{'n': 1}, {'n': 2}], {'path': 'path'})
+
+        assert parsing_started == [True]
+        assert mock_submit.call_args_list[0] == mock.call('<html>',
+                                                          in_pool=True)
+
+    @mock.patch('ligrarian.submit_parse',
+                side_effect=[None, KeyboardInterrupt])
+    def test_save_error_does_not_hide_error(self, mock_submit, mock_worker,
+                                            mock_record, mock_save, capsys):
+        """Saving completed books after an error shouldn't replace it."""
+        mock_worker.side_effect = self.fake_worker({1: self.one,
+                                                    2: self.two})
+        mock_save.side_effect = OSError('disk full')
+
+        with pytest.raises(KeyboardInterrupt):
+            ligrarian.run_batch([{'n': 1}, {'n': 2}], {'path': 'path'})
+
+        assert 'Failed to save the completed books: disk full' in \
+            capsys.readouterr().out
+
+    def test_unattempted_books_reported(self, mock_worker, mock_record,
+                                        mock_save, capsys):
+        """Books no worker took should be reported as never attempted."""
+        mock_worker.side_effect = lambda settings, jobs, results: \
+            results.put(None)
+        ligrarian.run_batch([{'url': 'one'}, {'search': 'two'}],
+                            {'path': 'path'})
+        out = capsys.readouterr().out
+
+        assert 'Book 1 (one) was never attempted.' in out
+        assert 'Book 2 (two) was never attempted.' in out
+        assert 'completed 0 of 2' in out
+
+
+@mock.patch('ligrarian.ensure_year_sheet')
+@mock.patch('ligrarian.write_rows')
+class TestInputInfos:
+    """Records grouped by year, year sheets created once, one save."""
+
+    def record(self, title, date):
+        """Return an (info, date) record for a book."""
+        return ({'title': title, 'author': 'a', 'pages': 1,
+                 'category': 'c', 'genre': 'g'}, date)
+
+    def test_rows_grouped_by_sheet(self, mock_write, mock_ensure):
+        """Year sheets get their year's rows and Overall gets them all."""
+        mock_workbook = mock.MagicMock()
+        mock_workbook.__getitem__.side_effect = lambda name: name
+        records = [self.record('a', '01/01/2019'),
+                   self.record('b', '01/01/2020'),
+                   self.record('c', '02/01/2019')]
+        ligrarian.input_infos(mock_workbook, records, 'path')
+        written = {call[0][0]: [row[0] for row in call[0][1]]
+                   for call in mock_write.call_args_list}
+
+        assert written == {'Overall': ['a', 'b', 'c'], '2019': ['a', 'c'],
+                           '2020': ['b']}
+
+    def test_year_sheets_ensured_once_in_order(self, mock_write,
+                                               mock_ensure):
+        """Each year sheet should be ensured once, oldest first."""
+        mock_workbook = mock.MagicMock()
+        records = [self.record('a', '01/01/2020'),
+                   self.record('b', '01/01/2019'),
+                   self.record('c', '02/01/2020')]
+        ligrarian.input_infos(mock_workbook, records, 'path')
+
+        assert mock_ensure.call_args_list == [
+                mock.call(mock_workbook, '2019'),
+                mock.call(mock_workbook, '2020')
+        ]
+
+    def test_workbook_saved_once(self, mock_write, mock_ensure):
+        """The workbook should be saved once to path."""
+        mock_workbook = mock.MagicMock()
+        ligrarian.input_infos(mock_workbook,
+                              [self.record('a', '01/01/2020')] * 3, 'path')
+
+        mock_workbook.save.assert_called_once_with('path')
+
+
+class TestAppendRowsXlsx:
+    """Rows are streamed into sheet parts, leaving other parts untouched."""
+
+    row = ['Cannery Row', 'John Steinbeck', 181, 'Fiction', 'Classics',
+           '01/02/2018']
+
+    @pytest.fixture
+    def workbook_path(self, tmp_path):
+        """Return the path to a copy of the template workbook."""
+        path = str(tmp_path / 'Ligrarian.xlsx')
+        shutil.copy(WORKBOOK, path)
+        return path
+
+    def test_rows_appended_after_last_row(self, workbook_path):
+        """Rows should be written in order below the header row."""
+        ligrarian.append_rows_xlsx(workbook_path, {'2018': [self.row]})
+        ligrarian.append_rows_xlsx(workbook_path, {'2018': [self.row[::-1]]})
+        sheet = openpyxl.load_workbook(workbook_path)['2018']
+
+        assert [cell.value for cell in sheet[2]][:6] == self.row
+        assert [cell.value for cell in sheet[3]][:6] == self.row[::-1]
+
+    def test_other_parts_unchanged(self, workbook_path):
+        """Only the modified sheet's part should differ."""
+        ligrarian.append_rows_xlsx(workbook_path, {'2018': [self.row]})
+        with zipfile.ZipFile(WORKBOOK) as original, \
+                zipfile.ZipFile(workbook_path) as modified:
+            changed = [name for name in original.namelist()
+                       if original.read(name) != modified.read(name)]
+
+        assert changed == ['xl/worksheets/sheet2.xml']
+
+    def test_missing_sheet_raises(self, workbook_path):
+        """A sheet that doesn't exist should raise KeyError."""
+        with pytest.raises(KeyError):
+            ligrarian.append_rows_xlsx(workbook_path, {'2020': [self.row]})
+
+    def test_row_created_between_rows(self):
+        """A missing row should be created before the next existing row."""
+        xml = ('<worksheet><sheetData><row r="1"><c r="A1"><v>1</v></c>'
+               '</row><row r="3"><c r="H3" s="2"/></row></sheetData>'
+               '</worksheet>')
+        xml = ligrarian.append_rows_to_sheet_xml(xml, [[5], [6]])
+
+        assert ('<row r="2"><c r="A2"><v>5</v></c></row><row r="3">'
+                '<c r="A3"><v>6</v></c><c r="H3" s="2"/></row>') in xml
+
+    def test_rows_appended_after_gap(self):
+        """Rows should go below the last filled row, not into a gap."""
+        xml = '<worksheet><sheetData>{}</sheetData></worksheet>'.format(
+            ''.join('<row r="{0}"><c r="A{0}"><v>{0}</v></c></row>'.format(row)
+                    for row in (1, 2, 3, 5, 6)))
+        xml = ligrarian.append_rows_to_sheet_xml(xml, [[7], [8]])
+
+        assert '<c r="A5"><v>5</v></c>' in xml
+        assert '<row r="4">' not in xml
+        assert ('<row r="7"><c r="A7"><v>7</v></c></row>'
+                '<row r="8"><c r="A8"><v>8</v></c></row>') in xml
+
+    def test_write_records_streams_to_existing_sheets(self, workbook_path):
+        """Records for existing year sheets should be streamed in order."""
+        info = dict(zip(['title', 'author', 'pages', 'category', 'genre'],
+                        self.row))
+        with mock.patch('ligrarian.input_infos') as mock_input:
+            ligrarian.write_records(workbook_path, [(info, '01/02/2018'),
+                                                    (info, '02/02/2018')])
+        workbook = openpyxl.load_workbook(workbook_path)
+
+        mock_input.assert_not_called()
+        assert workbook['Overall']['F3'].value == '02/02/2018'
+        assert workbook['2018']['F3'].value == '02/02/2018'
+
+    @mock.patch('ligrarian.input_infos')
+    def test_write_records_falls_back_without_year_sheet(
+            self, mock_input, workbook_path):
+        """A missing year sheet should be created by loading the workbook."""
+        info = dict(zip(['title', 'author', 'pages', 'category', 'genre'],
+                        self.row))
+        ligrarian.write_records(workbook_path, [(info, '01/02/2020')])
+
+        mock_input.assert_called_once()
+        assert mock_input.call_args[0][1:] == ([(info, '01/02/2020')],
+                                               workbook_path)
+
+
+class TestPrepareSpreadsheet:
+    """The year sheet is created ahead of the book's row being saved."""
+
+    @pytest.fixture
+    def settings(self, tmp_path):
+        """Return settings using a copy of the workbook and no history."""
+        path = str(tmp_path / 'Ligrarian.xlsx')
+        shutil.copy(WORKBOOK, path)
+        return {'path': path, 'history': ''}
+
+    def test_missing_year_sheet_not_saved(self, settings):
+        """A missing year sheet should be created without saving it."""
+        with open(settings['path'], 'rb') as workbook_file:
+            original = workbook_file.read()
+        workbook = ligrarian.prepare_spreadsheet(settings, '2019')
+
+        assert '2019' in workbook.sheetnames
+        with open(settings['path'], 'rb') as workbook_file:
+            assert workbook_file.read() == original
+
+    def test_prepared_workbook_saved_with_row(self, settings):
+        """The prepared year sheet should be saved along with the row."""
+        info = {'title': 'Title', 'author': 'Author', 'pages': 100,
+                'category': 'Fiction', 'genre': 'Classics'}
+        workbook = ligrarian.prepare_spreadsheet(settings, '2019')
+        ligrarian.save_records(settings, [(info, '01/02/2019')], workbook)
+        saved = openpyxl.load_workbook(settings['path'])
+
+        assert saved['2019']['A2'].value == 'Title'
+        assert saved['Overall']['F2'].value == '01/02/2019'
+
+    @mock.patch('ligrarian.check_year_sheet_exists')
+    def test_existing_year_sheet_not_loaded(self, mock_check, settings):
+        """An existing year sheet shouldn't need the workbook loaded."""
+        assert ligrarian.prepare_spreadsheet(settings, '2018') is None
+
+        mock_check.assert_not_called()